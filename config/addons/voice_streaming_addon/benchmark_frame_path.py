@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Allocation benchmark for the add-on's per-frame path.
+
+Feeds 20ms frames through what encode_to_mp3 does for every frame (a
+visualization message, an MP3 encode and a ring append) twice: once the way
+it used to copy (to_ndarray(), bytes concatenation, bytes(packet) joins)
+and once through plane_view(), pack_audio_data() and the pooled
+MP3FrameRing slots.
+
+tracemalloc only traces memory allocated through Python and numpy, not
+libav's own frame and packet buffers, which both paths share. It also sees
+live blocks rather than individual malloc calls, so for each frame it
+reports the peak of traced memory above the steady state: the copies and
+temporaries the frame caused, whether or not they were freed again.
+
+Usage: python benchmark_frame_path.py [--frames 500] [--ring 1500]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import av
+import numpy as np
+
+from src.webrtc_server import (
+    AUDIO_DATA_HEADER,
+    MSG_AUDIO_DATA,
+    MP3FrameRing,
+    MP3StreamEncoder,
+    pack_audio_data,
+    plane_view,
+)
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960  # 20ms, what aiortc's Opus decoder produces
+FRAME_BYTES = SAMPLES_PER_FRAME * 2 * 2  # stereo s16
+
+
+def make_frames(count):
+    """Generate stereo s16 frames of a 440Hz tone"""
+    frames = []
+    for i in range(count):
+        t = (np.arange(SAMPLES_PER_FRAME) + i * SAMPLES_PER_FRAME) / SAMPLE_RATE
+        tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+        interleaved = np.repeat(tone, 2).reshape(1, -1)
+        frame = av.AudioFrame.from_ndarray(interleaved, format="s16", layout="stereo")
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = i * SAMPLES_PER_FRAME
+        frames.append(frame)
+    return frames
+
+
+class CopyingRing:
+    """The ring as it stored chunks before, one bytes object per slot"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._chunks = [b""] * capacity
+        self.write_seq = 0
+
+    def append(self, data):
+        self._chunks[self.write_seq % self.capacity] = data
+        self.write_seq += 1
+
+
+def copying_step(stream_id, frame, encoder, ring):
+    audio_array = frame.to_ndarray()
+    samples = audio_array.reshape(-1)[::100]
+    rms = np.sqrt(np.mean(np.square(samples, dtype=np.float32))) / 32768.0
+    level = int(np.clip((20 * np.log10(rms + 1e-9) + 90) * (255 / 90), 0, 255))
+    stream_bytes = stream_id.encode()
+    header = AUDIO_DATA_HEADER.pack(
+        MSG_AUDIO_DATA, level, len(samples), time.time(), len(stream_bytes)
+    )
+    message = header + stream_bytes + (samples >> 8).astype(np.int8).tobytes()
+
+    packets, _ = encoder.encode(frame)
+    if packets:
+        ring.append(b"".join(bytes(packet) for packet in packets))
+    return message
+
+
+def view_step(stream_id, frame, encoder, ring):
+    message = pack_audio_data(stream_id, plane_view(frame)[::100], time.time())
+
+    packets, duration = encoder.encode(frame)
+    if packets:
+        ring.append(packets, duration)
+    return message
+
+
+def run(name, step, ring, frames, warmup):
+    stream_id = "benchmark"
+    encoder = MP3StreamEncoder()
+    # Fill the ring once, as a stream that has been live for a while would
+    for frame in frames[:warmup]:
+        step(stream_id, frame, encoder, ring)
+
+    tracemalloc.start()
+    peaks = []
+    for frame in frames[warmup:]:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        message = step(stream_id, frame, encoder, ring)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        del message
+    tracemalloc.stop()
+
+    measured = len(frames) - warmup
+    peak = sum(peaks) / measured
+    return {
+        "path": name,
+        "frames": measured,
+        "peak_bytes_per_frame": round(peak),
+        # Peak traced memory in units of one decoded 20ms frame
+        "frame_copies": round(peak / FRAME_BYTES, 2),
+        "max_peak_bytes": max(peaks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument(
+        "--ring", type=int, default=1500, help="ring slots, 50 per second"
+    )
+    args = parser.parse_args()
+
+    # Enough warm-up frames to wrap the ring, so slots are being reused
+    warmup = args.ring + 50
+    frames = make_frames(warmup + args.frames)
+    results = [
+        run("copying", copying_step, CopyingRing(args.ring), frames, warmup),
+        run("views_and_pooled_ring", view_step, MP3FrameRing(args.ring), frames, warmup),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
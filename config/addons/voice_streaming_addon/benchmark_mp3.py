@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the add-on MP3 encoding path.
+
+Compares the legacy per-frame pydub export (one ffmpeg process and one
+complete MP3 file per 20ms frame) with the persistent in-process
+MP3StreamEncoder. Reports frames/sec and the CPU share one real-time
+stream needs on this host.
+
+The add-on no longer depends on pydub; install it (and ffmpeg) separately
+for the comparison, or pass --skip-pydub.
+
+Usage: python benchmark_mp3.py [--frames 500] [--skip-pydub]
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+
+import av
+import numpy as np
+
+from src.webrtc_server import MP3StreamEncoder
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960  # 20ms, what aiortc's Opus decoder produces
+FRAME_SECONDS = SAMPLES_PER_FRAME / SAMPLE_RATE
+
+
+def make_frames(count):
+    """Generate stereo s16 frames of a 440Hz tone"""
+    frames = []
+    for i in range(count):
+        t = (np.arange(SAMPLES_PER_FRAME) + i * SAMPLES_PER_FRAME) / SAMPLE_RATE
+        tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+        interleaved = np.repeat(tone, 2).reshape(1, -1)
+        frame = av.AudioFrame.from_ndarray(interleaved, format="s16", layout="stereo")
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = i * SAMPLES_PER_FRAME
+        frames.append(frame)
+    return frames
+
+
+def encode_pydub(frames):
+    from pydub import AudioSegment
+
+    for frame in frames:
+        audio_array = frame.to_ndarray()
+        audio_segment = AudioSegment(
+            audio_array.tobytes(),
+            frame_rate=frame.sample_rate,
+            sample_width=audio_array.dtype.itemsize,
+            channels=len(frame.layout.channels),
+        )
+        mp3_buffer = io.BytesIO()
+        audio_segment.export(mp3_buffer, format="mp3", bitrate="128k")
+        mp3_buffer.getvalue()
+
+
+def encode_streaming(frames):
+    encoder = MP3StreamEncoder()
+    for frame in frames:
+        encoder.encode(frame)
+
+
+def run(name, func, frames):
+    # pydub shells out to ffmpeg, so count child CPU time as well
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_children = _children_cpu()
+    func(frames)
+    wall = time.perf_counter() - start_wall
+    cpu = (time.process_time() - start_cpu) + (_children_cpu() - start_children)
+
+    audio_seconds = len(frames) * FRAME_SECONDS
+    return {
+        "path": name,
+        "frames": len(frames),
+        "wall_seconds": round(wall, 3),
+        "frames_per_second": round(len(frames) / wall, 1),
+        # CPU seconds spent per second of audio = fraction of a core per stream
+        "cpu_per_stream": round(cpu / audio_seconds, 4),
+        "max_streams_per_core": round(audio_seconds / cpu, 1) if cpu else None,
+    }
+
+
+def _children_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument(
+        "--skip-pydub", action="store_true", help="only benchmark the new encoder"
+    )
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames)
+    results = []
+    if not args.skip_pydub:
+        results.append(run("pydub_export", encode_pydub, frames))
+    results.append(run("mp3_stream_encoder", encode_streaming, frames))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ CONFIG_PATH="/data/options.json"
 SSL_ENABLED=$(jq -r '.ssl // false' $CONFIG_PATH)
 CERTFILE=$(jq -r '.certfile // "fullchain.pem"' $CONFIG_PATH)
 KEYFILE=$(jq -r '.keyfile // "privkey.pem"' $CONFIG_PATH)
+export MP3_PREROLL_MS=$(jq -r '.mp3_stream.preroll_ms // 500' $CONFIG_PATH)
+export MP3_BUFFER_SECONDS=$(jq -r '.mp3_stream.buffer_seconds // 30' $CONFIG_PATH)
 
 # Start the Python WebRTC server
 echo "Starting Voice Streaming Server..."
@@ -1,24 +1,90 @@
 import asyncio
-import io
+import fractions
 import json
 import logging
+import math
+import os
+import struct
+import time
 import uuid
-from typing import Dict, Optional
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Dict, Optional
 
+import av
 import numpy as np
 from aiohttp import WSMsgType, web
 from aiohttp.web_ws import WebSocketResponse
 from aiortc import (
     MediaStreamTrack,
-    RTCIceCandidate,
     RTCPeerConnection,
     RTCSessionDescription,
 )
 from aiortc.contrib.media import MediaRelay
-from pydub import AudioSegment
+from aiortc.sdp import candidate_from_sdp
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long signaling waits for ICE gathering before sending SDP
+ICE_GATHERING_TIMEOUT = 2.0
+
+# WebSocket sub-protocol for binary visualization frames. Clients that do not
+# negotiate it keep receiving JSON audio_data messages.
+VIZ_BINARY_PROTOCOL = "voice-viz.v1"
+
+# Binary audio_data layout (network byte order): message type, RMS level
+# (dBFS -90..0 mapped to 0..255), sample count N, wall-clock timestamp in
+# seconds, stream id length L, then L bytes of stream id and N int8 samples.
+MSG_AUDIO_DATA = 0x02
+AUDIO_DATA_HEADER = struct.Struct("!BBHdB")
+
+# numpy dtype per PyAV sample format, planar or packed
+SAMPLE_DTYPES = {
+    "u8": np.uint8,
+    "s16": np.int16,
+    "s32": np.int32,
+    "flt": np.float32,
+    "dbl": np.float64,
+}
+
+
+def plane_view(frame: av.AudioFrame, plane: int = 0) -> np.ndarray:
+    """Samples of one plane of a frame as a view of the frame's own buffer.
+
+    Packed audio interleaves all channels in plane 0. Unlike to_ndarray(),
+    which stacks the planes into a new array, nothing is copied.
+    """
+    count = frame.samples
+    if not frame.format.is_planar:
+        count *= len(frame.layout.channels)
+    return np.frombuffer(
+        frame.planes[plane],
+        dtype=SAMPLE_DTYPES[frame.format.name.rstrip("p")],
+        count=count,
+    )
+
+
+async def wait_for_ice_gathering(pc: RTCPeerConnection, timeout: float):
+    """Wait until ICE gathering is complete, or at most `timeout` seconds"""
+    if pc.iceGatheringState == "complete":
+        return
+
+    gathered = asyncio.Event()
+
+    def on_gathering_state_change():
+        if pc.iceGatheringState == "complete":
+            gathered.set()
+
+    pc.on("icegatheringstatechange", on_gathering_state_change)
+    try:
+        await asyncio.wait_for(gathered.wait(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"ICE gathering not complete after {timeout}s, sending SDP anyway"
+        )
+    finally:
+        pc.remove_listener("icegatheringstatechange", on_gathering_state_change)
+
 
 class MP3StreamTrack(MediaStreamTrack):
     """Track that buffers audio for MP3 streaming"""
@@ -51,39 +117,388 @@ class MP3StreamTrack(MediaStreamTrack):
             self._task.cancel()
 
 
-class VoiceStreamingServer:
+def pack_audio_data(
+    stream_id: str, samples: np.ndarray, timestamp: float
+) -> bytearray:
+    """Pack an int16 waveform snapshot into a binary audio_data message.
+
+    The message is allocated once at its final size and filled in place,
+    so `samples` may be a strided view straight into the frame.
+    """
+    rms = np.sqrt(np.mean(np.square(samples, dtype=np.float32))) / 32768.0
+    # Plain floats from here, numpy scalars would allocate for every step
+    level = min(max(int((20 * math.log10(rms + 1e-9) + 90) * (255 / 90)), 0), 255)
+    stream_bytes = stream_id.encode()
+    offset = AUDIO_DATA_HEADER.size + len(stream_bytes)
+    message = bytearray(offset + len(samples))
+    AUDIO_DATA_HEADER.pack_into(
+        message, 0, MSG_AUDIO_DATA, level, len(samples), timestamp, len(stream_bytes)
+    )
+    message[AUDIO_DATA_HEADER.size : offset] = stream_bytes
+    # Keep the top byte of each sample, plenty for drawing a waveform
+    np.right_shift(
+        samples,
+        8,
+        out=np.frombuffer(message, dtype=np.int8, offset=offset),
+        casting="unsafe",
+    )
+    return message
+
+
+class MP3FrameRing:
+    """Fixed-capacity ring of encoded MP3 chunks with per-listener read cursors.
+
+    Each slot holds one encoder output (which always starts on an MP3 frame
+    boundary) together with its duration. Writers overwrite the oldest slot in
+    place, and readers track an absolute sequence number, so neither side ever
+    copies the backlog.
+
+    Slots are bytearrays that the encoder's packets are copied into directly.
+    A slot only grows, so once the ring has wrapped, appending allocates
+    nothing. Readers copy out in read(), before the slot can be reused.
+    """
+
+    def __init__(self, capacity: int = 1500):
+        self.capacity = capacity
+        self._slots = [bytearray() for _ in range(capacity)]
+        self._lengths = [0] * capacity
+        self._durations = [0.0] * capacity
+        self.write_seq = 0  # sequence number of the next chunk to be written
+        self.closed = False
+        self._data_ready = asyncio.Event()
+
+    @property
+    def oldest_seq(self) -> int:
+        return max(0, self.write_seq - self.capacity)
+
+    def append(self, packets, duration: float):
+        """Copy one encoder output, a list of av.Packet, into the next slot"""
+        slot = self.write_seq % self.capacity
+        size = 0
+        for packet in packets:
+            size += packet.size
+        buffer = self._slots[slot]
+        if len(buffer) < size:
+            buffer = self._slots[slot] = bytearray(size)
+        offset = 0
+        for packet in packets:
+            end = offset + packet.size
+            buffer[offset:end] = packet
+            offset = end
+        self._lengths[slot] = size
+        self._durations[slot] = duration
+        self.write_seq += 1
+        # Wakes every current waiter; clearing right away does not undo that
+        self._data_ready.set()
+        self._data_ready.clear()
+
+    def close(self):
+        self.closed = True
+        self._data_ready.set()
+
+    def preroll_cursor(self, seconds: float) -> int:
+        """Cursor that starts roughly `seconds` before the live edge"""
+        cursor = self.write_seq
+        buffered = 0.0
+        while cursor > self.oldest_seq and buffered < seconds:
+            cursor -= 1
+            buffered += self._durations[cursor % self.capacity]
+        return cursor
+
+    def read(self, cursor: int):
+        """Return (data, next_cursor) for everything written since `cursor`"""
+        # Listeners that fell behind the ring resume at the oldest chunk
+        cursor = max(cursor, self.oldest_seq)
+        end = self.write_seq
+        data = b"".join(
+            memoryview(self._slots[slot])[: self._lengths[slot]]
+            for slot in (seq % self.capacity for seq in range(cursor, end))
+        )
+        return data, end
+
+    async def wait(self, cursor: int):
+        """Wait until there is data past `cursor` or the ring is closed"""
+        while cursor >= self.write_seq and not self.closed:
+            await self._data_ready.wait()
+
+
+class MP3StreamEncoder:
+    """Long-lived in-process MP3 encoder for one stream.
+
+    The resampler and codec context are created once and carry their state
+    across frames, so each 20ms WebRTC frame only costs a resample and an
+    incremental encode instead of writing a complete MP3 file through ffmpeg.
+    """
+
+    def __init__(
+        self, bit_rate: int = 128000, sample_rate: int = 48000, layout: str = "stereo"
+    ):
+        self.sample_rate = sample_rate
+        self.codec_context = av.CodecContext.create("mp3", "w")
+        self.codec_context.bit_rate = bit_rate
+        self.codec_context.sample_rate = sample_rate
+        self.codec_context.format = av.AudioFormat("s16p")
+        self.codec_context.layout = layout
+        self.codec_context.time_base = fractions.Fraction(1, sample_rate)
+        self.codec_context.open()
+
+        # Resampler to ensure compatible format for the MP3 encoder
+        self.resampler = av.AudioResampler(
+            format="s16p", layout=layout, rate=sample_rate
+        )
+
+    def encode(self, frame: av.AudioFrame):
+        """Encode one frame, returning (packets, duration_seconds).
+
+        The encoder buffers internally, so a call may return no packets and a
+        later one several MP3 frames. Output always starts on a frame boundary.
+        The av.Packets are handed out as they are, without copying them to
+        bytes; MP3FrameRing.append() copies them into a pooled slot.
+        """
+        packets = []
+        for resampled in self.resampler.resample(frame):
+            packets.extend(self.codec_context.encode(resampled))
+        if not packets:
+            return packets, 0.0
+        frame_size = self.codec_context.frame_size
+        samples = 0
+        for packet in packets:
+            samples += packet.duration or frame_size
+        return packets, samples / self.sample_rate
+
+
+class ConnectionState(Enum):
+    NEGOTIATING = "negotiating"  # peer connection created, SDP and ICE under way
+    CONNECTED = "connected"  # ICE connected, media can flow
+    CLOSED = "closed"  # socket gone, being cleaned up
+
+
+class StreamState(Enum):
+    LIVE = "live"
+    ENDED = "ended"  # removed from the registry
+
+
+class SubscriptionState(Enum):
+    PENDING = "pending"  # subscribed, the peer connection is not up yet
+    ACTIVE = "active"
+    CLOSED = "closed"  # unsubscribed, or the stream ended
+
+
+@dataclass(slots=True, eq=False)
+class Connection:
+    """A sender's or receiver's WebSocket and peer connection.
+
+    Slotted, so a mistyped field fails at once instead of adding a dict key.
+    """
+
+    connection_id: str
+    role: str  # "sender" or "receiver"
+    ws: WebSocketResponse
+    pc: RTCPeerConnection
+    stream_id: Optional[str] = None
+    # Receivers that negotiated VIZ_BINARY_PROTOCOL
+    binary_viz: bool = False
+    state: ConnectionState = ConnectionState.NEGOTIATING
+
+
+@dataclass(slots=True, eq=False)
+class Stream:
+    stream_id: str
+    track: MediaStreamTrack
+    sender_id: str
+    state: StreamState = StreamState.LIVE
+    created_at: float = field(default_factory=time.monotonic)
+    last_activity: float = field(default_factory=time.monotonic)
+
+
+@dataclass(slots=True, eq=False)
+class Subscription:
+    kind: str
+    stream_id: str
+    subscriber_id: str
+    state: SubscriptionState = SubscriptionState.PENDING
+
+
+class StreamRegistry:
+    """Published streams with O(1) latest-stream and per-stream subscriber lookups.
+
+    Streams are kept in an insertion-ordered dict, so the newest one is read
+    with reversed() instead of list(keys()). Subscribers are indexed per kind
+    as a set per stream plus a reverse subscriber -> stream map. Listeners
+    registered with on() get "added", "removed", "subscribed" and
+    "unsubscribed" events. Removed streams and dropped subscriptions are
+    moved to their ENDED and CLOSED states.
+    """
+
     def __init__(self):
+        self._streams: Dict[str, Stream] = {}  # oldest first
+        # kind -> stream_id -> subscriber ids
+        self._subscribers: Dict[str, Dict[str, set]] = {}
+        # kind -> subscriber id -> subscription
+        self._subscribed_to: Dict[str, Dict[str, Subscription]] = {}
+        self._listeners: Dict[str, list] = {}
+
+    def __len__(self):
+        return len(self._streams)
+
+    def __contains__(self, stream_id):
+        return stream_id in self._streams
+
+    def __iter__(self):
+        return iter(self._streams)
+
+    def ids(self):
+        return list(self._streams)
+
+    def items(self):
+        return self._streams.items()
+
+    def get(self, stream_id: Optional[str]) -> Optional[Stream]:
+        return self._streams.get(stream_id)
+
+    def latest(self) -> Optional[str]:
+        """Id of the most recently published stream"""
+        return next(reversed(self._streams), None)
+
+    def resolve(self, stream_id: Optional[str] = None) -> Optional[str]:
+        """The requested stream id if published, the latest one if None"""
+        if not stream_id:
+            return self.latest()
+        return stream_id if stream_id in self._streams else None
+
+    def add(self, stream: Stream) -> Stream:
+        stream.last_activity = time.monotonic()
+        self._streams[stream.stream_id] = stream
+        self._emit("added", stream.stream_id, stream)
+        return stream
+
+    def remove(self, stream_id: str) -> Optional[Stream]:
+        stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return None
+        stream.state = StreamState.ENDED
+        for kind, streams in self._subscribers.items():
+            for subscriber_id in streams.pop(stream_id, ()):
+                self._subscribed_to[kind].pop(subscriber_id).state = (
+                    SubscriptionState.CLOSED
+                )
+        self._emit("removed", stream_id, stream)
+        return stream
+
+    def touch(self, stream_id: str):
+        """Record activity (e.g. a frame) on a stream"""
+        stream = self._streams.get(stream_id)
+        if stream is not None:
+            stream.last_activity = time.monotonic()
+
+    def idle_for(self, stream_id: str) -> float:
+        return time.monotonic() - self._streams[stream_id].last_activity
+
+    # Subscriptions
+
+    def subscribe(
+        self, kind: str, stream_id: str, subscriber_id: str
+    ) -> Optional[Subscription]:
+        """Subscribe to one stream of this kind, leaving any previous one"""
+        if stream_id not in self._streams:
+            return None
+        current = self._subscribed_to.get(kind, {}).get(subscriber_id)
+        if current is not None and current.stream_id == stream_id:
+            return current
+        self.unsubscribe(kind, subscriber_id)
+        self._subscribers.setdefault(kind, {}).setdefault(stream_id, set()).add(
+            subscriber_id
+        )
+        subscription = Subscription(kind, stream_id, subscriber_id)
+        self._subscribed_to.setdefault(kind, {})[subscriber_id] = subscription
+        self._emit("subscribed", stream_id, kind, subscriber_id)
+        return subscription
+
+    def unsubscribe(self, kind: str, subscriber_id: str) -> Optional[str]:
+        """Leave this kind's subscription; returns the stream id it was for"""
+        subscription = self._subscribed_to.get(kind, {}).pop(subscriber_id, None)
+        if subscription is None:
+            return None
+        subscription.state = SubscriptionState.CLOSED
+        stream_id = subscription.stream_id
+        subscribers = self._subscribers[kind][stream_id]
+        subscribers.discard(subscriber_id)
+        if not subscribers:
+            del self._subscribers[kind][stream_id]
+        self._emit("unsubscribed", stream_id, kind, subscriber_id)
+        return stream_id
+
+    def unsubscribe_all(self, subscriber_id: str):
+        for kind in list(self._subscribed_to):
+            self.unsubscribe(kind, subscriber_id)
+
+    def subscribers(self, kind: str, stream_id: str):
+        """Subscriber ids of a stream; treat the returned set as read-only"""
+        return self._subscribers.get(kind, {}).get(stream_id, frozenset())
+
+    def subscription(self, kind: str, subscriber_id: str) -> Optional[Subscription]:
+        return self._subscribed_to.get(kind, {}).get(subscriber_id)
+
+    # Events
+
+    def on(self, event: str, callback: Callable):
+        self._listeners.setdefault(event, []).append(callback)
+
+    def _emit(self, event: str, *args):
+        for callback in self._listeners.get(event, ()):
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Stream registry {event} listener failed: {e}")
+
+
+class VoiceStreamingServer:
+    def __init__(
+        self,
+        mp3_preroll_ms: int = 500,
+        mp3_buffer_seconds: int = 30,
+        ice_gathering_timeout: float = ICE_GATHERING_TIMEOUT,
+    ):
         self.app = web.Application()
+        self.ice_gathering_timeout = ice_gathering_timeout
         self.setup_routes()
 
         # Connection management
-        self.senders: Dict[str, dict] = {}  # sender_id → {ws, pc, track, stream_id}
-        self.receivers: Dict[str, dict] = {}  # receiver_id → {ws, pc, stream_id}
-        self.active_streams: Dict[str, MediaStreamTrack] = {}  # stream_id → audio_track
+        self.senders: Dict[str, Connection] = {}  # sender_id → connection
+        self.receivers: Dict[str, Connection] = {}  # receiver_id → connection
+        # stream_id → Stream, with a "receivers" subscriber index
+        self.streams = StreamRegistry()
 
         # MP3 streaming
-        self.mp3_buffers: Dict[str, bytearray] = {}  # stream_id → MP3 data
+        self.mp3_buffers: Dict[str, MP3FrameRing] = {}  # stream_id → MP3 ring
+        # receiver_id → in-flight visualization send, at most one per client
+        self.viz_sends: Dict[str, asyncio.Task] = {}
+        self.viz_frames_dropped = 0
+        self.mp3_preroll_seconds = mp3_preroll_ms / 1000
+        self.mp3_buffer_seconds = mp3_buffer_seconds
         self.relay = MediaRelay()
 
     def setup_routes(self):
         self.app.router.add_get("/health", self.health_check)
         self.app.router.add_get("/ws", self.websocket_handler)
-        self.app.router.add_get("/stream/{stream_id}.mp3", self.stream_mp3)
+        # latest.mp3 must be registered first or {stream_id}.mp3 swallows it
         self.app.router.add_get("/stream/latest.mp3", self.stream_latest_mp3)
+        self.app.router.add_get("/stream/{stream_id}.mp3", self.stream_mp3)
 
     async def health_check(self, request):
-        active_streams = list(self.active_streams.keys())
+        active_streams = self.streams.ids()
         return web.json_response(
             {
                 "status": "healthy",
                 "active_streams": active_streams,
                 "senders": len(self.senders),
                 "receivers": len(self.receivers),
+                "viz_frames_dropped": self.viz_frames_dropped,
             }
         )
 
     async def websocket_handler(self, request):
-        ws = web.WebSocketResponse()
+        ws = web.WebSocketResponse(protocols=(VIZ_BINARY_PROTOCOL,))
         await ws.prepare(request)
 
         connection_id = str(uuid.uuid4())
@@ -132,12 +547,9 @@ class VoiceStreamingServer:
         pc = RTCPeerConnection()
         stream_id = f"stream_{connection_id}"
 
-        self.senders[connection_id] = {
-            "ws": ws,
-            "pc": pc,
-            "stream_id": stream_id,
-            "track": None,
-        }
+        self.senders[connection_id] = Connection(
+            connection_id, "sender", ws, pc, stream_id=stream_id
+        )
 
         @pc.on("track")
         async def on_track(track):
@@ -145,11 +557,10 @@ class VoiceStreamingServer:
                 logger.info(f"Received audio track from sender {connection_id}")
 
                 # Store the track
-                self.senders[connection_id]["track"] = track
-                self.active_streams[stream_id] = track
+                self.streams.add(Stream(stream_id, track, connection_id))
 
                 logger.info(f"Stored stream {stream_id} for sender {connection_id}")
-                logger.info(f"Active streams: {list(self.active_streams.keys())}")
+                logger.info(f"Active streams: {self.streams.ids()}")
 
                 # Broadcast stream availability
                 await self.broadcast_stream_available(stream_id)
@@ -163,6 +574,7 @@ class VoiceStreamingServer:
         async def on_ice_state_change():
             state = pc.iceConnectionState
             logger.info(f"ICE connection state for sender {connection_id}: {state}")
+            self.on_ice_state(connection_id, pc)
             if state == "completed":
                 logger.info(f"ICE connection completed for sender {connection_id}")
 
@@ -179,7 +591,16 @@ class VoiceStreamingServer:
 
         pc = RTCPeerConnection()
 
-        self.receivers[connection_id] = {"ws": ws, "pc": pc, "stream_id": stream_id}
+        self.receivers[connection_id] = Connection(
+            connection_id,
+            "receiver",
+            ws,
+            pc,
+            stream_id=stream_id,
+            binary_viz=ws.ws_protocol == VIZ_BINARY_PROTOCOL,
+        )
+        if stream_id:
+            self.streams.subscribe("receivers", stream_id, connection_id)
 
         # Don't add track yet - wait for receiver to send offer first
         # The track will be added when we receive the offer in handle_webrtc_offer
@@ -188,13 +609,29 @@ class VoiceStreamingServer:
         async def on_ice_state_change():
             state = pc.iceConnectionState
             logger.info(f"ICE connection state for receiver {connection_id}: {state}")
+            self.on_ice_state(connection_id, pc)
+
+    def on_ice_state(self, connection_id: str, pc: RTCPeerConnection):
+        """Follow ICE progress in the connection's and subscription's states"""
+        connection = self.senders.get(connection_id) or self.receivers.get(
+            connection_id
+        )
+        if connection is None or connection.pc is not pc:
+            return
+        if pc.iceConnectionState in ("connected", "completed"):
+            connection.state = ConnectionState.CONNECTED
+            subscription = self.streams.subscription("receivers", connection_id)
+            if subscription is not None:
+                subscription.state = SubscriptionState.ACTIVE
+        elif pc.iceConnectionState in ("failed", "closed"):
+            connection.state = ConnectionState.CLOSED
 
     async def handle_webrtc_offer(self, connection_id: str, data: dict):
         """Handle WebRTC offer from sender or receiver"""
         if connection_id in self.senders:
             # Offer from sender
             sender = self.senders[connection_id]
-            pc = sender["pc"]
+            pc = sender.pc
 
             offer = RTCSessionDescription(
                 sdp=data["offer"]["sdp"], type=data["offer"]["type"]
@@ -204,10 +641,9 @@ class VoiceStreamingServer:
             answer = await pc.createAnswer()
             await pc.setLocalDescription(answer)
 
-            # Wait for ICE gathering
-            await asyncio.sleep(0.5)
+            await wait_for_ice_gathering(pc, self.ice_gathering_timeout)
 
-            await sender["ws"].send_text(
+            await sender.ws.send_text(
                 json.dumps(
                     {
                         "type": "webrtc_answer",
@@ -221,12 +657,12 @@ class VoiceStreamingServer:
         elif connection_id in self.receivers:
             # Offer from receiver - add track and send answer
             receiver = self.receivers[connection_id]
-            pc = receiver["pc"]
-            stream_id = receiver["stream_id"]
+            pc = receiver.pc
+            stream_id = receiver.stream_id
 
             # Add the relayed track if stream exists
-            if stream_id and stream_id in self.active_streams:
-                source_track = self.active_streams[stream_id]
+            if stream_id and stream_id in self.streams:
+                source_track = self.streams.get(stream_id).track
                 relayed_track = self.relay.subscribe(source_track)
                 pc.addTrack(relayed_track)
                 logger.info(
@@ -241,10 +677,9 @@ class VoiceStreamingServer:
             answer = await pc.createAnswer()
             await pc.setLocalDescription(answer)
 
-            # Wait for ICE gathering
-            await asyncio.sleep(0.5)
+            await wait_for_ice_gathering(pc, self.ice_gathering_timeout)
 
-            await receiver["ws"].send_text(
+            await receiver.ws.send_text(
                 json.dumps(
                     {
                         "type": "webrtc_answer",
@@ -260,7 +695,7 @@ class VoiceStreamingServer:
         """Handle WebRTC answer from receiver"""
         if connection_id in self.receivers:
             receiver = self.receivers[connection_id]
-            pc = receiver["pc"]
+            pc = receiver.pc
 
             answer = RTCSessionDescription(
                 sdp=data["answer"]["sdp"], type=data["answer"]["type"]
@@ -272,26 +707,28 @@ class VoiceStreamingServer:
         candidate_data = data.get("candidate")
 
         if connection_id in self.senders:
-            pc = self.senders[connection_id]["pc"]
+            pc = self.senders[connection_id].pc
         elif connection_id in self.receivers:
-            pc = self.receivers[connection_id]["pc"]
+            pc = self.receivers[connection_id].pc
         else:
             return
 
-        if candidate_data:
-            candidate = RTCIceCandidate(
-                sdpMid=candidate_data.get("sdpMid"),
-                sdpMLineIndex=candidate_data.get("sdpMLineIndex"),
-                candidate=candidate_data.get("candidate"),
-            )
-            await pc.addIceCandidate(candidate)
-            logger.info(
-                f"ICE candidate received for {connection_id} (aiortc handles ICE internally)"
-            )
+        # An empty candidate string marks the end of trickling
+        if candidate_data and candidate_data.get("candidate"):
+            sdp = candidate_data["candidate"]
+            if sdp.startswith("candidate:"):
+                sdp = sdp[len("candidate:") :]
+            try:
+                candidate = candidate_from_sdp(sdp)
+                candidate.sdpMid = candidate_data.get("sdpMid")
+                candidate.sdpMLineIndex = candidate_data.get("sdpMLineIndex")
+                await pc.addIceCandidate(candidate)
+            except Exception as e:
+                logger.warning(f"Ignoring bad ICE candidate from {connection_id}: {e}")
 
     async def send_available_streams(self, ws: WebSocketResponse):
         """Send list of available streams"""
-        streams = list(self.active_streams.keys())
+        streams = self.streams.ids()
         logger.info(f"Sending available streams to {id(ws)}: {streams}")
         await ws.send_text(
             json.dumps({"type": "available_streams", "streams": streams})
@@ -305,7 +742,7 @@ class VoiceStreamingServer:
         # Send to all receivers
         for receiver in self.receivers.values():
             try:
-                await receiver["ws"].send_text(message)
+                await receiver.ws.send_text(message)
             except Exception as e:
                 logger.error(f"Failed to broadcast to receiver: {e}")
 
@@ -316,7 +753,7 @@ class VoiceStreamingServer:
 
         for receiver in self.receivers.values():
             try:
-                await receiver["ws"].send_text(message)
+                await receiver.ws.send_text(message)
             except Exception as e:
                 logger.error(f"Failed to broadcast to receiver: {e}")
 
@@ -331,11 +768,14 @@ class VoiceStreamingServer:
     async def encode_to_mp3(self, stream_id: str, track: MediaStreamTrack):
         """Encode audio track to MP3 for HTTP streaming"""
         logger.info(f"Starting MP3 encoding for {stream_id}")
-        self.mp3_buffers[stream_id] = bytearray()
+        # One ring slot per 20ms WebRTC frame
+        ring = MP3FrameRing(capacity=self.mp3_buffer_seconds * 50)
+        self.mp3_buffers[stream_id] = ring
+        encoder = MP3StreamEncoder()
 
         frame_count = 0
         try:
-            while stream_id in self.active_streams:
+            while stream_id in self.streams:
                 try:
                     frame = await asyncio.wait_for(track.recv(), timeout=2.0)
                 except asyncio.TimeoutError:
@@ -345,62 +785,81 @@ class VoiceStreamingServer:
                     continue
 
                 frame_count += 1
+                self.streams.touch(stream_id)
                 if frame_count % 50 == 0:
                     logger.info(
                         f"Proccessed {frame_count} frames for stream {stream_id}"
                     )
 
-                # Convert frame to numpy array
-                audio_array = frame.to_ndarray()
-
                 # Send visualization data (downsampled) every 5 frames
                 if frame_count % 5 == 0:
-                    # Calculate simplified visualization data (RMS or raw samples)
-                    # For now, just send a subset of samples to keep it light
-                    raw_data = np.frombuffer(audio_array.tobytes(), dtype=np.int16)
-                    # Downsample significantly for visualization
-                    vis_data = raw_data[::100].tolist()
-
-                    msg = {
-                        "type": "audio_data",
-                        "stream_id": stream_id,
-                        "data": vis_data,
-                        "timestamp": asyncio.get_event_loop().time(),
-                    }
-                    # Broadcast to all receivers of this stream (for viz)
-                    for rid, r in self.receivers.items():
-                        if r.get("stream_id") == stream_id:
-                            asyncio.create_task(r["ws"].send_json(msg))
-
-                # Convert to AudioSegment
-                audio_segment = AudioSegment(
-                    audio_array.tobytes(),
-                    frame_rate=frame.sample_rate,
-                    sample_width=audio_array.dtype.itemsize,
-                    channels=len(frame.layout.channels),
-                )
-
-                # Export to MP3
-                mp3_buffer = io.BytesIO()
-                audio_segment.export(mp3_buffer, format="mp3", bitrate="128k")
-
-                # Append to buffer (keep last 30 seconds)
-                mp3_data = mp3_buffer.getvalue()
-                self.mp3_buffers[stream_id].extend(mp3_data)
-
-                # Limit buffer size (approximately 30 seconds at 128kbps)
-                max_size = 128 * 1024 * 30 // 8  # 480KB
-                if len(self.mp3_buffers[stream_id]) > max_size:
-                    self.mp3_buffers[stream_id] = self.mp3_buffers[stream_id][
-                        -max_size:
+                    subscribers = [
+                        (rid, self.receivers[rid])
+                        for rid in self.streams.subscribers("receivers", stream_id)
                     ]
+                    if subscribers:
+                        # A view of the frame's samples, not a copy
+                        self.broadcast_viz(stream_id, plane_view(frame), subscribers)
+
+                # Encode incrementally and append to the ring, overwriting
+                # the oldest frame once full
+                packets, duration = encoder.encode(frame)
+                if packets:
+                    ring.append(packets, duration)
 
         except Exception as e:
             logger.error(f"MP3 encoding error for {stream_id}: {e}")
         finally:
-            if stream_id in self.mp3_buffers:
+            ring.close()
+            if self.mp3_buffers.get(stream_id) is ring:
                 del self.mp3_buffers[stream_id]
 
+    def broadcast_viz(self, stream_id: str, audio_array: np.ndarray, subscribers):
+        """Serialize a visualization frame once per format and fan it out.
+
+        Each client has at most one send in flight. A client that has not
+        drained the previous frame skips this one instead of queueing tasks.
+        """
+        # Downsample significantly for visualization; a strided view
+        samples = audio_array[::100]
+        timestamp = time.time()
+        binary = text = None
+
+        for rid, receiver in subscribers:
+            pending = self.viz_sends.get(rid)
+            if pending and not pending.done():
+                self.viz_frames_dropped += 1
+                continue
+
+            if receiver.binary_viz:
+                if binary is None:
+                    binary = pack_audio_data(stream_id, samples, timestamp)
+                send = receiver.ws.send_bytes(binary)
+            else:
+                if text is None:
+                    text = json.dumps(
+                        {
+                            "type": "audio_data",
+                            "stream_id": stream_id,
+                            "data": samples.tolist(),
+                            "timestamp": timestamp,
+                        }
+                    )
+                send = receiver.ws.send_str(text)
+            task = asyncio.create_task(send)
+            task.add_done_callback(lambda t, rid=rid: self._viz_send_done(rid, t))
+            self.viz_sends[rid] = task
+
+    def _viz_send_done(self, rid: str, task: asyncio.Task):
+        """Retrieve a finished send's exception and drop a client that failed"""
+        if self.viz_sends.get(rid) is task:
+            del self.viz_sends[rid]
+        if task.cancelled() or task.exception() is None:
+            return
+        # The socket is closing; stop fanning out to it until cleanup runs
+        logger.debug(f"Dropping visualization client {rid}: {task.exception()!r}")
+        self.streams.unsubscribe_all(rid)
+
     async def stream_mp3(self, request):
         """Stream MP3 audio for a specific stream"""
         stream_id = request.match_info["stream_id"]
@@ -419,15 +878,19 @@ class VoiceStreamingServer:
         )
         await response.prepare(request)
 
-        try:
-            # Send buffered data first
-            if self.mp3_buffers[stream_id]:
-                await response.write(bytes(self.mp3_buffers[stream_id]))
+        ring = self.mp3_buffers[stream_id]
+        # Start a short pre-roll behind the live edge, then follow live data
+        cursor = ring.preroll_cursor(self.mp3_preroll_seconds)
 
-            # Stream live data
-            while stream_id in self.active_streams:
-                await asyncio.sleep(0.1)
-                # In a real implementation, you'd stream new chunks here
+        try:
+            while True:
+                data, cursor = ring.read(cursor)
+                if data:
+                    await response.write(data)
+                elif ring.closed:
+                    break
+                else:
+                    await ring.wait(cursor)
 
         except Exception as e:
             logger.error(f"MP3 streaming error: {e}")
@@ -438,21 +901,18 @@ class VoiceStreamingServer:
 
     async def stream_latest_mp3(self, request):
         """Stream the latest available stream"""
-        if not self.active_streams:
+        latest_stream_id = self.streams.latest()
+        if latest_stream_id is None:
             return web.Response(status=404, text="No active streams")
 
-        # Get the latest stream
-        latest_stream_id = list(self.active_streams.keys())[-1]
-
         # Redirect to specific stream
         return web.HTTPFound(f"/stream/{latest_stream_id}.mp3")
 
     async def stop_stream(self, connection_id: str):
         """Stop a stream"""
         if connection_id in self.senders:
-            stream_id = self.senders[connection_id]["stream_id"]
-            if stream_id in self.active_streams:
-                del self.active_streams[stream_id]
+            stream_id = self.senders[connection_id].stream_id
+            if self.streams.remove(stream_id):
                 await self.broadcast_stream_ended(stream_id)
 
     async def cleanup_connection(self, connection_id: str):
@@ -461,26 +921,32 @@ class VoiceStreamingServer:
 
         if connection_id in self.senders:
             sender = self.senders[connection_id]
-            stream_id = sender["stream_id"]
+            sender.state = ConnectionState.CLOSED
+            stream_id = sender.stream_id
 
             # Remove from active streams
-            if stream_id in self.active_streams:
-                del self.active_streams[stream_id]
+            if self.streams.remove(stream_id):
                 await self.broadcast_stream_ended(stream_id)
 
             # Close peer connection
-            if sender["pc"]:
-                await sender["pc"].close()
+            if sender.pc:
+                await sender.pc.close()
 
             del self.senders[connection_id]
             logger.info(f"Sender {connection_id} cleaned up")
 
         if connection_id in self.receivers:
             receiver = self.receivers[connection_id]
+            receiver.state = ConnectionState.CLOSED
+
+            self.streams.unsubscribe_all(connection_id)
+            pending = self.viz_sends.pop(connection_id, None)
+            if pending:
+                pending.cancel()
 
             # Close peer connection
-            if receiver["pc"]:
-                await receiver["pc"].close()
+            if receiver.pc:
+                await receiver.pc.close()
 
             del self.receivers[connection_id]
             logger.info(f"Receiver {connection_id} cleaned up")
@@ -502,5 +968,11 @@ class VoiceStreamingServer:
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    server = VoiceStreamingServer()
+    server = VoiceStreamingServer(
+        mp3_preroll_ms=int(os.environ.get("MP3_PREROLL_MS", 500)),
+        mp3_buffer_seconds=int(os.environ.get("MP3_BUFFER_SECONDS", 30)),
+        ice_gathering_timeout=float(
+            os.environ.get("ICE_GATHERING_TIMEOUT", ICE_GATHERING_TIMEOUT)
+        ),
+    )
     asyncio.run(server.run_server())
@@ -12,6 +12,12 @@ _LOGGER = logging.getLogger(__name__)
 
 DOMAIN = "voice_streaming"
 STREAM_URL = "http://192.168.2.185:8081/stream/latest.mp3"
+ROOM_STREAM_URL = "http://192.168.2.185:8081/stream/room/{room}.mp3"
+# Seconds of already spoken audio a speaker starts with, from the replay ring
+DEFAULT_PREROLL = 5
+# Egress profile for speakers: mono 24kHz MP3 is all voice needs and plays
+# everywhere; pre-roll is only available on this profile
+DEFAULT_SPEAKER_PROFILE = "voice"
 
 # This integration doesn't require YAML configuration
 CONFIG_SCHEMA = cv.empty_config_schema(DOMAIN)
@@ -44,11 +50,20 @@ async def async_setup(hass: HomeAssistant, config: dict):
     async def play_on_speaker_service(call):
         """Play voice stream on a speaker."""
         entity_id = call.data.get("entity_id")
+        preroll = call.data.get("preroll", DEFAULT_PREROLL)
+        room = call.data.get("room")
+        profile = call.data.get("profile", DEFAULT_SPEAKER_PROFILE)
 
         # Use direct connection to the Audio Server (bypassing HA 8123 proxy which fails)
         # We use the known LAN IP + Port 8081
         # This avoids 404s and SSL issues for local speakers
-        url = STREAM_URL
+        url = ROOM_STREAM_URL.format(room=room) if room else STREAM_URL
+        query = [f"profile={profile}"]
+        if preroll:
+            # Start with the message that was just spoken instead of joining
+            # mid-sentence; the speaker then plays that far behind live
+            query.append(f"preroll={preroll}")
+        url = f"{url}?{'&'.join(query)}"
 
         _LOGGER.info(f"Playing stream on {entity_id} from {url}")
 
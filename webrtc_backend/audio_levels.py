@@ -0,0 +1,219 @@
+"""
+Server-side level meter and spectrum for a stream.
+
+Frames are collected into a short window and analysed in one batch: a single
+mono mix, RMS, peak and a real FFT folded into log-spaced bands. The result
+is packed into a small binary WebSocket message so clients can draw meters
+without running their own Web Audio analyser.
+
+Binary ``audio_levels`` message layout (network byte order):
+
+    uint8   message type (MSG_AUDIO_LEVELS)
+    uint8   band count N
+    uint16  sequence number (wraps)
+    uint32  server timestamp in ms (wraps)
+    uint8   stream id length L
+    L bytes stream id (utf-8)
+    uint8   RMS level
+    uint8   peak level
+    N bytes band levels, low to high frequency
+
+Levels are dBFS mapped linearly from [-LEVEL_FLOOR_DB, 0] onto [0, 255].
+
+Frames are read through plane_view(), a numpy view of the frame's own
+buffer, and summed into scratch arrays kept per analyser, so the per-frame
+path does not copy samples the way AudioFrame.to_ndarray() does.
+"""
+
+import struct
+import time
+
+import numpy as np
+
+MSG_AUDIO_LEVELS = 0x01
+LEVELS_HEADER = struct.Struct("!BBHIB")
+
+LEVEL_FLOOR_DB = 90.0
+_EPSILON = 1e-10
+
+# numpy dtype per PyAV sample format, planar or packed
+SAMPLE_DTYPES = {
+    "u8": np.uint8,
+    "s16": np.int16,
+    "s32": np.int32,
+    "flt": np.float32,
+    "dbl": np.float64,
+}
+
+
+def plane_view(frame, plane=0):
+    """Samples of one plane of an AudioFrame as a view of the frame's buffer.
+
+    Packed audio interleaves all channels in plane 0; planar audio has one
+    channel per plane. Unlike to_ndarray() nothing is copied, and the view
+    keeps the frame's buffer alive for as long as it is referenced.
+    """
+    sample_format = frame.format
+    count = frame.samples
+    if not sample_format.is_planar:
+        count *= len(frame.layout.channels)
+    return np.frombuffer(
+        frame.planes[plane],
+        dtype=SAMPLE_DTYPES[sample_format.name.rstrip("p")],
+        count=count,
+    )
+
+
+def _full_scale(sample_format):
+    if sample_format.startswith("s16"):
+        return 32768.0
+    if sample_format.startswith("s32"):
+        return 2147483648.0
+    return 1.0
+
+
+def to_level_bytes(db):
+    """Map dBFS values onto 0..255"""
+    scaled = (np.asarray(db, dtype=np.float32) + LEVEL_FLOOR_DB) * (
+        255.0 / LEVEL_FLOOR_DB
+    )
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def pack_audio_levels(stream_id, sequence, rms_db, peak_db, band_db):
+    stream_bytes = stream_id.encode()
+    header = LEVELS_HEADER.pack(
+        MSG_AUDIO_LEVELS,
+        len(band_db),
+        sequence & 0xFFFF,
+        int(time.time() * 1000) & 0xFFFFFFFF,
+        len(stream_bytes),
+    )
+    levels = to_level_bytes(np.concatenate(([rms_db, peak_db], band_db)))
+    return header + stream_bytes + levels.tobytes()
+
+
+class VoiceActivityDetector:
+    """Energy gate with hangover, deciding per frame whether a stream carries voice.
+
+    One vectorized mean-square per frame against a dBFS threshold. A single
+    loud frame opens the gate so speech onsets aren't clipped; it closes
+    after `hangover_ms` of frames below the threshold.
+    """
+
+    def __init__(self, threshold_db: float = -45.0, hangover_ms: float = 400.0):
+        self.threshold = 10 ** (threshold_db / 10)  # mean square, full scale = 1
+        self.hangover = hangover_ms / 1000
+        self.active = False
+        self._quiet_for = 0.0
+        self._scratch = np.empty(0, dtype=np.float32)
+
+    def update(self, frame):
+        """Feed a frame; returns True if the active state changed"""
+        energy = 0.0
+        count = 0
+        for plane in range(len(frame.planes) if frame.format.is_planar else 1):
+            samples = plane_view(frame, plane)
+            if len(self._scratch) < len(samples):
+                self._scratch = np.empty(len(samples), dtype=np.float32)
+            scratch = self._scratch[: len(samples)]
+            scratch[:] = samples
+            energy += float(np.dot(scratch, scratch))
+            count += len(samples)
+        energy /= max(count, 1) * _full_scale(frame.format.name) ** 2
+
+        if energy >= self.threshold:
+            self._quiet_for = 0.0
+            if not self.active:
+                self.active = True
+                return True
+        elif self.active:
+            self._quiet_for += frame.samples / frame.sample_rate
+            if self._quiet_for >= self.hangover:
+                self.active = False
+                return True
+        return False
+
+
+class LevelAnalyzer:
+    """Computes RMS, peak and log-band spectrum over a window of frames"""
+
+    def __init__(self, bands: int = 16, window_frames: int = 5, min_freq: float = 60.0):
+        self.bands = bands
+        self.window_frames = window_frames
+        self.min_freq = min_freq
+        self._pending = 0  # frames mixed into the window so far
+        self._window = np.empty(0, dtype=np.float32)  # mono mix of the window
+        self._weighted = np.empty(0, dtype=np.float32)  # window times hann
+        self._plans = {}  # (samples, sample_rate) -> (hann window, band edges, scale)
+
+    def add(self, frame):
+        """Add a frame; returns (rms_db, peak_db, band_db) once the window is full"""
+        samples = frame.samples
+        if len(self._window) != samples * self.window_frames:
+            # First frame, or the frame size changed: start a new window
+            self._window = np.empty(samples * self.window_frames, dtype=np.float32)
+            self._pending = 0
+        start = self._pending * samples
+        mono = self._window[start : start + samples]
+        channels = len(frame.layout.channels)
+        if frame.format.is_planar:
+            mono[:] = plane_view(frame, 0)
+            for plane in range(1, channels):
+                mono += plane_view(frame, plane)
+        else:
+            # Packed audio interleaves the channels in one plane
+            np.sum(
+                plane_view(frame).reshape(-1, channels),
+                axis=1,
+                dtype=np.float32,
+                out=mono,
+            )
+        if channels > 1:
+            mono *= 1.0 / channels
+        self._pending += 1
+        if self._pending < self.window_frames:
+            return None
+
+        self._pending = 0
+        return self._analyse_mono(self._window, frame.sample_rate, frame.format.name)
+
+    def analyse(self, samples, sample_rate, sample_format="s16"):
+        """Analyse a (channels, samples) array in one batch"""
+        mono = samples.mean(axis=0, dtype=np.float32)
+        return self._analyse_mono(mono, sample_rate, sample_format)
+
+    def _analyse_mono(self, mono, sample_rate, sample_format):
+        """Levels of a float32 mono mix, scaled in place to full scale = 1"""
+        mono *= 1.0 / _full_scale(sample_format)
+
+        rms_db = 10 * np.log10(np.dot(mono, mono) / len(mono) + _EPSILON)
+        peak_db = 20 * np.log10(max(mono.max(), -mono.min()) + _EPSILON)
+
+        hann, edges, scale = self._plan(mono.shape[0], sample_rate)
+        if len(self._weighted) != len(mono):
+            self._weighted = np.empty(len(mono), dtype=np.float32)
+        np.multiply(mono, hann, out=self._weighted)
+        spectrum = np.abs(np.fft.rfft(self._weighted)) * scale
+        # Power per band, folded with one reduceat call
+        power = np.add.reduceat(np.square(spectrum), edges[:-1])
+        band_db = 10 * np.log10(power + _EPSILON)
+        return float(rms_db), float(peak_db), band_db
+
+    def _plan(self, n_samples, sample_rate):
+        key = (n_samples, sample_rate)
+        plan = self._plans.get(key)
+        if plan is None:
+            hann = np.hanning(n_samples).astype(np.float32)
+            n_bins = n_samples // 2 + 1
+            freqs = np.geomspace(self.min_freq, sample_rate / 2, self.bands + 1)
+            edges = np.round(freqs * n_samples / sample_rate).astype(np.int64)
+            # Every band needs at least one FFT bin
+            for i in range(1, len(edges)):
+                edges[i] = max(edges[i], edges[i - 1] + 1)
+            # Last band runs up to and including the Nyquist bin
+            edges[-1] = n_bins
+            # Full-scale sine -> 0 dBFS
+            scale = 2.0 / hann.sum()
+            plan = self._plans[key] = (hann, edges, scale)
+        return plan
@@ -1,25 +1,475 @@
 import asyncio
 import fractions
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
 
 import av
 from aiohttp import web
+from containers import ADTSFramer, OggOpusPacketizer, RawFramer
+from hls_packager import IDLE_TIMEOUT, PLAYLIST_CONTENT_TYPE, HLSPackager
+from recorder import read_index, seek
+from replay_buffer import REPLAY_RETAIN_SECONDS, ReplayRing
 
 logger = logging.getLogger(__name__)
 
+# 20ms frames handed to the encoder thread per submit (adds ~100ms latency)
+ENCODE_BATCH_FRAMES = 5
+# HTTP egress profiles, picked per request with ?profile=. A stream encodes
+# each profile in use once, shared by all its listeners. frame_samples is the
+# encoder's fixed frame size, which sets the pacing clock.
+EGRESS_PROFILES = {
+    # What /stream/{id}.mp3 has always served, and what HLS packages
+    "default": {
+        "codec": "mp3",
+        "format": "s16p",
+        "layout": "stereo",
+        "sample_rate": 44100,
+        "bit_rate": 128000,
+        "frame_samples": 1152,
+        "content_type": "audio/mpeg",
+    },
+    "voice": {
+        "codec": "mp3",
+        "format": "s16p",
+        "layout": "mono",
+        "sample_rate": 24000,
+        "bit_rate": 48000,
+        "frame_samples": 576,
+        "content_type": "audio/mpeg",
+    },
+    "voice-lo": {
+        "codec": "mp3",
+        "format": "s16p",
+        "layout": "mono",
+        "sample_rate": 16000,
+        "bit_rate": 24000,
+        "frame_samples": 576,
+        "content_type": "audio/mpeg",
+    },
+    "opus": {
+        "codec": "libopus",
+        "container": "ogg",
+        "format": "s16",
+        "layout": "mono",
+        "sample_rate": 48000,
+        "bit_rate": 24000,
+        "frame_samples": 960,
+        "content_type": "audio/ogg",
+    },
+    "aac": {
+        "codec": "aac",
+        "container": "adts",
+        "format": "fltp",
+        "layout": "mono",
+        "sample_rate": 24000,
+        "bit_rate": 48000,
+        "frame_samples": 1024,
+        "content_type": "audio/aac",
+    },
+}
+DEFAULT_PROFILE = "default"
+# Replay rings keep this profile, so it is encoded for every live stream;
+# pre-roll is only possible on it
+REPLAY_PROFILE = "voice"
+# Default depth of the per-stream jitter buffer in front of HTTP listeners;
+# 0 writes packets as soon as they are encoded
+JITTER_BUFFER_MS = 200
+# Encoder threads shared by all streams; 0 encodes on the event loop
+ENCODE_THREADS = min(4, os.cpu_count() or 1)
+# Silent frames fed to an encoder at most before its comfort silence packet
+SILENCE_MAX_FRAMES = 32
+
+
+def make_framer(profile):
+    """Wraps a profile's raw codec packets into something a player can stream"""
+    container = profile.get("container")
+    channels = 1 if profile["layout"] == "mono" else 2
+    if container == "ogg":
+        return OggOpusPacketizer(channels)
+    if container == "adts":
+        return ADTSFramer(profile["sample_rate"], channels)
+    return RawFramer()
+
+
+class AudioBroadcast:
+    """Encodes one stream to one egress profile once and fans the packets out
+    to every listener.
+
+    The encoder appends packets to a bounded backlog tagged with a running
+    sequence number. Each listener keeps its own cursor into that backlog, so
+    adding listeners costs a memory copy per write instead of a resample and
+    encode pipeline per listener.
+
+    Encoding runs on a thread pool in batches of frames. PyAV drops the GIL
+    inside libswresample and the encoders, so batches of different streams
+    encode in parallel while the event loop keeps serving signaling and RTP.
+    """
+
+    def __init__(
+        self,
+        stream_id,
+        track,
+        metrics,
+        backlog=250,
+        executor=None,
+        batch_frames=ENCODE_BATCH_FRAMES,
+        jitter_buffer_ms=JITTER_BUFFER_MS,
+        vad=None,
+        profile=DEFAULT_PROFILE,
+    ):
+        self.stream_id = stream_id
+        self.profile_name = profile
+        self.profile = EGRESS_PROFILES[profile]
+        self.frame_seconds = self.profile["frame_samples"] / self.profile["sample_rate"]
+        self._framer = make_framer(self.profile)
+        # Sent to every listener before the shared packets, e.g. Ogg headers
+        self.header = self._framer.header
+        self._framed_seconds = 0.0
+        # The stream's VoiceActivityDetector; silence is not encoded if set
+        self.vad = vad
+        self._vad_skipped = metrics.vad_skipped_frames.labels(stream_id)
+        self._silent_seconds = 0.0
+        self.track = track
+        # Encode on this executor in batches, or inline on the loop if None
+        self.executor = executor
+        self.batch_frames = batch_frames
+        self._encode_seconds = metrics.encode_seconds.labels(self.profile["codec"])
+        self._encode_on_loop = metrics.encode_loop_seconds.labels(self.profile["codec"])
+        self._bytes_out = metrics.bytes_out.labels(stream_id)
+        self._skipped = metrics.frames_dropped.labels(stream_id, "slow_listener")
+        self._overflow = metrics.frames_dropped.labels(stream_id, "jitter_overflow")
+        self._silence_frames = metrics.comfort_silence_frames.labels(stream_id)
+        # Encoded packets waiting for their real-time slot, see _pace_loop
+        self.jitter_packets = round(jitter_buffer_ms / 1000 / self.frame_seconds)
+        self._outgoing = deque()
+        self._outgoing_ready = asyncio.Event()
+        self._encoding_done = False
+        self._silence = None
+        self._pacer = None
+        self.listeners = 0
+        # Packet consumers besides HTTP listeners, e.g. HLS packagers
+        self.sinks = []
+        self.closed = False
+        self._packets = deque(maxlen=backlog)
+        self._next_seq = 0  # sequence number of the next packet to be published
+        self._data_ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._encode_loop())
+        if self.jitter_packets:
+            self._pacer = asyncio.create_task(self._pace_loop())
+
+    def close(self):
+        for task in (self._task, self._pacer):
+            if task and not task.done():
+                task.cancel()
+        self._mark_closed()
+
+    def _mark_closed(self):
+        if not self.closed:
+            # Release the MediaRelay subscription so the relay stops queueing frames
+            self.track.stop()
+            for sink in self.sinks:
+                sink.end()
+        self.closed = True
+        # Wake listeners so they notice the broadcast is over
+        self._data_ready.set()
+
+    def _queue_packet(self, data):
+        if self._pacer is None:
+            self._publish(data)
+            return
+        self._outgoing.append(data)
+        self._outgoing_ready.set()
+
+    async def _pace_loop(self):
+        """Hand packets to listeners at real-time rate from a jitter buffer.
+
+        Network arrival and batch encoding are bursty, which some speaker
+        firmware answers with large client buffers. Here packets are released
+        one per encoded frame duration on the loop clock after the buffer first
+        fills. When the sender stalls, a silent frame is written instead
+        so HTTP clients never starve. Audio arriving after a stall is trimmed
+        back to the buffer depth so latency doesn't creep up.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while len(self._outgoing) < self.jitter_packets and not self._encoding_done:
+                self._outgoing_ready.clear()
+                await self._outgoing_ready.wait()
+
+            next_due = loop.time()
+            while True:
+                if self._outgoing:
+                    self._publish(self._outgoing.popleft())
+                elif self._encoding_done:
+                    break
+                elif self._silence:
+                    self._silence_frames.value += 1
+                    self._publish(self._silence)
+
+                excess = len(self._outgoing) - 2 * self.jitter_packets
+                if excess > 0:
+                    for _ in range(excess + self.jitter_packets):
+                        self._outgoing.popleft()
+                    self._overflow.value += excess + self.jitter_packets
+
+                next_due += self.frame_seconds
+                delay = next_due - loop.time()
+                if delay < -1.0:
+                    # The loop itself stalled, restart the clock instead of bursting
+                    next_due = loop.time()
+                    delay = 0
+                await asyncio.sleep(max(0.0, delay))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._mark_closed()
+
+    def _publish(self, packet):
+        # Containers may hold several packets (Ogg pages), publish when full
+        self._framed_seconds += self.frame_seconds
+        data = self._framer.add(packet)
+        if not data:
+            return
+        for sink in self.sinks:
+            sink.add_packet(data, self._framed_seconds)
+        self._framed_seconds = 0.0
+        self._packets.append(data)
+        self._next_seq += 1
+        ready, self._data_ready = self._data_ready, asyncio.Event()
+        ready.set()
+
+    @property
+    def position(self):
+        """Sequence number of the next packet, a cursor at the live edge"""
+        return self._next_seq
+
+    async def iter_chunks(self, cursor=None):
+        """Yield encoded data for one listener, from `cursor` or the live edge"""
+        if cursor is None:
+            cursor = self._next_seq
+        while not self.closed:
+            if cursor == self._next_seq:
+                await self._data_ready.wait()
+                continue
+
+            first_seq = self._next_seq - len(self._packets)
+            if cursor < first_seq:
+                # Listener fell further behind than the backlog holds, skip ahead
+                logger.debug(
+                    f"Listener on {self.stream_id} skipped {first_seq - cursor} packets"
+                )
+                self._skipped.value += first_seq - cursor
+                cursor = first_seq
+
+            # Snapshot everything pending into a single write
+            chunk = b"".join(islice(self._packets, cursor - first_seq, None))
+            cursor = self._next_seq
+            self._bytes_out.value += len(chunk)
+            yield chunk
+
+    @staticmethod
+    def _create_encoder(profile):
+        codec_context = av.CodecContext.create(av.codec.Codec(profile["codec"], "w"))
+        codec_context.bit_rate = profile["bit_rate"]
+        codec_context.sample_rate = profile["sample_rate"]
+        codec_context.format = av.AudioFormat(profile["format"])
+        codec_context.layout = profile["layout"]
+        codec_context.time_base = fractions.Fraction(1, profile["sample_rate"])
+        codec_context.open()
+        return codec_context
+
+    def _open_encoder(self):
+        codec_context = self._create_encoder(self.profile)
+        # Resampler to the encoder's rate, layout and sample format
+        resampler = av.AudioResampler(
+            format=self.profile["format"],
+            layout=self.profile["layout"],
+            rate=self.profile["sample_rate"],
+        )
+        return codec_context, resampler
+
+    @staticmethod
+    def _encode_silence(profile):
+        """One encoded frame of digital silence for comfort noise"""
+        codec_context = AudioBroadcast._create_encoder(profile)
+        samples = profile["frame_samples"]
+        packets = []
+        # At least four frames, to get past the encoder delay to a frame that
+        # decodes to silence on its own. Encoders may hold back their first
+        # packet for longer (LAME at 16kHz only emits on the fifth frame), so
+        # keep feeding silence until one comes out.
+        for index in range(SILENCE_MAX_FRAMES):
+            if index >= 4 and packets:
+                break
+            frame = av.AudioFrame(
+                format=profile["format"], layout=profile["layout"], samples=samples
+            )
+            for plane in frame.planes:
+                plane.update(bytes(plane.buffer_size))
+            frame.sample_rate = profile["sample_rate"]
+            frame.pts = index * samples
+            packets.extend(codec_context.encode(frame))
+        if not packets:
+            raise RuntimeError(f"{profile['codec']} encoded no packet from silence")
+        return bytes(packets[-1])
+
+    @staticmethod
+    def _encode_batch(codec_context, resampler, frames):
+        """Resample and encode a batch of frames; runs on an encoder thread"""
+        started = time.perf_counter()
+        packets = []
+        for frame in frames:
+            for r_frame in resampler.resample(frame):
+                packets.extend(bytes(packet) for packet in codec_context.encode(r_frame))
+        return packets, time.perf_counter() - started
+
+    def _finish_batch(self, packets, elapsed, frame_count, offloaded):
+        for packet in packets:
+            self._queue_packet(packet)
+        per_frame = elapsed / frame_count
+        for _ in range(frame_count):
+            self._encode_seconds.observe(per_frame)
+        if not offloaded:
+            self._encode_on_loop.inc(elapsed)
+
+    async def _encode_loop(self):
+        logger.info(
+            f"Starting shared {self.profile_name} encoder for {self.stream_id}"
+        )
+        loop = asyncio.get_running_loop()
+        # Batch in flight on the executor; a broadcast's codec is only ever
+        # used by one batch at a time, which keeps packets in order
+        pending = None
+        try:
+            codec_context, resampler = self._open_encoder()
+            if self._pacer is not None or self.vad is not None:
+                self._silence = self._encode_silence(self.profile)
+
+            batch = []
+            while True:
+                try:
+                    frame = await self.track.recv()
+                except Exception as e:
+                    # End of stream or error
+                    logger.info(f"Stream ended or error: {e}")
+                    break
+
+                if self.vad is not None and not self.vad.active and not batch:
+                    # Silence: stand in pre-encoded silent frames for the
+                    # resampler and encoder, after whatever is still in flight
+                    if pending is not None:
+                        self._finish_batch(*await pending)
+                        pending = None
+                    self._silent_seconds += frame.samples / frame.sample_rate
+                    while self._silent_seconds >= self.frame_seconds:
+                        self._silent_seconds -= self.frame_seconds
+                        self._queue_packet(self._silence)
+                    self._vad_skipped.value += 1
+                    continue
+
+                batch.append(frame)
+                if len(batch) < self.batch_frames:
+                    continue
+
+                if self.executor is None:
+                    self._finish_batch(
+                        *self._encode_batch(codec_context, resampler, batch),
+                        len(batch),
+                        False,
+                    )
+                else:
+                    if pending is not None:
+                        self._finish_batch(*await pending)
+                    future = loop.run_in_executor(
+                        self.executor, self._encode_batch, codec_context, resampler, batch
+                    )
+                    pending = self._batch_result(future, len(batch))
+                batch = []
+
+            if pending is not None:
+                self._finish_batch(*await pending)
+                pending = None
+            if batch:
+                # Flush the tail of the stream
+                self._finish_batch(
+                    *self._encode_batch(codec_context, resampler, batch),
+                    len(batch),
+                    False,
+                )
+
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Encoding error for {self.stream_id}: {e}")
+        finally:
+            if pending is not None:
+                pending.close()
+            logger.info(
+                f"Shared {self.profile_name} encoder stopped for {self.stream_id}"
+            )
+            if self._pacer is None or self._pacer.done():
+                self._mark_closed()
+            else:
+                # Let the pacer play out what is buffered, it closes afterwards
+                self._encoding_done = True
+                self._outgoing_ready.set()
+
+    @staticmethod
+    async def _batch_result(future, frame_count):
+        packets, elapsed = await future
+        return packets, elapsed, frame_count, True
+
 
 class AudioStreamServer:
-    def __init__(self, relay_server):
+    def __init__(
+        self,
+        relay_server,
+        encode_threads: int = ENCODE_THREADS,
+        encode_batch_frames: int = ENCODE_BATCH_FRAMES,
+        jitter_buffer_ms: int = JITTER_BUFFER_MS,
+        replay_retain_seconds: float = REPLAY_RETAIN_SECONDS,
+    ):
         self.relay_server = relay_server
+        self.replay_retain_seconds = replay_retain_seconds
+        self.jitter_buffer_ms = jitter_buffer_ms
+        self.executor = (
+            ThreadPoolExecutor(max_workers=encode_threads, thread_name_prefix="audio-encode")
+            if encode_threads > 0
+            else None
+        )
+        self.encode_batch_frames = encode_batch_frames
         self.app = web.Application()
         self.app.router.add_get("/stream/latest.mp3", self.latest_stream_handler)
+        self.app.router.add_get("/stream/room/{room}.mp3", self.room_stream_handler)
         self.app.router.add_get("/stream/{stream_id}.mp3", self.stream_handler)
+        self.app.router.add_get("/stream/{stream_id}/replay", self.replay_handler)
         self.app.router.add_get("/stream/status", self.status_handler)
+        self.app.router.add_get("/hls/{stream_id}/index.m3u8", self.hls_playlist_handler)
+        self.app.router.add_get(r"/hls/{stream_id}/{name:[0-9.]+}.mp3", self.hls_media_handler)
+        self.app.router.add_get("/recordings", self.recordings_handler)
+        self.app.router.add_get(
+            r"/recordings/{recording:[A-Za-z0-9_-]+}/seek", self.recording_seek_handler
+        )
+        self.app.router.add_get(
+            r"/recordings/{recording:[A-Za-z0-9_-]+}/{segment:[0-9]+\.opus}",
+            self.recording_segment_handler,
+        )
+        self.broadcasts = {}  # (stream_id, profile) -> AudioBroadcast
+        self.packagers = {}  # stream_id -> HLSPackager
+        self.replays = {}  # stream_id -> ReplayRing, kept a while after the end
         self.runner = None
         self.site = None
 
     async def latest_stream_handler(self, request):
-        if not self.relay_server.active_streams:
+        stream_id = self.relay_server.streams.latest()
+        if stream_id is None:
             html_content = """
             <!DOCTYPE html>
             <html>
@@ -110,13 +560,18 @@ class AudioStreamServer:
             """
             return web.Response(text=html_content, content_type="text/html")
 
-        # Get latest stream (last inserted key)
-        stream_id = list(self.relay_server.active_streams.keys())[-1]
-
         # Delegate to stream_handler
         request.match_info["stream_id"] = stream_id
         return await self.stream_handler(request)
 
+    async def room_stream_handler(self, request):
+        """The newest stream published into a room"""
+        stream_id = self.relay_server.streams.latest(request.match_info["room"])
+        if stream_id is None:
+            return web.Response(status=404, text="No stream in this room")
+        request.match_info["stream_id"] = stream_id
+        return await self.stream_handler(request)
+
     async def start(self, host="0.0.0.0", port=8081):
         self.runner = web.AppRunner(self.app)
         await self.runner.setup()
@@ -125,91 +580,329 @@ class AudioStreamServer:
         logger.info(f"Audio Stream Server started on {host}:{port}")
 
     async def stop(self):
+        for (stream_id, _), broadcast in list(self.broadcasts.items()):
+            self.close_broadcast(stream_id, broadcast)
         if self.site:
             await self.site.stop()
         if self.runner:
             await self.runner.cleanup()
+        if self.executor:
+            self.executor.shutdown(wait=False)
 
     async def status_handler(self, request):
         return web.json_response(
-            {"active_streams": list(self.relay_server.active_streams.keys())}
+            {"active_streams": self.relay_server.streams.ids()}
         )
 
     async def stream_handler(self, request):
         stream_id = request.match_info["stream_id"]
-        stream_info = self.relay_server.active_streams.get(stream_id)
+        stream = self.relay_server.streams.get(stream_id)
 
-        if not stream_info:
+        if not stream:
             return web.Response(status=404, text="Stream not found")
 
-        logger.info(f"Starting audio stream for {stream_id} to {request.remote}")
+        try:
+            preroll = float(request.query.get("preroll", 0))
+        except ValueError:
+            return web.Response(status=400, text="Bad preroll")
+        # Pre-roll comes from the replay ring, so only switch to its profile
+        # when the stream keeps one
+        use_replay = preroll > 0 and stream_id in self.replays
+        profile = request.query.get("profile") or (
+            REPLAY_PROFILE if use_replay else DEFAULT_PROFILE
+        )
+        if profile not in EGRESS_PROFILES:
+            return web.Response(
+                status=400,
+                text=f"Unknown profile, choose one of: {', '.join(EGRESS_PROFILES)}",
+            )
+
+        logger.info(
+            f"Starting {profile} audio stream for {stream_id} to {request.remote}"
+        )
 
-        # Subscribe to the track via MediaRelay to get a fresh consumer
-        source_track = stream_info["track"]
         try:
-            track = self.relay_server.relay.subscribe(source_track)
+            broadcast = self.get_broadcast(stream_id, stream.track, profile)
         except Exception as e:
             logger.error(f"Failed to subscribe to track: {e}")
             return web.Response(status=500, text="Failed to subscribe to media track")
 
+        # Take the replay and the live cursor together so nothing is lost or
+        # repeated between them
+        replay = self.replays.get(stream_id)
+        head = broadcast.header
+        if replay is not None and preroll > 0 and profile == REPLAY_PROFILE:
+            head += replay.last(preroll)
+        cursor = broadcast.position
+
         response = web.StreamResponse(
             status=200,
             reason="OK",
             headers={
-                "Content-Type": "audio/mpeg",
+                "Content-Type": broadcast.profile["content_type"],
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
             },
         )
         await response.prepare(request)
 
-        # Setup MP3 encoding
+        broadcast.listeners += 1
+        try:
+            if head:
+                await response.write(head)
+            async for chunk in broadcast.iter_chunks(cursor):
+                await response.write(chunk)
+        except asyncio.CancelledError:
+            logger.info("Client disconnected")
+        except Exception as e:
+            logger.error(f"Streaming error: {e}")
+        finally:
+            self.release_listener(stream_id, broadcast)
+
+        return response
+
+    async def replay_handler(self, request):
+        """The last ?seconds= of a live or recently ended stream, from memory"""
+        stream_id = request.match_info["stream_id"]
+        replay = self.replays.get(stream_id)
+        if replay is None:
+            return web.Response(status=404, text="No replay for this stream")
+        try:
+            seconds = float(request.query.get("seconds", replay.max_seconds))
+        except ValueError:
+            return web.Response(status=400, text="Bad seconds")
+        return web.Response(
+            body=replay.last(seconds),
+            content_type=EGRESS_PROFILES[REPLAY_PROFILE]["content_type"],
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    async def hls_playlist_handler(self, request):
+        stream_id = request.match_info["stream_id"]
+        packager = self.packagers.get(stream_id)
+        if packager is None:
+            stream = self.relay_server.streams.get(stream_id)
+            if not stream:
+                return web.Response(status=404, text="Stream not found")
+            try:
+                packager = self.start_packager(stream_id, stream.track)
+            except Exception as e:
+                logger.error(f"Failed to subscribe to track: {e}")
+                return web.Response(status=500, text="Failed to subscribe to media track")
+        packager.last_request = time.monotonic()
+
+        msn = request.query.get("_HLS_msn")
+        if msn is not None:
+            # LL-HLS blocking reload: answer once the requested part exists
+            part = request.query.get("_HLS_part")
+            try:
+                msn = int(msn)
+                part = int(part) if part is not None else None
+            except ValueError:
+                return web.Response(status=400, text="Bad _HLS_msn/_HLS_part")
+            if packager.too_far_ahead(msn):
+                return web.Response(status=400, text="_HLS_msn too far ahead of live")
+            await packager.wait_for(msn, part)
+
+        return web.Response(
+            text=packager.playlist(),
+            content_type=PLAYLIST_CONTENT_TYPE,
+            # Blocking reload responses are cacheable, plain reloads are not
+            headers={"Cache-Control": "max-age=6" if msn is not None else "no-cache"},
+        )
+
+    async def hls_media_handler(self, request):
+        packager = self.packagers.get(request.match_info["stream_id"])
+        if packager is None:
+            return web.Response(status=404, text="Stream not found")
+
+        numbers = request.match_info["name"].split(".")
+        try:
+            if len(numbers) == 1:
+                data = await packager.media(int(numbers[0]))
+            elif len(numbers) == 2:
+                data = await packager.media(int(numbers[0]), int(numbers[1]))
+            else:
+                data = None
+        except ValueError:
+            data = None
+        if data is None:
+            return web.Response(status=404, text="Segment not found")
+
+        # Listed segments and parts never change, let caches keep them
+        return web.Response(
+            body=data,
+            content_type="audio/mpeg",
+            headers={"Cache-Control": "max-age=60, immutable"},
+        )
+
+    async def recordings_handler(self, request):
+        directory = self.relay_server.recordings_dir
+        active = {
+            recorder.name: stream_id
+            for stream_id, recorder in self.relay_server.recorders.items()
+        }
+        recordings = []
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not os.path.isdir(path):
+                    continue
+                recordings.append(
+                    {
+                        "name": name,
+                        "segments": sorted(
+                            f for f in os.listdir(path) if f.endswith(".opus")
+                        ),
+                        "recording": name in active,
+                    }
+                )
+        return web.json_response({"recordings": recordings})
+
+    async def recording_seek_handler(self, request):
+        """Segment and byte offset of the Ogg page holding ?t= seconds"""
+        recording = request.match_info["recording"]
+        try:
+            t = float(request.query.get("t", 0))
+        except ValueError:
+            return web.Response(status=400, text="Bad t")
+        path = os.path.join(self.relay_server.recordings_dir, recording)
         try:
-            # Create MP3 encoder
-            codec = av.codec.Codec("mp3", "w")
-            codec_context = av.CodecContext.create(codec)
-            codec_context.bit_rate = 128000
-            codec_context.sample_rate = 44100
-            codec_context.format = av.AudioFormat("s16p")
-            codec_context.layout = "stereo"
-            codec_context.time_base = fractions.Fraction(1, 44100)
-
-            # Open the codec
-            codec_context.open()
-
-            # Resampler to ensure compatible format for MP3 encoder
-            resampler = av.AudioResampler(
-                format="s16p",
-                layout="stereo",
-                rate=44100,
+            entries = await asyncio.get_running_loop().run_in_executor(
+                None, read_index, path
             )
+        except FileNotFoundError:
+            return web.Response(status=404, text="Recording not found")
 
-            # Start streaming
-            while True:
-                try:
-                    frame = await track.recv()
+        entry = seek(entries, t)
+        if entry is None:
+            return web.Response(status=404, text="Recording is empty")
+        return web.json_response(
+            {
+                **entry,
+                "url": f"/recordings/{recording}/{entry['segment']}",
+                # Players fetch bytes 0..headers_end (OpusHead/OpusTags) and
+                # then a range starting at offset
+                "headers_end": next(
+                    e["offset"] for e in entries if e["segment"] == entry["segment"]
+                ),
+            }
+        )
 
-                    # Resample
-                    resampled_frames = resampler.resample(frame)
+    async def recording_segment_handler(self, request):
+        path = os.path.join(
+            self.relay_server.recordings_dir,
+            request.match_info["recording"],
+            request.match_info["segment"],
+        )
+        if not os.path.isfile(path):
+            return web.Response(status=404, text="Segment not found")
+        # FileResponse serves Range requests, which is how seeking works
+        return web.FileResponse(path, headers={"Content-Type": "audio/ogg"})
 
-                    for r_frame in resampled_frames:
-                        packets = codec_context.encode(r_frame)
-                        for packet in packets:
-                            await response.write(bytes(packet))
+    def start_packager(self, stream_id, source_track):
+        broadcast = self.get_broadcast(stream_id, source_track)
+        packager = HLSPackager(stream_id)
+        # The packager counts as a listener so the shared encoder keeps running
+        broadcast.listeners += 1
+        broadcast.sinks.append(packager)
+        self.packagers[stream_id] = packager
+        asyncio.create_task(self._expire_packager(stream_id, packager, broadcast))
+        logger.info(f"Started HLS packager for {stream_id}")
+        return packager
 
-                except Exception as e:
-                    # End of stream or error
-                    logger.info(f"Stream ended or error: {e}")
+    async def _expire_packager(self, stream_id, packager, broadcast):
+        """Stop packaging once the stream ends or players stop polling"""
+        try:
+            while not packager.ended:
+                await asyncio.sleep(IDLE_TIMEOUT / 3)
+                if time.monotonic() - packager.last_request > IDLE_TIMEOUT:
                     break
+            if packager.ended:
+                # Let players fetch the final parts and the ENDLIST playlist
+                await asyncio.sleep(IDLE_TIMEOUT)
+        finally:
+            logger.info(f"Stopped HLS packager for {stream_id}")
+            if self.packagers.get(stream_id) is packager:
+                del self.packagers[stream_id]
+            if packager in broadcast.sinks:
+                broadcast.sinks.remove(packager)
+            self.release_listener(stream_id, broadcast)
 
-        except asyncio.CancelledError:
-            logger.info("Client disconnected")
-        except Exception as e:
-            logger.error(f"Streaming error: {e}")
+    def start_replay(self, stream_id, source_track, max_seconds, max_bytes):
+        """Keep the stream's recent REPLAY_PROFILE packets for replay and pre-roll.
+
+        The ring must see audio before anyone asks for it, so it holds a
+        listener on the shared encoder for the whole life of the stream: the
+        encoder no longer stops with the last HTTP listener. That is why
+        replay is off unless REPLAY_SECONDS or the sender asks for it.
+        """
+        broadcast = self.get_broadcast(stream_id, source_track, REPLAY_PROFILE)
+        replay = ReplayRing(stream_id, max_seconds, max_bytes)
+        broadcast.listeners += 1
+        broadcast.sinks.append(replay)
+        self.replays[stream_id] = replay
+        asyncio.create_task(self._expire_replay(stream_id, replay, broadcast))
+        return replay
+
+    async def _expire_replay(self, stream_id, replay, broadcast):
+        try:
+            try:
+                await replay.wait_ended()
+            finally:
+                # The ring keeps its own packets, drop the encoder and its backlog
+                self.release_listener(stream_id, broadcast)
+            await asyncio.sleep(self.replay_retain_seconds)
         finally:
-            # Clean up track subscription
-            # track.stop() # aiortc tracks don't have stop(), they stop when upstream stops or GC?
-            # MediaRelay tracks handle cleanup when they are no longer iterated?
-            pass
+            if self.replays.get(stream_id) is replay:
+                del self.replays[stream_id]
 
-        return response
+    def close_stream(self, stream_id):
+        """Stop HTTP egress of a removed stream; returns what was released"""
+        freed = {"mp3_broadcasts": 0, "hls_packagers": 0, "replay_rings": 0}
+        if stream_id in self.packagers:
+            freed["hls_packagers"] += 1
+        replay = self.replays.pop(stream_id, None)
+        if replay is not None:
+            # Reaped streams are long dead, no point keeping their replay
+            replay.end()
+            freed["replay_rings"] += 1
+        for key, broadcast in list(self.broadcasts.items()):
+            if key[0] == stream_id:
+                freed["mp3_broadcasts"] += 1
+                # Ends listeners' responses and any packager's playlist
+                self.close_broadcast(stream_id, broadcast)
+        return freed
+
+    def release_listener(self, stream_id, broadcast):
+        broadcast.listeners -= 1
+        if broadcast.listeners == 0:
+            # Last listener gone, stop encoding until someone tunes in again
+            self.close_broadcast(stream_id, broadcast)
+
+    def get_broadcast(self, stream_id, source_track, profile=DEFAULT_PROFILE):
+        """Return the stream's shared encoder for a profile, starting it if needed"""
+        broadcast = self.broadcasts.get((stream_id, profile))
+        if broadcast is None or broadcast.closed:
+            # Subscribe to the track via MediaRelay once for all HTTP listeners
+            track = self.relay_server.relay.subscribe(source_track)
+            stream = self.relay_server.streams.get(stream_id)
+            broadcast = AudioBroadcast(
+                stream_id,
+                track,
+                self.relay_server.metrics,
+                executor=self.executor,
+                batch_frames=self.encode_batch_frames,
+                jitter_buffer_ms=self.jitter_buffer_ms,
+                vad=stream.vad if stream and self.relay_server.vad_gating else None,
+                profile=profile,
+            )
+            broadcast.start()
+            self.broadcasts[(stream_id, profile)] = broadcast
+        return broadcast
+
+    def close_broadcast(self, stream_id, broadcast):
+        broadcast.close()
+        key = (stream_id, broadcast.profile_name)
+        if self.broadcasts.get(key) is broadcast:
+            del self.broadcasts[key]
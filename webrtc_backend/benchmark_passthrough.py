@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Opus passthrough vs MediaRelay decode-and-re-encode fan-out.
+
+Simulates the per-receiver work of one stream with N receivers for a fixed
+number of 20ms frames:
+
+- relay: what each receiver's RTCRtpSender does with a MediaRelay track,
+  i.e. run its own OpusEncoder on every decoded frame, then packetize.
+- passthrough: what it does with an OpusPassthroughTrack, i.e. wrap the
+  sender's already-encoded payload in an av.Packet, pack() it, then
+  packetize.
+
+SRTP and socket I/O are identical for both paths and are left out.
+Reports CPU per receiver and receivers per core as JSON.
+
+Usage: python benchmark_passthrough.py [--receivers 1 8 32] [--frames 500]
+"""
+
+import argparse
+import fractions
+import json
+import time
+
+import av
+import numpy as np
+from aiortc.codecs.opus import OpusEncoder
+from aiortc.rtp import RtpPacket
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960
+FRAME_SECONDS = SAMPLES_PER_FRAME / SAMPLE_RATE
+TIME_BASE = fractions.Fraction(1, SAMPLE_RATE)
+
+
+def make_frames(count):
+    """Stereo s16 frames of a 440Hz tone, like aiortc's Opus decoder output"""
+    frames = []
+    for i in range(count):
+        t = (np.arange(SAMPLES_PER_FRAME) + i * SAMPLES_PER_FRAME) / SAMPLE_RATE
+        tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+        frame = av.AudioFrame.from_ndarray(
+            np.repeat(tone, 2).reshape(1, -1), format="s16", layout="stereo"
+        )
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = i * SAMPLES_PER_FRAME
+        frame.time_base = TIME_BASE
+        frames.append(frame)
+    return frames
+
+
+def packetize(payloads, timestamp, sequence):
+    for payload in payloads:
+        RtpPacket(
+            payload_type=111,
+            sequence_number=sequence & 0xFFFF,
+            timestamp=timestamp & 0xFFFFFFFF,
+            payload=payload,
+        ).serialize()
+
+
+def relay_path(frames, receivers):
+    encoders = [OpusEncoder() for _ in range(receivers)]
+    for sequence, frame in enumerate(frames):
+        for encoder in encoders:
+            payloads, timestamp = encoder.encode(frame)
+            packetize(payloads, timestamp, sequence)
+
+
+def passthrough_path(encoded, receivers):
+    encoders = [OpusEncoder() for _ in range(receivers)]
+    for sequence, (payload, pts) in enumerate(encoded):
+        for encoder in encoders:
+            packet = av.Packet(payload)
+            packet.pts = pts
+            packet.time_base = TIME_BASE
+            payloads, timestamp = encoder.pack(packet)
+            packetize(payloads, timestamp, sequence)
+
+
+def measure(func, *args):
+    start = time.process_time()
+    func(*args)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Opus passthrough benchmark")
+    parser.add_argument("--receivers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames)
+    # The sender's encoded stream, produced once
+    source_encoder = OpusEncoder()
+    encoded = []
+    for frame in frames:
+        payloads, timestamp = source_encoder.encode(frame)
+        encoded.extend((payload, timestamp) for payload in payloads)
+
+    audio_seconds = args.frames * FRAME_SECONDS
+    results = []
+    for receivers in args.receivers:
+        for name, func, source in (
+            ("relay_reencode", relay_path, frames),
+            ("opus_passthrough", passthrough_path, encoded),
+        ):
+            cpu = measure(func, source, receivers)
+            per_receiver = cpu / receivers / audio_seconds
+            results.append(
+                {
+                    "path": name,
+                    "receivers": receivers,
+                    "cpu_seconds": round(cpu, 3),
+                    # Fraction of one core a single receiver costs in real time
+                    "cpu_per_receiver": round(per_receiver, 5),
+                    "receivers_per_core": round(1 / per_receiver) if cpu else None,
+                }
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
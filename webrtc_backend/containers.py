@@ -0,0 +1,172 @@
+"""
+Minimal containers for encoded audio packets: Ogg Opus pages and AAC ADTS.
+
+Encoders hand out raw codec packets. MP3 frames are self-delimiting and can
+be streamed as-is, but Opus needs Ogg pages and raw AAC needs an ADTS header
+per frame before a player can make sense of them. Both are small enough to
+build here instead of going through a muxer per listener.
+"""
+
+import struct
+
+OPUS_SAMPLE_RATE = 48000
+OPUS_PRE_SKIP = 312
+
+# Packets per page when streaming Ogg Opus; 5 x 20ms keeps latency low while
+# the 27 byte page header stays a small share of a voice bitrate
+STREAM_PAGE_PACKETS = 5
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def ogg_crc(data):
+    """CRC-32 as Ogg defines it (polynomial 0x04C11DB7, not reflected)"""
+    crc = 0
+    table = _CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+def ogg_page(packets, granule, serial, sequence, header_type=0x00):
+    """One Ogg page holding complete `packets` (at most 255 lacing values)"""
+    lacing = bytearray()
+    for packet in packets:
+        lacing.extend(b"\xff" * (len(packet) // 255))
+        lacing.append(len(packet) % 255)
+    header = struct.pack(
+        "<4sBBqIIIB",
+        b"OggS",
+        0,
+        header_type,
+        granule,
+        serial,
+        sequence,
+        0,
+        len(lacing),
+    )
+    page = bytearray(header + lacing + b"".join(packets))
+    struct.pack_into("<I", page, 22, ogg_crc(page))
+    return bytes(page)
+
+
+def opus_head(channels):
+    return b"OpusHead" + struct.pack(
+        "<BBHIhB", 1, channels, OPUS_PRE_SKIP, OPUS_SAMPLE_RATE, 0, 0
+    )
+
+
+def opus_tags(vendor=b"voice-streaming"):
+    return b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+
+
+# Samples per frame for each TOC config (RFC 6716 section 3.1), at 48kHz
+_OPUS_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3  # SILK NB/MB/WB 10/20/40/60ms
+    + [480, 960] * 2  # Hybrid SWB/FB 10/20ms
+    + [120, 240, 480, 960] * 4  # CELT NB/WB/SWB/FB 2.5/5/10/20ms
+)
+
+
+def opus_packet_samples(packet):
+    """Duration of an Opus packet in 48kHz samples, from its TOC byte"""
+    if not packet:
+        return 0
+    toc = packet[0]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return _OPUS_FRAME_SAMPLES[toc >> 3] * frames
+
+
+def opus_packet_channels(packet):
+    """Channel count of an Opus packet, from the stereo flag of its TOC byte"""
+    return 2 if packet and packet[0] & 0x04 else 1
+
+
+class OggOpusPacketizer:
+    """Groups a live stream's Opus packets into Ogg pages.
+
+    Every listener first gets ``header`` (the OpusHead and OpusTags pages)
+    and then joins the shared pages wherever the stream is, as Ogg radio
+    streams do; players take the granule position of the first page as the
+    start.
+    """
+
+    def __init__(self, channels, serial=1, page_packets=STREAM_PAGE_PACKETS):
+        self.serial = serial
+        self.page_packets = page_packets
+        self.header = ogg_page([opus_head(channels)], 0, serial, 0, 0x02) + ogg_page(
+            [opus_tags()], 0, serial, 1
+        )
+        self._sequence = 2
+        self._granule = OPUS_PRE_SKIP
+        self._packets = []
+
+    def add(self, packet):
+        """Returns a finished page, or b"" while the current one fills"""
+        self._packets.append(packet)
+        self._granule += opus_packet_samples(packet)
+        if len(self._packets) < self.page_packets:
+            return b""
+        page = ogg_page(self._packets, self._granule, self.serial, self._sequence)
+        self._sequence += 1
+        self._packets = []
+        return page
+
+
+# ADTS sampling frequency index, ISO/IEC 14496-3 table 1.18
+_ADTS_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000)
+
+
+class ADTSFramer:
+    """Prefixes raw AAC-LC frames with ADTS headers so they can be streamed"""
+
+    header = b""
+
+    def __init__(self, sample_rate, channels):
+        rate_index = _ADTS_RATES.index(sample_rate)
+        # Object type AAC-LC (2) is stored minus one
+        self._fixed = bytes(
+            [0xFF, 0xF1, (1 << 6) | (rate_index << 2) | (channels >> 2)]
+        )
+        self._channels = (channels & 0x03) << 6
+
+    def add(self, packet):
+        length = len(packet) + 7
+        return (
+            self._fixed
+            + bytes(
+                [
+                    self._channels | ((length >> 11) & 0x03),
+                    (length >> 3) & 0xFF,
+                    ((length & 0x07) << 5) | 0x1F,
+                    0xFC,
+                ]
+            )
+            + packet
+        )
+
+
+class RawFramer:
+    """MP3 frames carry their own headers and stream as they are"""
+
+    header = b""
+
+    def add(self, packet):
+        return packet
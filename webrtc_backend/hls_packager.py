@@ -0,0 +1,231 @@
+"""
+In-memory Low-Latency HLS packaging of a stream's shared MP3 encode.
+
+The packager sits on an AudioBroadcast as one more consumer, so a stream is
+encoded once no matter how many HLS players, Cast devices and MP3 listeners
+pull from it. Packets are grouped into partial segments (~200ms) and full
+segments (~2s) held in a sliding window. Players fetch them with short,
+cacheable GETs instead of holding a chunked response open.
+
+Segments use HLS packed audio: raw MP3 frames preceded by an ID3 tag that
+carries the 90kHz start timestamp. Blocking playlist reloads
+(``_HLS_msn``/``_HLS_part``) and preload hints are supported, so LL-HLS
+players learn about a new part as soon as it exists.
+
+URLs, relative to the playlist ``/hls/{stream_id}/index.m3u8``:
+
+    {msn}.mp3         complete segment, immutable once listed
+    {msn}.{part}.mp3  partial segment, immutable once listed
+"""
+
+import asyncio
+import logging
+import struct
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SECONDS = 2.0
+PART_SECONDS = 0.2
+WINDOW_SEGMENTS = 6
+# Stop packaging when no player asked for the playlist for this long
+IDLE_TIMEOUT = 30.0
+
+PLAYLIST_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+_TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp\x00"
+
+
+def _syncsafe(size):
+    return bytes(((size >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+
+
+def id3_timestamp_tag(pts_90khz):
+    """ID3v2.4 tag with the PRIV timestamp HLS packed audio segments start with"""
+    payload = _TIMESTAMP_OWNER + struct.pack("!Q", pts_90khz & 0x1FFFFFFFF)
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+
+class HLSPackager:
+    """Cuts one stream's MP3 packets into LL-HLS parts and segments"""
+
+    def __init__(
+        self,
+        stream_id,
+        segment_seconds=SEGMENT_SECONDS,
+        part_seconds=PART_SECONDS,
+        window_segments=WINDOW_SEGMENTS,
+    ):
+        self.stream_id = stream_id
+        self.segment_seconds = segment_seconds
+        self.part_seconds = part_seconds
+        self.ended = False
+        self.last_request = time.monotonic()
+        # Complete segments: dicts with msn, duration, start pts and parts
+        self._segments = deque(maxlen=window_segments)
+        self._current = self._new_segment(0, 0)
+        self._part_packets = []
+        self._part_duration = 0.0
+        self._part_start = 0
+        self._pts = 0  # 90kHz timestamp of the next packet
+        self._changed = asyncio.Event()
+
+    @staticmethod
+    def _new_segment(msn, pts):
+        # parts: list of (payload, duration, start pts)
+        return {"msn": msn, "pts": pts, "duration": 0.0, "parts": [], "data": None}
+
+    def add_packet(self, data, duration):
+        """Called by the broadcast for every encoded MP3 packet.
+
+        PART-TARGET has to stay the same for the whole stream and no part may
+        be longer, so a part is closed as soon as one more packet would take
+        it past part_seconds rather than once it has gone past.
+        """
+        if self._part_packets and self._exceeds(self._part_duration + duration):
+            self._close_part()
+        if not self._part_packets:
+            self._part_start = self._pts
+        self._part_packets.append(data)
+        self._part_duration += duration
+        self._pts += round(duration * 90000)
+        # Assume the next packet is as long as this one
+        if self._exceeds(self._part_duration + duration):
+            self._close_part()
+
+    def _exceeds(self, duration):
+        # Some slack, as packet durations are floats summed up
+        return duration > self.part_seconds + 1e-6
+
+    def _close_part(self):
+        segment = self._current
+        segment["parts"].append(
+            (b"".join(self._part_packets), self._part_duration, self._part_start)
+        )
+        segment["duration"] += self._part_duration
+        self._part_packets = []
+        self._part_duration = 0.0
+
+        if segment["duration"] >= self.segment_seconds - self.part_seconds / 2:
+            segment["data"] = id3_timestamp_tag(segment["pts"]) + b"".join(
+                payload for payload, _, _ in segment["parts"]
+            )
+            self._segments.append(segment)
+            self._current = self._new_segment(segment["msn"] + 1, self._pts)
+        self._notify()
+
+    def end(self):
+        if self._part_packets:
+            self._close_part()
+        self.ended = True
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _has(self, msn, part):
+        if self.ended:
+            return True
+        if msn < self._current["msn"]:
+            return True
+        if msn > self._current["msn"]:
+            return False
+        # Without a part, a request for msn waits for the whole segment
+        return part is not None and part < len(self._current["parts"])
+
+    async def media(self, msn, part=None):
+        """Segment `msn` or one of its parts, None if it is not in the window.
+
+        A request for the next part or segment, as the preload hint names
+        it, is held until that exists.
+        """
+        if self._current["msn"] <= msn <= self._current["msn"] + 1:
+            await self.wait_for(msn, part)
+        if part is None:
+            return self.segment(msn)
+        return self.part(msn, part)
+
+    def too_far_ahead(self, msn):
+        """Whether `msn` is more than two segments past the last complete one.
+
+        LL-HLS servers answer such blocking reloads with 400 instead of waiting.
+        """
+        # The segment in progress is the last complete one plus one
+        return msn > self._current["msn"] + 1
+
+    async def wait_for(self, msn, part=None, timeout=None):
+        """Block a playlist reload until segment `msn` (or its `part`) exists"""
+        deadline = time.monotonic() + (timeout or self.segment_seconds * 3)
+        while not self._has(msn, part):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def _find(self, msn):
+        if msn == self._current["msn"]:
+            return self._current
+        for segment in self._segments:
+            if segment["msn"] == msn:
+                return segment
+        return None
+
+    def segment(self, msn):
+        segment = self._find(msn)
+        if segment is None or segment["data"] is None:
+            return None
+        return segment["data"]
+
+    def part(self, msn, index):
+        segment = self._find(msn)
+        if segment is None or index >= len(segment["parts"]):
+            return None
+        payload, _, pts = segment["parts"][index]
+        return id3_timestamp_tag(pts) + payload
+
+    def playlist(self):
+        target = max(
+            [self.segment_seconds] + [segment["duration"] for segment in self._segments]
+        )
+        first_msn = self._segments[0]["msn"] if self._segments else self._current["msn"]
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:6",
+            f"#EXT-X-TARGETDURATION:{max(1, round(target))}",
+            f"#EXT-X-PART-INF:PART-TARGET={self.part_seconds:.3f}",
+            "#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,"
+            f"PART-HOLD-BACK={self.part_seconds * 3:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first_msn}",
+        ]
+
+        # Parts are only listed for the last couple of segments, as LL-HLS intends
+        parts_from = len(self._segments) - 2
+        for index, segment in enumerate(self._segments):
+            if index >= parts_from:
+                lines.extend(self._part_lines(segment))
+            lines.append(f"#EXTINF:{segment['duration']:.3f},")
+            lines.append(f"{segment['msn']}.mp3")
+
+        current = self._current
+        lines.extend(self._part_lines(current))
+        if self.ended:
+            lines.append("#EXT-X-ENDLIST")
+        else:
+            lines.append(
+                f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{current["msn"]}.{len(current["parts"])}.mp3"'
+            )
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _part_lines(segment):
+        return [
+            f'#EXT-X-PART:DURATION={duration:.3f},URI="{segment["msn"]}.{index}.mp3",INDEPENDENT=YES'
+            for index, (_, duration, _) in enumerate(segment["parts"])
+        ]
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Load-generation harness for the WebRTC voice streaming relay server.
+
+Starts N synthetic aiortc senders and M receivers per stream against a local
+server, drives the full /ws signaling flow for each of them and reports a
+JSON summary:
+
+- join latency: start_receiving -> first decoded audio frame
+- end-to-end audio latency: every sender emits a short marker pulse once per
+  interval on top of a tone or noise bed. The pulse frequency encodes its
+  sequence number and the send time is logged, so receivers can match each
+  detected pulse to the moment it left the sender.
+- frame loss, from gaps in the received frame timestamps
+- server CPU and RSS (Linux /proc), when the server pid is known
+
+Everything runs on loopback; no STUN/TURN or other external services.
+
+Usage:
+    python load_test.py --spawn-server --senders 2 --receivers 8 --duration 30
+    python load_test.py --url ws://127.0.0.1:8080/ws --server-pid 1234
+"""
+
+import argparse
+import asyncio
+import fractions
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+import av
+import numpy as np
+from aiortc import (
+    MediaStreamTrack,
+    RTCConfiguration,
+    RTCPeerConnection,
+    RTCSessionDescription,
+)
+from aiortc.mediastreams import MediaStreamError
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960  # 20ms
+FRAME_SECONDS = SAMPLES_PER_FRAME / SAMPLE_RATE
+
+# Marker pulses: 40ms bursts whose frequency encodes (sequence % PULSE_SLOTS)
+PULSE_FRAMES = 2
+PULSE_SLOTS = 8
+PULSE_BASE_HZ = 500
+PULSE_STEP_HZ = 250
+PULSE_AMPLITUDE = 0.6
+BED_AMPLITUDE = 0.05
+DETECT_RMS = 0.2
+
+
+def pulse_frequency(sequence):
+    return PULSE_BASE_HZ + (sequence % PULSE_SLOTS) * PULSE_STEP_HZ
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted, non-empty list"""
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def summarize(samples, scale=1000.0):
+    """p50/p95/max/avg of a list of seconds, in milliseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "avg": round(statistics.mean(ordered) * scale, 1),
+        "p50": round(percentile(ordered, 0.50) * scale, 1),
+        "p95": round(percentile(ordered, 0.95) * scale, 1),
+        "max": round(ordered[-1] * scale, 1),
+    }
+
+
+class PulseTrack(MediaStreamTrack):
+    """Real-time paced audio: a tone or noise bed with periodic marker pulses"""
+
+    kind = "audio"
+
+    def __init__(self, signal="tone", pulse_interval=1.0):
+        super().__init__()
+        self.signal = signal
+        self.frames_per_interval = max(
+            PULSE_FRAMES + 1, round(pulse_interval / FRAME_SECONDS)
+        )
+        self.pulses = []  # (send_time, sequence)
+        self._start = None
+        self._frame_index = 0
+        self._rng = np.random.default_rng()
+        self._t = np.arange(SAMPLES_PER_FRAME) / SAMPLE_RATE
+
+    async def recv(self):
+        if self._start is None:
+            self._start = time.monotonic()
+        target = self._start + self._frame_index * FRAME_SECONDS
+        delay = target - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        offset = self._frame_index * FRAME_SECONDS
+        if self.signal == "noise":
+            samples = self._rng.uniform(
+                -BED_AMPLITUDE, BED_AMPLITUDE, SAMPLES_PER_FRAME
+            )
+        else:
+            samples = BED_AMPLITUDE * np.sin(2 * np.pi * 220 * (self._t + offset))
+
+        position = self._frame_index % self.frames_per_interval
+        if position < PULSE_FRAMES:
+            sequence = self._frame_index // self.frames_per_interval
+            if position == 0:
+                self.pulses.append((time.monotonic(), sequence))
+            frequency = pulse_frequency(sequence)
+            samples = samples + PULSE_AMPLITUDE * np.sin(
+                2 * np.pi * frequency * (self._t + offset)
+            )
+
+        pcm = (np.clip(samples, -1, 1) * 32767).astype(np.int16).reshape(1, -1)
+        frame = av.AudioFrame.from_ndarray(pcm, format="s16", layout="mono")
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = self._frame_index * SAMPLES_PER_FRAME
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        self._frame_index += 1
+        return frame
+
+
+class SignalingClient:
+    """A /ws connection plus one RTCPeerConnection"""
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.ws = None
+        self.pc = RTCPeerConnection(configuration=RTCConfiguration(iceServers=[]))
+
+    async def connect(self):
+        self.ws = await self.session.ws_connect(self.url)
+
+    async def send(self, message):
+        await self.ws.send_str(json.dumps(message))
+
+    async def receive(self, *types, timeout=10.0):
+        """Wait for the next JSON message of one of the given types"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"no {types} message within {timeout}s")
+            msg = await self.ws.receive(timeout=remaining)
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    raise ConnectionError("signaling socket closed")
+                continue
+            data = json.loads(msg.data)
+            if data.get("type") == "error":
+                raise RuntimeError(data.get("message"))
+            if data.get("type") in types:
+                return data
+
+    async def close(self):
+        await self.pc.close()
+        if self.ws is not None:
+            await self.ws.close()
+
+
+class SyntheticSender(SignalingClient):
+    def __init__(self, session, url, signal, pulse_interval):
+        super().__init__(session, url)
+        self.track = PulseTrack(signal, pulse_interval)
+        self.stream_id = None
+        self.setup_seconds = None
+
+    async def start(self):
+        started = time.monotonic()
+        await self.connect()
+        await self.send({"type": "start_sending"})
+        ready = await self.receive("sender_ready")
+        self.stream_id = f"stream_{ready['connection_id']}"
+
+        self.pc.addTrack(self.track)
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+        await self.send(
+            {
+                "type": "webrtc_offer",
+                "offer": {
+                    "sdp": self.pc.localDescription.sdp,
+                    "type": self.pc.localDescription.type,
+                },
+            }
+        )
+        answer = await self.receive("webrtc_answer")
+        await self.pc.setRemoteDescription(RTCSessionDescription(**answer["answer"]))
+        self.setup_seconds = time.monotonic() - started
+
+
+class SyntheticReceiver(SignalingClient):
+    def __init__(self, session, url, sender):
+        super().__init__(session, url)
+        self.sender = sender
+        self.join_seconds = None
+        self.latencies = []
+        self.frames_received = 0
+        self.frames_lost = 0
+        # Why the track stopped delivering, if it failed rather than ended
+        self.error = None
+        self._consumer = None
+
+    async def start(self):
+        await self.connect()
+        join_started = time.monotonic()
+
+        @self.pc.on("track")
+        def on_track(track):
+            self._consumer = asyncio.create_task(self.consume(track, join_started))
+
+        await self.send(
+            {"type": "start_receiving", "stream_id": self.sender.stream_id}
+        )
+        offer = await self.receive("webrtc_offer")
+        await self.pc.setRemoteDescription(RTCSessionDescription(**offer["offer"]))
+        await self.pc.setLocalDescription(await self.pc.createAnswer())
+        await self.send(
+            {
+                "type": "webrtc_answer",
+                "answer": {
+                    "sdp": self.pc.localDescription.sdp,
+                    "type": self.pc.localDescription.type,
+                },
+            }
+        )
+
+    async def consume(self, track, join_started):
+        expected_pts = None
+        in_pulse = False
+        try:
+            while True:
+                frame = await track.recv()
+                now = time.monotonic()
+                if self.join_seconds is None:
+                    self.join_seconds = now - join_started
+
+                self.frames_received += 1
+                if frame.pts is not None:
+                    if expected_pts is not None and frame.pts > expected_pts:
+                        gap = frame.pts - expected_pts
+                        self.frames_lost += gap // frame.samples
+                    expected_pts = frame.pts + frame.samples
+
+                channels = len(frame.layout.channels)
+                mono = frame.to_ndarray().reshape(-1, channels).mean(axis=1) / 32768.0
+                rms = float(np.sqrt(np.mean(np.square(mono))))
+                if rms >= DETECT_RMS and not in_pulse:
+                    in_pulse = True
+                    self.match_pulse(mono, frame.sample_rate, now)
+                elif rms < DETECT_RMS:
+                    in_pulse = False
+        except MediaStreamError:
+            pass  # the track ended, e.g. when the peer connection closed
+        except Exception as e:
+            self.error = repr(e)
+            print(f"receiver failed: {self.error}", file=sys.stderr)
+
+    def match_pulse(self, mono, sample_rate, detected_at):
+        spectrum = np.abs(np.fft.rfft(mono))
+        peak_hz = np.argmax(spectrum) * sample_rate / len(mono)
+        slot = round((peak_hz - PULSE_BASE_HZ) / PULSE_STEP_HZ) % PULSE_SLOTS
+        # Newest pulse with this frequency that was sent before we heard it
+        for sent_at, sequence in reversed(self.sender.track.pulses):
+            if sent_at <= detected_at and sequence % PULSE_SLOTS == slot:
+                self.latencies.append(detected_at - sent_at)
+                return
+
+    async def close(self):
+        if self._consumer:
+            self._consumer.cancel()
+        await super().close()
+
+
+class ProcessSampler:
+    """CPU and RSS of a process from /proc (Linux only)"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.rss_samples = []
+        self._start_cpu = None
+        self._start_wall = None
+
+    def _cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15, i.e. 11 and 12 after the name
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def _rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def start(self):
+        self._start_cpu = self._cpu_seconds()
+        self._start_wall = time.monotonic()
+
+    def sample(self):
+        self.rss_samples.append(self._rss_mb())
+
+    def report(self):
+        wall = time.monotonic() - self._start_wall
+        return {
+            "pid": self.pid,
+            "cpu_percent": round(
+                (self._cpu_seconds() - self._start_cpu) / wall * 100, 1
+            ),
+            "rss_mb_max": round(max(self.rss_samples, default=0.0), 1),
+            "rss_mb_last": round(self.rss_samples[-1], 1) if self.rss_samples else None,
+        }
+
+
+def spawn_server(env=None):
+    """Start webrtc_server_relay.py next to this file, with extra environment"""
+    return subprocess.Popen(
+        [sys.executable, "webrtc_server_relay.py"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_for_server(session, health_url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(health_url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"server did not become healthy at {health_url}")
+
+
+async def run(args):
+    server = None
+    if args.spawn_server:
+        server = spawn_server()
+        args.server_pid = server.pid
+
+    health_url = args.url.replace("ws://", "http://").rsplit("/", 1)[0] + "/health"
+    samplers = {}
+    if sys.platform.startswith("linux"):
+        samplers["load_generator"] = ProcessSampler(os.getpid())
+        if args.server_pid:
+            samplers["server"] = ProcessSampler(args.server_pid)
+
+    senders, receivers = [], []
+    errors = []
+    async with aiohttp.ClientSession() as session:
+        try:
+            await wait_for_server(session, health_url)
+            for sampler in samplers.values():
+                sampler.start()
+
+            senders = [
+                SyntheticSender(session, args.url, args.signal, args.pulse_interval)
+                for _ in range(args.senders)
+            ]
+            results = await asyncio.gather(
+                *(sender.start() for sender in senders), return_exceptions=True
+            )
+            errors += [f"sender: {r}" for r in results if isinstance(r, Exception)]
+            live_senders = [
+                sender
+                for sender, result in zip(senders, results)
+                if not isinstance(result, Exception)
+            ]
+
+            # Give the relay a moment to see the first RTP from each sender
+            await asyncio.sleep(1.0)
+
+            receivers = [
+                SyntheticReceiver(session, args.url, sender)
+                for sender in live_senders
+                for _ in range(args.receivers)
+            ]
+            results = await asyncio.gather(
+                *(receiver.start() for receiver in receivers), return_exceptions=True
+            )
+            errors += [f"receiver: {r}" for r in results if isinstance(r, Exception)]
+
+            deadline = time.monotonic() + args.duration
+            while time.monotonic() < deadline:
+                for sampler in samplers.values():
+                    sampler.sample()
+                await asyncio.sleep(1.0)
+
+            process_reports = {
+                name: sampler.report() for name, sampler in samplers.items()
+            }
+        finally:
+            await asyncio.gather(
+                *(client.close() for client in receivers + senders),
+                return_exceptions=True,
+            )
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+    errors += [f"receiver: {r.error}" for r in receivers if r.error]
+    received = sum(r.frames_received for r in receivers)
+    lost = sum(r.frames_lost for r in receivers)
+    report = {
+        "config": {
+            "senders": args.senders,
+            "receivers_per_stream": args.receivers,
+            "duration_seconds": args.duration,
+            "signal": args.signal,
+        },
+        "sender_setup_ms": summarize(
+            [s.setup_seconds for s in senders if s.setup_seconds is not None]
+        ),
+        "join_latency_ms": summarize(
+            [r.join_seconds for r in receivers if r.join_seconds is not None]
+        ),
+        "e2e_latency_ms": summarize([lat for r in receivers for lat in r.latencies]),
+        "frames": {
+            "received": received,
+            "lost": lost,
+            "loss_ratio": round(lost / (received + lost), 5) if received + lost else None,
+            "receivers_without_audio": sum(
+                1 for r in receivers if not r.frames_received
+            ),
+            "receivers_failed": sum(1 for r in receivers if r.error),
+        },
+        "processes": process_reports,
+        "errors": errors,
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebRTC relay load test")
+    parser.add_argument("--url", default="ws://127.0.0.1:8080/ws")
+    parser.add_argument("--senders", type=int, default=1)
+    parser.add_argument(
+        "--receivers", type=int, default=4, help="receivers per stream"
+    )
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--signal", choices=("tone", "noise"), default="tone")
+    parser.add_argument("--pulse-interval", type=float, default=1.0)
+    parser.add_argument("--server-pid", type=int, help="pid to sample CPU/RSS from")
+    parser.add_argument(
+        "--spawn-server",
+        action="store_true",
+        help="start webrtc_server_relay.py locally for the run",
+    )
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Minimal Prometheus text-format metrics for the voice streaming server.
+
+The hot paths (per-frame receive, encode and send) hold on to a labelled
+child and only do attribute arithmetic on it, so recording a sample never
+builds label tuples, dicts or strings. All formatting happens at scrape time.
+"""
+
+import asyncio
+import math
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, tuned for LAN signaling and per-frame work
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ENCODE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.05)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values):
+        """Return the child for these label values, creating it on first use"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        """Drop a labelled child, e.g. when its stream or connection goes away"""
+        self._children.pop(tuple(str(value) for value in values), None)
+
+    def clear(self):
+        self._children.clear()
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for key, child in self._children.items():
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child):
+        labels = _format_labels(self.labelnames, key)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1):
+        self._children[()].value += amount
+
+    @property
+    def value(self):
+        return self._children[()].value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value):
+        self._children[()].value = value
+
+    @property
+    def value(self):
+        return self._children[()].value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def _render_child(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            labels = _format_labels(
+                self.labelnames, key, f'le="{_format_value(bound)}"'
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class StreamingMetrics:
+    """All metric families exported by the relay server on /metrics"""
+
+    def __init__(self):
+        self.uptime = Gauge("voice_uptime_seconds", "Seconds since server start")
+        self.connections = Gauge(
+            "voice_active_connections", "Open signaling WebSocket connections"
+        )
+        self.streams = Gauge("voice_active_streams", "Streams currently published")
+        self.audio_bytes = Counter(
+            "voice_audio_bytes_total", "Decoded audio bytes received from all senders"
+        )
+        self.process_cpu = Gauge(
+            "voice_process_cpu_percent",
+            "CPU used by the server process over the last second (100 = one core)",
+        )
+        self.loop_cpu = Gauge(
+            "voice_loop_cpu_percent",
+            "CPU used by the event loop thread over the last second (100 = saturated)",
+        )
+        self.admission_rejected = Counter(
+            "voice_admission_rejected_total",
+            "Connections, senders or receivers refused by admission control",
+            ["reason"],
+        )
+        self.streams_reaped = Counter(
+            "voice_streams_reaped_total",
+            "Streams removed by the stale stream reaper",
+            ["reason"],
+        )
+        self.reaper_freed = Counter(
+            "voice_reaper_freed_total",
+            "Subscriptions and encoders released when the reaper removed a stream",
+            ["resource"],
+        )
+        self.reaper_pending = Gauge(
+            "voice_reaper_pending_deadlines", "Stream deadlines queued in the reaper"
+        )
+        self.ws_messages_dropped = Counter(
+            "voice_ws_messages_dropped_total",
+            "Outbound WebSocket messages dropped because a client's queue was full",
+        )
+
+        # Per-stream media counters
+        self.frames_in = Counter(
+            "voice_stream_frames_in_total",
+            "Audio frames received from the sender",
+            ["stream"],
+        )
+        self.bytes_in = Counter(
+            "voice_stream_bytes_in_total",
+            "Decoded audio bytes received from the sender",
+            ["stream"],
+        )
+        self.frames_dropped = Counter(
+            "voice_stream_frames_dropped_total",
+            "Frames lost upstream (timestamp gaps) or skipped by slow listeners",
+            ["stream", "reason"],
+        )
+        self.frames_out = Counter(
+            "voice_stream_frames_out_total",
+            "Audio frames handed to WebRTC receivers",
+            ["stream"],
+        )
+        self.bytes_out = Counter(
+            "voice_stream_bytes_out_total",
+            "Encoded bytes written to HTTP listeners",
+            ["stream"],
+        )
+        self.comfort_silence_frames = Counter(
+            "voice_stream_comfort_silence_frames_total",
+            "Silent MP3 frames written to HTTP listeners while the sender stalled",
+            ["stream"],
+        )
+        self.vad_skipped_frames = Counter(
+            "voice_stream_vad_skipped_frames_total",
+            "Frames not encoded because voice activity detection saw silence",
+            ["stream"],
+        )
+        self.voice_active = Gauge(
+            "voice_stream_voice_active",
+            "1 while voice activity detection hears speech on the stream",
+            ["stream"],
+        )
+        self.mixer_inputs = Gauge(
+            "voice_mixer_inputs", "Sender streams summed into the mix stream"
+        )
+        self.recording_bytes = Counter(
+            "voice_recording_bytes_total", "Ogg Opus bytes written by stream recorders"
+        )
+        self.recordings_active = Gauge(
+            "voice_recordings_active", "Streams currently being recorded"
+        )
+        self.encode_seconds = Histogram(
+            "voice_encode_seconds",
+            "Resample and encode time per frame",
+            ["codec"],
+            buckets=ENCODE_BUCKETS,
+        )
+        self.encode_loop_seconds = Counter(
+            "voice_encode_loop_blocked_seconds_total",
+            "Encoder time spent on the event loop thread instead of the encoder pool",
+            ["codec"],
+        )
+
+        # Per-peer transport stats, refreshed from aiortc getStats() at scrape time
+        self.jitter = Gauge(
+            "voice_peer_jitter_seconds",
+            "Interarrival jitter reported for the peer's audio stream",
+            ["connection", "role"],
+        )
+        self.rtt = Gauge(
+            "voice_peer_round_trip_seconds",
+            "Round trip time reported by RTCP for the peer",
+            ["connection", "role"],
+        )
+        self.packets_lost = Gauge(
+            "voice_peer_packets_lost",
+            "Cumulative packets lost reported for the peer",
+            ["connection", "role"],
+        )
+
+        # Signaling phases
+        self.offer_answer_seconds = Histogram(
+            "voice_signaling_offer_answer_seconds",
+            "Time from SDP offer to SDP answer",
+            ["role"],
+        )
+        self.join_first_packet_seconds = Histogram(
+            "voice_join_first_packet_seconds",
+            "Time from start_receiving to the first audio packet sent",
+        )
+
+        # Event loop health
+        self.loop_lag = Histogram(
+            "voice_event_loop_lag_seconds",
+            "Delay between a scheduled wakeup and when the loop ran it",
+            buckets=LOOP_LAG_BUCKETS,
+        )
+        self.loop_lag_last = Gauge(
+            "voice_event_loop_lag_last_seconds", "Most recent event loop lag sample"
+        )
+
+    def families(self):
+        return [value for value in vars(self).values() if isinstance(value, _Metric)]
+
+    def forget_stream(self, stream_id):
+        for family in (
+            self.frames_in,
+            self.bytes_in,
+            self.frames_out,
+            self.bytes_out,
+            self.comfort_silence_frames,
+            self.vad_skipped_frames,
+            self.voice_active,
+        ):
+            family.remove(stream_id)
+        for reason in (
+            "upstream",
+            "slow_listener",
+            "jitter_overflow",
+            "recorder",
+            "mix_overflow",
+        ):
+            self.frames_dropped.remove(stream_id, reason)
+
+    def forget_connection(self, connection_id):
+        for role in ("sender", "receiver"):
+            for family in (self.jitter, self.rtt, self.packets_lost):
+                family.remove(connection_id, role)
+
+    def render(self):
+        lines = []
+        for family in self.families():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+def merge_expositions(label, expositions):
+    """Merge text-format scrapes of several processes into one exposition.
+
+    `expositions` maps a label value to one process's scrape. Every sample
+    gets that value as an extra `label`, and samples of the same family from
+    all processes are grouped under one HELP/TYPE header as the format
+    requires.
+    """
+    headers = {}  # family name -> its HELP and TYPE lines
+    samples = {}  # family name -> relabelled samples from every process
+    for value, text in expositions.items():
+        extra = f'{label}="{_escape(value)}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = line.split(" ", 3)[2]
+                if line not in headers.setdefault(family, []):
+                    headers[family].append(line)
+                continue
+            if not line or line.startswith("#"):
+                continue
+            space = line.index(" ")
+            brace = line.find("{", 0, space)
+            if brace == -1:
+                line = f"{line[:space]}{{{extra}}}{line[space:]}"
+            else:
+                line = f"{line[:brace + 1]}{extra},{line[brace + 1:]}"
+            samples.setdefault(family or line[:space], []).append(line)
+
+    lines = []
+    for family in dict.fromkeys([*headers, *samples]):
+        lines.extend(headers.get(family, ()))
+        lines.extend(samples.get(family, ()))
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_loop_lag(metrics: StreamingMetrics, interval: float = 0.5):
+    """Sample event loop lag by measuring how late a fixed sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        metrics.loop_lag.observe(lag)
+        metrics.loop_lag_last.set(lag)
+
+
+async def monitor_process_cpu(metrics: StreamingMetrics, interval: float = 1.0):
+    """Track CPU usage of the whole process and of the event loop thread.
+
+    Process CPU includes the encode thread pool and can exceed 100 on a
+    multi-core host while the loop is fine. Admission control looks at the
+    loop thread, which runs on the loop and so is what thread_time() measures
+    here.
+    """
+    last_cpu = time.process_time()
+    last_loop_cpu = time.thread_time()
+    last_wall = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        cpu, loop_cpu, wall = time.process_time(), time.thread_time(), time.monotonic()
+        elapsed = wall - last_wall
+        metrics.process_cpu.set(round((cpu - last_cpu) / elapsed * 100, 1))
+        metrics.loop_cpu.set(round((loop_cpu - last_loop_cpu) / elapsed * 100, 1))
+        last_cpu, last_loop_cpu, last_wall = cpu, loop_cpu, wall
@@ -0,0 +1,206 @@
+"""
+Server-side mix of all sender streams into one track.
+
+In mix mode every sender is also an input of a StreamMixer, and the mix is
+published as one more stream (``MIX_STREAM_ID``). Receivers and MP3
+listeners subscribe to that single stream instead of one per sender, and
+the mix is computed once per 20ms no matter how many of them there are.
+
+Each input pulls decoded frames from its own MediaRelay subscription,
+resamples them to 48kHz stereo s16 and queues the samples. Every tick the
+mixer takes one 20ms frame from each input, sums them in an int32
+accumulator with per-input Q15 gain, clips to int16 and emits the frame.
+Inputs that have nothing queued contribute silence; inputs that queue more
+than ``MAX_BUFFERED_SECONDS`` drop their oldest samples so a bursty sender
+can't add latency to the whole mix.
+"""
+
+import asyncio
+import fractions
+import logging
+import time
+from collections import deque
+
+import av
+import numpy as np
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from audio_levels import plane_view
+
+logger = logging.getLogger(__name__)
+
+MIX_STREAM_ID = "mix"
+MIX_SAMPLE_RATE = 48000
+MIX_CHANNELS = 2
+FRAME_SAMPLES = MIX_SAMPLE_RATE // 50  # 20ms
+MAX_BUFFERED_SECONDS = 0.1
+GAIN_ONE = 1 << 15  # Q15 fixed point
+
+
+class MixerInput:
+    """One sender's samples, queued as (n, channels) int16 chunks"""
+
+    def __init__(self, stream_id, track, dropped, gain=1.0):
+        self.stream_id = stream_id
+        self.track = track
+        self.set_gain(gain)
+        self._dropped = dropped
+        self._chunks = deque()
+        self._offset = 0  # samples of the first chunk already mixed
+        self.buffered = 0  # samples per channel queued
+        self._resampler = av.AudioResampler(
+            format="s16", layout="stereo", rate=MIX_SAMPLE_RATE
+        )
+        self._task = None
+
+    def set_gain(self, gain):
+        self.gain = gain
+        self._gain_q15 = int(round(gain * GAIN_ONE))
+
+    def start(self):
+        self._task = asyncio.create_task(self._pull())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.track.stop()
+
+    async def _pull(self):
+        try:
+            while True:
+                frame = await self.track.recv()
+                for r_frame in self._resampler.resample(frame):
+                    # Packed s16 stereo: one plane of interleaved samples,
+                    # queued as a view that keeps the resampled frame alive
+                    self.push(plane_view(r_frame).reshape(-1, MIX_CHANNELS))
+        except (asyncio.CancelledError, MediaStreamError):
+            pass
+        except Exception as e:
+            logger.warning(f"Mixer input {self.stream_id} stopped: {e}")
+
+    def push(self, samples):
+        self._chunks.append(samples)
+        self.buffered += len(samples)
+        excess = self.buffered - int(MAX_BUFFERED_SECONDS * MIX_SAMPLE_RATE)
+        if excess > 0:
+            self._skip(excess)
+            self._dropped.value += -(-excess // FRAME_SAMPLES)
+
+    def _skip(self, count):
+        while count > 0 and self._chunks:
+            available = len(self._chunks[0]) - self._offset
+            step = min(available, count)
+            self._advance(step)
+            count -= step
+
+    def _advance(self, count):
+        self._offset += count
+        self.buffered -= count
+        if self._offset == len(self._chunks[0]):
+            self._chunks.popleft()
+            self._offset = 0
+
+    def mix_into(self, acc):
+        """Add up to one frame of this input into the int32 accumulator"""
+        position = 0
+        while position < len(acc) and self._chunks:
+            chunk = self._chunks[0]
+            count = min(len(chunk) - self._offset, len(acc) - position)
+            samples = chunk[self._offset : self._offset + count]
+            target = acc[position : position + count]
+            if self._gain_q15 == GAIN_ONE:
+                target += samples
+            else:
+                target += (samples.astype(np.int32) * self._gain_q15) >> 15
+            position += count
+            self._advance(count)
+
+
+class MixedTrack(MediaStreamTrack):
+    """Audio track that emits the mixer's output on a 20ms clock"""
+
+    kind = "audio"
+
+    def __init__(self, mixer):
+        super().__init__()
+        self.mixer = mixer
+        self._start = None
+        self._pts = 0
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if self._start is None:
+            self._start = time.time()
+        else:
+            self._pts += FRAME_SAMPLES
+            wait = self._start + self._pts / MIX_SAMPLE_RATE - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elif wait < -1.0:
+                # The loop stalled, restart the clock instead of bursting
+                self._start = time.time() - self._pts / MIX_SAMPLE_RATE
+
+        frame = self.mixer.mix()
+        frame.pts = self._pts
+        frame.sample_rate = MIX_SAMPLE_RATE
+        frame.time_base = fractions.Fraction(1, MIX_SAMPLE_RATE)
+        return frame
+
+
+class StreamMixer:
+    def __init__(self, relay, metrics):
+        self.relay = relay
+        self.metrics = metrics
+        self.inputs = {}  # stream_id -> MixerInput
+        self.track = None
+        self._acc = np.zeros((FRAME_SAMPLES, MIX_CHANNELS), dtype=np.int32)
+        self._out = np.empty((1, FRAME_SAMPLES * MIX_CHANNELS), dtype=np.int16)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def add_input(self, stream_id, source_track, gain=1.0):
+        if self.track is None or self.track.readyState != "live":
+            self.track = MixedTrack(self)
+        mixer_input = MixerInput(
+            stream_id,
+            self.relay.subscribe(source_track),
+            self.metrics.frames_dropped.labels(MIX_STREAM_ID, "mix_overflow"),
+            gain,
+        )
+        mixer_input.start()
+        self.inputs[stream_id] = mixer_input
+        self.metrics.mixer_inputs.set(len(self.inputs))
+        logger.info(f"Mixing {stream_id} ({len(self.inputs)} inputs)")
+        return mixer_input
+
+    def remove_input(self, stream_id):
+        mixer_input = self.inputs.pop(stream_id, None)
+        if mixer_input is None:
+            return
+        mixer_input.stop()
+        self.metrics.mixer_inputs.set(len(self.inputs))
+        if not self.inputs and self.track is not None:
+            self.track.stop()
+            self.track = None
+
+    def set_gain(self, stream_id, gain):
+        mixer_input = self.inputs.get(stream_id)
+        if mixer_input is None:
+            return False
+        mixer_input.set_gain(gain)
+        return True
+
+    def mix(self):
+        """Sum one 20ms frame of every input into an s16 AudioFrame"""
+        acc = self._acc
+        acc.fill(0)
+        for mixer_input in self.inputs.values():
+            mixer_input.mix_into(acc)
+        np.clip(acc, -32768, 32767, out=acc)
+        # from_ndarray copies into the frame, so the output array is reused
+        np.copyto(self._out, acc.reshape(1, -1), casting="unsafe")
+        return av.AudioFrame.from_ndarray(self._out, format="s16", layout="stereo")
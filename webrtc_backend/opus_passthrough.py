@@ -0,0 +1,174 @@
+"""
+Encode-once Opus forwarding for WebRTC receivers.
+
+With MediaRelay every receiver's RTCRtpSender gets decoded frames and runs
+its own Opus encoder. OpusPacketRelay instead taps the sender's encoded RTP
+payloads as they arrive and hands them to each receiver as av.Packet
+objects. aiortc's sender packs those as-is, so per-receiver work drops to
+RTP packetization and SRTP, like an SFU.
+
+Decoding still happens once per stream in the sender's RTCRtpReceiver, which
+keeps MP3 egress and visualization working on decoded frames.
+
+The tap relies on two aiortc internals: RTCRtpTransceiver._codecs and
+RTCRtpReceiver._handle_rtp_packet(packet, arrival_time_ms), which the RTP
+router looks up on the receiver for every packet. Verified against aiortc
+1.9.0 (the pinned version) and 1.15.0. When either is missing or looks
+different, attach() returns None and the stream falls back to decoded relay
+tracks; the server also falls back if the tap never sees a packet.
+"""
+
+import asyncio
+import fractions
+import inspect
+import logging
+
+import av
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+logger = logging.getLogger(__name__)
+
+OPUS_TIME_BASE = fractions.Fraction(1, 48000)
+
+
+class OpusPacketRelay:
+    """Fans one sender's Opus RTP payloads out to any number of tracks"""
+
+    def __init__(self, payload_type=None, queue_size=25):
+        self.payload_type = payload_type
+        self.queue_size = queue_size
+        self.ended = False
+        self._queues = set()
+        self._last_timestamp = None
+        self._pts = 0
+        # RTP packets seen by the tap, to tell a working tap from a dead one
+        self.tapped = 0
+
+    @classmethod
+    def attach(cls, pc, track):
+        """Tap the RTCRtpReceiver behind a remote track, or None if not possible"""
+        for transceiver in pc.getTransceivers():
+            if transceiver.receiver.track is track:
+                break
+        else:
+            return None
+
+        codecs = getattr(transceiver, "_codecs", None)
+        if not isinstance(codecs, list):
+            logger.warning("aiortc transceiver has no _codecs list, not tapping Opus")
+            return None
+        payload_type = None
+        for codec in codecs:
+            if getattr(codec, "mimeType", "").lower() == "audio/opus":
+                payload_type = codec.payloadType
+                break
+        else:
+            if codecs:
+                # Negotiated something other than Opus, packets can't be forwarded
+                return None
+
+        receiver = transceiver.receiver
+        handle_rtp_packet = getattr(receiver, "_handle_rtp_packet", None)
+        if not callable(handle_rtp_packet) or not cls._takes_packet(handle_rtp_packet):
+            logger.warning(
+                "aiortc RTCRtpReceiver._handle_rtp_packet missing or changed, "
+                "not tapping Opus"
+            )
+            return None
+
+        relay = cls(payload_type)
+
+        async def tap_rtp_packet(packet, arrival_time_ms):
+            relay.tapped += 1
+            relay.push(packet)
+            await handle_rtp_packet(packet, arrival_time_ms)
+
+        # The RTP router looks this up on the instance for every packet
+        receiver._handle_rtp_packet = tap_rtp_packet
+        return relay
+
+    @staticmethod
+    def _takes_packet(method):
+        """Whether `method` still has the (packet, arrival_time_ms) signature"""
+        try:
+            parameters = list(inspect.signature(method).parameters)
+        except (TypeError, ValueError):
+            return False
+        return parameters == ["packet", "arrival_time_ms"]
+
+    def push(self, packet):
+        if self.ended or not packet.payload:
+            return
+        if self.payload_type is None:
+            self.payload_type = packet.payload_type
+        elif packet.payload_type != self.payload_type:
+            return
+
+        if self._last_timestamp is not None:
+            delta = (packet.timestamp - self._last_timestamp) & 0xFFFFFFFF
+            if delta == 0 or delta >= 0x80000000:
+                # Duplicate or late packet, receivers already moved past it
+                return
+            self._pts += delta
+        self._last_timestamp = packet.timestamp
+
+        item = (packet.payload, self._pts)
+        for queue in self._queues:
+            if queue.full():
+                # Slow consumer: drop its oldest packet rather than fall behind
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if self.ended:
+            queue.put_nowait(None)
+        else:
+            self._queues.add(queue)
+        return OpusPassthroughTrack(self, queue)
+
+    def unsubscribe(self, queue):
+        self._queues.discard(queue)
+
+    def stop(self):
+        self.ended = True
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._queues.clear()
+
+    @property
+    def subscribers(self):
+        return len(self._queues)
+
+
+class OpusPassthroughTrack(MediaStreamTrack):
+    """Audio track yielding already-encoded Opus packets instead of frames"""
+
+    kind = "audio"
+
+    def __init__(self, relay, queue):
+        super().__init__()
+        self._relay = relay
+        self._queue = queue
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        item = await self._queue.get()
+        if item is None:
+            self.stop()
+            raise MediaStreamError
+
+        payload, pts = item
+        packet = av.Packet(payload)
+        packet.pts = pts
+        packet.time_base = OPUS_TIME_BASE
+        return packet
+
+    def stop(self):
+        super().stop()
+        self._relay.unsubscribe(self._queue)
@@ -0,0 +1,89 @@
+"""
+Per-connection outbound message queue for signaling WebSockets.
+
+Every connection gets a bounded queue drained by its own writer task, so a
+broadcast is just an O(n) loop of non-blocking enqueues and one stalled
+client can never hold up messages to the others.
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+    """Bounded FIFO of messages for one WebSocket.
+
+    Overflow policy:
+    - messages sent with a ``coalesce_key`` replace any still-unsent message
+      with the same key in place (state snapshots like ``available_streams``
+      or the latest ``audio_levels``), so they never grow the queue;
+    - otherwise, when the queue is full the oldest message is dropped.
+    """
+
+    def __init__(self, ws, maxsize: int = 64, dropped_counter=None):
+        self.ws = ws
+        self.maxsize = maxsize
+        self._queue = deque()  # entries are [coalesce_key, message]
+        self._pending = {}  # coalesce_key -> queued entry
+        self._ready = asyncio.Event()
+        self._dropped_counter = dropped_counter
+        self.dropped = 0
+        self._task = asyncio.create_task(self._drain())
+
+    def __len__(self):
+        return len(self._queue)
+
+    def send(self, message, coalesce_key=None):
+        """Queue a str or bytes message without waiting on the socket"""
+        if self._task.done():
+            return
+
+        if coalesce_key is not None:
+            entry = self._pending.get(coalesce_key)
+            if entry is not None:
+                entry[1] = message
+                return
+
+        if len(self._queue) >= self.maxsize:
+            old_key, _ = self._queue.popleft()
+            if old_key is not None:
+                self._pending.pop(old_key, None)
+            self.dropped += 1
+            if self._dropped_counter is not None:
+                self._dropped_counter.value += 1
+
+        entry = [coalesce_key, message]
+        self._queue.append(entry)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = entry
+        self._ready.set()
+
+    def close(self):
+        self._task.cancel()
+        self._queue.clear()
+        self._pending.clear()
+
+    async def _drain(self):
+        try:
+            while True:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                key, message = self._queue.popleft()
+                if key is not None:
+                    self._pending.pop(key, None)
+
+                if isinstance(message, bytes):
+                    await self.ws.send_bytes(message)
+                else:
+                    await self.ws.send_str(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Socket is gone; the connection's read loop will clean up
+            logger.debug(f"Outbound writer stopped: {e}")
@@ -0,0 +1,274 @@
+"""
+Opt-in recording of streams to segmented Ogg Opus files.
+
+A StreamRecorder takes the stream's Opus packets from its OpusPacketRelay
+when passthrough is on, so recording costs no encode at all. Otherwise it
+subscribes to decoded frames via MediaRelay and encodes them with aiortc's
+Opus encoder. All encoding, page building and disk I/O happen on the
+recorder's own writer thread. The capture task on the event loop only
+enqueues packets and never blocks; if the disk falls behind, packets are
+dropped and counted instead of stalling the live path.
+
+Layout of one recording:
+
+    {recordings_dir}/{stream_id}-{YYYYmmdd-HHMMSS}/
+        000.opus, 001.opus, ...   standalone Ogg Opus segments
+        index.jsonl               {"t", "segment", "offset"} per Ogg page
+
+Segments rotate by duration or size. Files are preallocated in chunks with
+posix_fallocate, written append-only with pwrite and truncated to their real
+length on rotation. The index maps recording time to a page boundary, so an
+HTTP range request can start playback anywhere.
+"""
+
+import bisect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from containers import (
+    OPUS_PRE_SKIP,
+    OPUS_SAMPLE_RATE,
+    ogg_page,
+    opus_head,
+    opus_packet_channels,
+    opus_packet_samples,
+    opus_tags,
+)
+
+logger = logging.getLogger(__name__)
+
+RECORDINGS_DIR = "recordings"
+SEGMENT_SECONDS = 300
+SEGMENT_BYTES = 16 * 1024 * 1024
+PREALLOCATE_BYTES = 1024 * 1024
+# ~1s of 20ms packets per Ogg page, and one index entry per page
+PACKETS_PER_PAGE = 50
+QUEUE_SIZE = 500
+
+
+class OggOpusSegment:
+    """One standalone Ogg Opus file, written append-only from the writer thread"""
+
+    def __init__(self, path, serial, channels, preallocate=PREALLOCATE_BYTES):
+        self.path = path
+        self.serial = serial
+        self.preallocate = preallocate
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = 0
+        self._allocated = 0
+        self._sequence = 0
+        self._granule = 0
+        self._packets = []
+        self.samples = 0  # audio samples written, excluding pre-skip
+
+        self._write_page([opus_head(channels)], 0, 0x02)
+        self._write_page([opus_tags()], 0, 0x00)
+        self._granule = OPUS_PRE_SKIP
+
+    def add(self, packet):
+        """Queue a packet; returns the offset of a page flushed before it, if any"""
+        offset = None
+        lacing = len(packet) // 255 + 1
+        if self._packets and (
+            len(self._packets) >= PACKETS_PER_PAGE
+            or sum(len(p) // 255 + 1 for p in self._packets) + lacing > 255
+        ):
+            offset = self.flush()
+        samples = opus_packet_samples(packet)
+        self._granule += samples
+        self.samples += samples
+        self._packets.append(packet)
+        return offset
+
+    def flush(self, last=False):
+        """Write pending packets as one page; returns its byte offset"""
+        if not self._packets and not last:
+            return None
+        offset = self.size
+        self._write_page(self._packets, self._granule, 0x04 if last else 0x00)
+        self._packets = []
+        return offset
+
+    def _write_page(self, packets, granule, header_type):
+        self._write(ogg_page(packets, granule, self.serial, self._sequence, header_type))
+        self._sequence += 1
+
+    def _write(self, data):
+        end = self.size + len(data)
+        if end > self._allocated and hasattr(os, "posix_fallocate"):
+            # Grow in large chunks so the file system keeps the extent contiguous
+            grow = max(self.preallocate, end - self._allocated)
+            try:
+                os.posix_fallocate(self.fd, self._allocated, grow)
+                self._allocated += grow
+            except OSError:
+                self._allocated = end
+        written = os.pwrite(self.fd, data, self.size)
+        self.size += written
+
+    def close(self):
+        self.flush(last=True)
+        # Give back the unused preallocated tail
+        os.ftruncate(self.fd, self.size)
+        os.close(self.fd)
+
+
+class StreamRecorder:
+    def __init__(
+        self,
+        stream_id,
+        track,
+        directory,
+        metrics,
+        segment_seconds=SEGMENT_SECONDS,
+        segment_bytes=SEGMENT_BYTES,
+    ):
+        """`track` yields Opus av.Packets (passthrough) or decoded audio frames"""
+        self.stream_id = stream_id
+        self.track = track
+        self.name = f"{stream_id}-{time.strftime('%Y%m%d-%H%M%S')}"
+        self.path = os.path.join(directory, self.name)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.stopped = False
+        self._bytes = metrics.recording_bytes
+        self._dropped = metrics.frames_dropped.labels(stream_id, "recorder")
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._task = None
+        self._thread = threading.Thread(
+            target=self._write_loop, name=f"recorder-{stream_id}", daemon=True
+        )
+
+    def start(self, loop):
+        os.makedirs(self.path, exist_ok=True)
+        self._thread.start()
+        self._task = loop.create_task(self._capture_loop())
+        logger.info(f"Recording {self.stream_id} to {self.path}")
+
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.track.stop()
+        self._enqueue(None)
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if item is None:
+                # The writer must still learn to finish, block briefly for it
+                self._queue.put(item)
+            else:
+                self._dropped.value += 1
+
+    async def _capture_loop(self):
+        try:
+            while True:
+                self._enqueue(await self.track.recv())
+        except Exception as e:
+            if not self.stopped:
+                logger.info(f"Recording source for {self.stream_id} ended: {e}")
+        finally:
+            self.stop()
+
+    def _write_loop(self):
+        encoder = None
+        segment = None
+        segment_index = 0
+        recorded = 0.0  # seconds in finished segments
+        index = open(os.path.join(self.path, "index.jsonl"), "a", buffering=1)
+
+        def write_index(t, offset):
+            index.write(
+                json.dumps({"t": round(t, 3), "segment": segment_name, "offset": offset})
+                + "\n"
+            )
+
+        def close_segment():
+            # The final page holds whatever was queued since the last flush
+            offset = segment.size
+            segment.close()
+            self._bytes.inc(segment.size - offset)
+            if segment.size > offset:
+                write_index(pending_time, offset)
+
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                if hasattr(item, "samples"):
+                    # Decoded frame: encode here, off the event loop
+                    if encoder is None:
+                        from aiortc.codecs.opus import OpusEncoder
+
+                        encoder = OpusEncoder()
+                    packets, _ = encoder.encode(item)
+                else:
+                    packets = [bytes(item)]
+
+                for packet in packets:
+                    if segment is None:
+                        segment_name = f"{segment_index:03d}.opus"
+                        # The source's own channel count, so a mono stream
+                        # isn't declared stereo in OpusHead
+                        segment = OggOpusSegment(
+                            os.path.join(self.path, segment_name),
+                            serial=segment_index,
+                            channels=opus_packet_channels(packet),
+                        )
+                        pending_time = recorded
+                    before = segment.size
+                    page_offset = segment.add(packet)
+                    self._bytes.inc(segment.size - before)
+                    if page_offset is not None:
+                        write_index(pending_time, page_offset)
+                        # The next page starts with the packet just added
+                        pending_time = (
+                            recorded
+                            + (segment.samples - opus_packet_samples(packet))
+                            / OPUS_SAMPLE_RATE
+                        )
+
+                    duration = segment.samples / OPUS_SAMPLE_RATE
+                    if (
+                        duration >= self.segment_seconds
+                        or segment.size >= self.segment_bytes
+                    ):
+                        close_segment()
+                        recorded += duration
+                        segment = None
+                        segment_index += 1
+        except Exception as e:
+            logger.error(f"Recorder for {self.stream_id} failed: {e}")
+        finally:
+            if segment is not None:
+                close_segment()
+            index.close()
+            logger.info(f"Recording of {self.stream_id} finished")
+
+
+def read_index(path):
+    """Load a recording's index as a list of {t, segment, offset}"""
+    entries = []
+    with open(os.path.join(path, "index.jsonl")) as index:
+        for line in index:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+def seek(entries, t):
+    """Index entry of the page that contains recording time `t`"""
+    if not entries:
+        return None
+    times = [entry["t"] for entry in entries]
+    return entries[max(0, bisect.bisect_right(times, t) - 1)]
@@ -0,0 +1,82 @@
+"""
+In-memory instant replay of a stream's recent MP3 packets.
+
+A ReplayRing sits on a stream's AudioBroadcast as one more sink, next to HLS
+packagers, so it holds exactly the packets listeners were sent: nothing is
+decoded or encoded again to serve a replay. The ring keeps the most recent
+packets up to a duration and a byte budget, evicting the oldest first, and
+stays readable for a while after the stream ended so a just-finished
+message can still be played back.
+
+Served at ``/stream/{stream_id}/replay?seconds=N``, and used as pre-roll for
+``/stream/{stream_id}.mp3?preroll=N`` so a speaker starts with what was just
+said instead of joining mid-sentence.
+"""
+
+import asyncio
+import time
+from collections import deque
+from itertools import islice
+
+# Per-stream defaults; senders may ask for other limits up to the maximums.
+# Off unless configured or asked for: a ring keeps the stream's voice MP3
+# encoder running with no listener, about 2% of an x86 core per stream and
+# several times that on a Raspberry Pi.
+REPLAY_SECONDS = 0.0
+REPLAY_MAX_SECONDS = 300.0
+REPLAY_MAX_BYTES = 5 * 1024 * 1024
+# How long the ring of an ended stream stays available
+REPLAY_RETAIN_SECONDS = 120.0
+
+
+class ReplayRing:
+    """The most recent encoded packets of one stream, bounded by time and size"""
+
+    def __init__(self, stream_id, max_seconds, max_bytes=REPLAY_MAX_BYTES):
+        self.stream_id = stream_id
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.seconds = 0.0
+        self.bytes = 0
+        self.evicted = 0  # packets pushed out by either limit
+        self.ended_at = None
+        self._packets = deque()  # (data, duration), oldest first
+        self._ended = asyncio.Event()
+
+    def __len__(self):
+        return len(self._packets)
+
+    def add_packet(self, data, duration):
+        """Called by the broadcast for every published MP3 packet"""
+        self._packets.append((data, duration))
+        self.seconds += duration
+        self.bytes += len(data)
+        while self._packets and (
+            self.seconds > self.max_seconds or self.bytes > self.max_bytes
+        ):
+            old, old_duration = self._packets.popleft()
+            self.seconds -= old_duration
+            self.bytes -= len(old)
+            self.evicted += 1
+
+    def end(self):
+        if self.ended_at is None:
+            self.ended_at = time.monotonic()
+        self._ended.set()
+
+    async def wait_ended(self):
+        await self._ended.wait()
+
+    def last(self, seconds):
+        """Concatenated packets covering the most recent `seconds`"""
+        count = 0
+        covered = 0.0
+        for _, duration in reversed(self._packets):
+            if covered >= seconds:
+                break
+            covered += duration
+            count += 1
+        if not count:
+            return b""
+        start = len(self._packets) - count
+        return b"".join(data for data, _ in islice(self._packets, start, None))
@@ -0,0 +1,96 @@
+"""
+Typed state of signaling connections, published streams and subscriptions.
+
+These used to be plain dicts with keys added wherever they were first needed
+(``rtp_sender``, ``offer_sent_at``, ``last_activity``, ...). As slotted
+dataclasses every field is declared in one place. Reading one is a slot
+lookup instead of a dict lookup, an idle connection costs a fixed handful of
+slots instead of a dict, and a mistyped field raises AttributeError at once
+instead of quietly reading or writing a key nobody else looks at.
+
+Each object also carries an explicit lifecycle state:
+
+    Connection    OPEN -> NEGOTIATING -> CONNECTED -> CLOSED
+                  (back to OPEN when media stops or ICE fails, the signaling
+                  socket stays up)
+    Stream        LIVE -> ENDED
+    Subscription  PENDING -> ACTIVE -> CLOSED
+"""
+
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional, Set
+
+from aiohttp import web
+from aiortc import MediaStreamTrack, RTCPeerConnection, RTCRtpSender
+
+from audio_levels import VoiceActivityDetector
+from opus_passthrough import OpusPacketRelay
+from outbound_queue import OutboundQueue
+
+
+class ConnectionState(Enum):
+    OPEN = "open"  # signaling socket up, no peer connection
+    NEGOTIATING = "negotiating"  # peer connection created, SDP and ICE under way
+    CONNECTED = "connected"  # ICE connected, media can flow
+    CLOSED = "closed"  # socket gone, being cleaned up
+
+
+class StreamState(Enum):
+    LIVE = "live"
+    ENDED = "ended"  # removed from the registry
+
+
+class SubscriptionState(Enum):
+    PENDING = "pending"  # subscribed, nothing delivered yet
+    ACTIVE = "active"  # first audio or data went out
+    CLOSED = "closed"  # unsubscribed, or the stream ended
+
+
+@dataclass(slots=True, eq=False)
+class Connection:
+    """One signaling WebSocket and the peer connection negotiated over it"""
+
+    connection_id: str
+    ws: web.WebSocketResponse
+    # All messages to this client go through its own bounded queue
+    outbox: OutboundQueue
+    state: ConnectionState = ConnectionState.OPEN
+    role: Optional[str] = None  # "sender" or "receiver" once media is set up
+    pc: Optional[RTCPeerConnection] = None
+    # Stream published (sender) or listened to (receiver)
+    stream_id: Optional[str] = None
+    # Rooms joined; none means the client hears about every room
+    rooms: Set[str] = field(default_factory=set)
+    # Receivers: the sender whose track switch_stream replaces
+    rtp_sender: Optional[RTCRtpSender] = None
+    offer_sent_at: Optional[float] = None
+
+
+@dataclass(slots=True, eq=False)
+class Stream:
+    """A published audio stream"""
+
+    stream_id: str
+    track: MediaStreamTrack
+    sender_id: Optional[str] = None  # None for streams the server produces
+    room: Optional[str] = None  # None: global, part of every room
+    opus_relay: Optional[OpusPacketRelay] = None
+    # Not analysed (e.g. the mix) means never gated as silent
+    vad: Optional[VoiceActivityDetector] = None
+    mix: bool = False
+    state: StreamState = StreamState.LIVE
+    created_at: float = field(default_factory=time.monotonic)
+    last_activity: float = field(default_factory=time.monotonic)
+
+
+@dataclass(slots=True, eq=False)
+class Subscription:
+    """One subscriber's subscription of one kind ("receivers", "levels")"""
+
+    kind: str
+    stream_id: str
+    subscriber_id: str
+    state: SubscriptionState = SubscriptionState.PENDING
+    created_at: float = field(default_factory=time.monotonic)
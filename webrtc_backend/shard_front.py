@@ -0,0 +1,631 @@
+"""
+Front signaling process for running the relay as several worker processes.
+
+aiortc does DTLS/SRTP, Opus and MP3 work on one event loop, so a single
+relay process tops out at one core. In sharded mode the front process owns
+the public ports and spawns N workers, each a full VoiceStreamingServer on a
+loopback port. Media never crosses processes: a stream lives on the worker
+its sender was placed on, and receivers and MP3 listeners of that stream are
+routed to the same worker.
+
+- Senders are placed on the least loaded worker (CPU reported by the worker,
+  then connections routed to it by the front).
+- Every client WebSocket is proxied to one worker at a time, picked when the
+  client starts sending or receiving. Receiving a stream owned by another
+  worker moves the client's upstream there and renegotiates.
+- The front keeps one control WebSocket per worker, so it learns about every
+  stream_available / stream_ended and serves ``available_streams`` and those
+  broadcasts for the whole pool. Workers' own copies are filtered out.
+- ``/stream/*.mp3`` and ``/hls/*`` on the audio port are proxied to the
+  owning worker.
+- ``/metrics`` scrapes every worker and serves their samples with a
+  ``shard`` label; ``?format=json`` sums the workers' summaries.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+import uuid
+from typing import Dict
+
+import aiohttp
+from aiohttp import WSMsgType, web
+from metrics import CONTENT_TYPE, Gauge, merge_expositions
+from outbound_queue import OutboundQueue
+
+logger = logging.getLogger(__name__)
+
+# Loopback ports of worker i are base + i
+WORKER_BASE_PORT = 8090
+WORKER_AUDIO_BASE_PORT = 8190
+
+# How often workers are polled for load and restarted if they died
+WORKER_POLL_INTERVAL = 2.0
+
+# Ended streams whose owner is remembered so their replay can be proxied
+ENDED_OWNERS_KEPT = 100
+
+# Stream state messages the front answers itself for the whole pool
+STREAM_LIST_MESSAGES = (
+    "available_streams",
+    "stream_available",
+    "stream_ended",
+    "stream_vad",
+)
+
+
+class ShardedFront:
+    def __init__(
+        self,
+        worker_count: int,
+        worker_target,
+        worker_options: dict = None,
+        worker_base_port: int = WORKER_BASE_PORT,
+        worker_audio_base_port: int = WORKER_AUDIO_BASE_PORT,
+    ):
+        """`worker_target(options, port, audio_port)` runs one worker process"""
+        self.worker_target = worker_target
+        self.worker_options = worker_options or {}
+        self.workers = [
+            {
+                "index": index,
+                "process": None,
+                "port": worker_base_port + index,
+                "audio_port": worker_audio_base_port + index,
+                "streams": set(),
+                "clients": 0,
+                "cpu": 0.0,
+                "stats": {},  # last /metrics?format=json summary
+                "alive": False,
+            }
+            for index in range(worker_count)
+        ]
+        self.clients: Dict[str, dict] = {}
+        # stream_id -> owning worker, in the order streams became available
+        self.stream_owners: Dict[str, dict] = {}
+        self.stream_rooms: Dict[str, str] = {}  # stream_id -> room, None if global
+        # Owners of recently ended streams, whose replay workers still serve
+        self.ended_owners: Dict[str, dict] = {}
+        self.session = None
+        self.tasks = []
+        self.start_time = time.monotonic()
+
+        self.app = web.Application()
+        self.app.router.add_get("/health", self.health_check)
+        self.app.router.add_get("/metrics", self.metrics_handler)
+        self.app.router.add_get("/ws", self.websocket_handler)
+        self.audio_app = web.Application()
+        self.audio_app.router.add_get("/stream/latest.mp3", self.latest_audio_handler)
+        self.audio_app.router.add_get("/stream/room/{room}.mp3", self.room_audio_handler)
+        self.audio_app.router.add_get("/stream/status", self.audio_status_handler)
+        self.audio_app.router.add_get("/stream/{stream_id}.mp3", self.audio_handler)
+        self.audio_app.router.add_get("/stream/{stream_id}/replay", self.replay_handler)
+        self.audio_app.router.add_get("/hls/{stream_id}/{name}", self.hls_handler)
+        self.audio_app.router.add_get("/recordings", self.recordings_handler)
+        self.audio_app.router.add_get("/recordings/{tail:.+}", self.recordings_handler)
+
+    # Workers
+
+    def start_worker(self, worker: dict):
+        # Spawn, not fork: each worker builds its own event loop and aiortc state
+        context = multiprocessing.get_context("spawn")
+        process = context.Process(
+            target=self.worker_target,
+            args=(self.worker_options, worker["port"], worker["audio_port"]),
+            name=f"relay-worker-{worker['index']}",
+            daemon=True,
+        )
+        process.start()
+        worker["process"] = process
+        logger.info(
+            f"Started worker {worker['index']} (pid {process.pid}) on port {worker['port']}"
+        )
+
+    def worker_url(self, worker: dict, path: str, audio: bool = False):
+        port = worker["audio_port"] if audio else worker["port"]
+        return f"http://127.0.0.1:{port}{path}"
+
+    def least_loaded_worker(self):
+        live = [worker for worker in self.workers if worker["alive"]]
+        if not live:
+            return None
+        # CPU in 10% steps so a noisy reading doesn't outweigh client counts
+        return min(live, key=lambda worker: (worker["cpu"] // 10, worker["clients"]))
+
+    async def monitor_worker(self, worker: dict):
+        """Restart the worker if it exits and refresh its load figures"""
+        while True:
+            try:
+                if not worker["process"].is_alive():
+                    logger.error(
+                        f"Worker {worker['index']} exited "
+                        f"({worker['process'].exitcode}), restarting"
+                    )
+                    self.start_worker(worker)
+
+                async with self.session.get(
+                    self.worker_url(worker, "/metrics?format=json"),
+                    timeout=aiohttp.ClientTimeout(total=WORKER_POLL_INTERVAL),
+                ) as response:
+                    stats = await response.json()
+                worker["stats"] = stats
+                worker["cpu"] = stats.get("process_cpu_percent", 0.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Worker {worker['index']} not reachable: {e}")
+            await asyncio.sleep(WORKER_POLL_INTERVAL)
+
+    async def follow_worker_streams(self, worker: dict):
+        """Mirror a worker's stream availability over a control WebSocket"""
+        while True:
+            try:
+                async with self.session.ws_connect(self.worker_url(worker, "/ws")) as ws:
+                    worker["alive"] = True
+                    logger.info(f"Control connection to worker {worker['index']} up")
+                    async for msg in ws:
+                        if msg.type != WSMsgType.TEXT:
+                            continue
+                        data = json.loads(msg.data)
+                        if data.get("type") == "available_streams":
+                            for stream_id in set(worker["streams"]) - set(data["streams"]):
+                                self.stream_ended(worker, stream_id)
+                            rooms = data.get("rooms", {})
+                            for stream_id in data["streams"]:
+                                self.stream_available(worker, stream_id, rooms.get(stream_id))
+                        elif data.get("type") == "stream_available":
+                            self.stream_available(worker, data["stream_id"], data.get("room"))
+                        elif data.get("type") == "stream_ended":
+                            self.stream_ended(worker, data["stream_id"])
+                        elif data.get("type") == "stream_vad":
+                            room = self.stream_rooms.get(data["stream_id"])
+                            for client in self.audience(room):
+                                client["outbox"].send(
+                                    msg.data,
+                                    coalesce_key=f"stream_vad:{data['stream_id']}",
+                                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Control connection to worker {worker['index']}: {e}")
+
+            if worker["alive"]:
+                logger.warning(f"Lost worker {worker['index']}, dropping its streams")
+                worker["alive"] = False
+                for stream_id in list(worker["streams"]):
+                    self.stream_ended(worker, stream_id)
+            await asyncio.sleep(0.5)
+
+    def stream_available(self, worker: dict, stream_id: str, room: str = None):
+        if stream_id in worker["streams"]:
+            return
+        worker["streams"].add(stream_id)
+        self.stream_owners[stream_id] = worker
+        self.stream_rooms[stream_id] = room
+        self.broadcast(
+            json.dumps({"type": "stream_available", "stream_id": stream_id, "room": room}),
+            room,
+        )
+
+    def stream_ended(self, worker: dict, stream_id: str):
+        if stream_id not in worker["streams"]:
+            return
+        worker["streams"].discard(stream_id)
+        if self.stream_owners.get(stream_id) is worker:
+            del self.stream_owners[stream_id]
+        self.ended_owners[stream_id] = worker
+        while len(self.ended_owners) > ENDED_OWNERS_KEPT:
+            del self.ended_owners[next(iter(self.ended_owners))]
+        room = self.stream_rooms.pop(stream_id, None)
+        self.broadcast(
+            json.dumps({"type": "stream_ended", "stream_id": stream_id, "room": room}),
+            room,
+        )
+
+    def latest_stream(self, room: str = None):
+        # Dicts keep insertion order, the newest stream is last
+        if room is None:
+            return next(reversed(self.stream_owners), None)
+        return next(
+            (s for s in reversed(self.stream_owners) if self.stream_rooms.get(s) == room),
+            None,
+        )
+
+    # Client signaling
+
+    def audience(self, room: str = None):
+        """Clients to notify about a stream in `room` (None: global)"""
+        return [
+            client
+            for client in self.clients.values()
+            if room is None or not client["rooms"] or room in client["rooms"]
+        ]
+
+    def broadcast(self, message: str, room: str = None):
+        for client in self.audience(room):
+            client["outbox"].send(message)
+
+    def send_available_streams(self, client: dict):
+        streams = [
+            stream_id
+            for stream_id in self.stream_owners
+            if not client["rooms"]
+            or self.stream_rooms.get(stream_id) in client["rooms"]
+            or self.stream_rooms.get(stream_id) is None
+        ]
+        client["outbox"].send(
+            json.dumps(
+                {
+                    "type": "available_streams",
+                    "streams": streams,
+                    "rooms": {
+                        stream_id: self.stream_rooms.get(stream_id) for stream_id in streams
+                    },
+                }
+            ),
+            coalesce_key="available_streams",
+        )
+
+    def client_room(self, client: dict, data: dict):
+        """Room a receive request is about: its own, or the client's only room"""
+        if data.get("room"):
+            return data["room"]
+        if len(client["rooms"]) == 1:
+            return next(iter(client["rooms"]))
+        return None
+
+    def send_error(self, client: dict, message: str, code: str = None):
+        error = {"type": "error", "message": message}
+        if code:
+            error["code"] = code
+        client["outbox"].send(json.dumps(error))
+
+    async def websocket_handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        client_id = str(uuid.uuid4())
+        client = {
+            "ws": ws,
+            "outbox": OutboundQueue(ws),
+            "worker": None,
+            "upstream": None,
+            "pump": None,
+            # Rooms joined; none means the client hears about every room
+            "rooms": set(),
+        }
+        self.clients[client_id] = client
+
+        try:
+            self.send_available_streams(client)
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        await self.route_message(client, json.loads(msg.data))
+                    except json.JSONDecodeError:
+                        logger.error(f"Invalid JSON received from {client_id}")
+                    except Exception as e:
+                        logger.error(f"Error routing message from {client_id}: {e}", exc_info=True)
+                elif msg.type == WSMsgType.ERROR:
+                    logger.error(f"WebSocket error: {ws.exception()}")
+        finally:
+            await self.detach_upstream(client)
+            client["outbox"].close()
+            del self.clients[client_id]
+
+        return ws
+
+    async def route_message(self, client: dict, data: dict):
+        message_type = data.get("type")
+
+        if message_type == "get_available_streams":
+            self.send_available_streams(client)
+            return
+
+        if message_type in ("join_room", "leave_room"):
+            # Room membership only filters the notifications the front sends
+            room = data.get("room")
+            if message_type == "join_room" and room:
+                client["rooms"].add(room)
+            elif message_type == "leave_room":
+                if room:
+                    client["rooms"].discard(room)
+                else:
+                    client["rooms"].clear()
+            self.send_available_streams(client)
+            return
+
+        if message_type == "start_sending":
+            worker = self.least_loaded_worker()
+            if worker is None:
+                self.send_error(client, "No relay worker available", "server_busy")
+                return
+            await self.attach_upstream(client, worker)
+
+        elif message_type in ("start_receiving", "switch_stream", "subscribe_levels"):
+            stream_id = data.get("stream_id") or self.latest_stream(
+                self.client_room(client, data)
+            )
+            worker = self.stream_owners.get(stream_id)
+            if worker is None:
+                if message_type != "subscribe_levels":
+                    self.send_error(client, "No audio stream available")
+                return
+            data = dict(data, stream_id=stream_id)
+            if client["worker"] is not worker:
+                if message_type == "subscribe_levels" and client["worker"] is not None:
+                    # Levels only flow on the worker that owns the stream
+                    logger.debug(f"Ignoring levels subscription for remote stream {stream_id}")
+                    return
+                await self.attach_upstream(client, worker)
+                if message_type == "switch_stream":
+                    # New worker means a new peer connection, so renegotiate
+                    data["type"] = "start_receiving"
+
+        elif message_type in ("start_recording", "stop_recording"):
+            stream_id = data.get("stream_id") or self.latest_stream(
+                self.client_room(client, data)
+            )
+            worker = self.stream_owners.get(stream_id)
+            if worker is None:
+                self.send_error(client, "No such stream to record", "stream_not_found")
+                return
+            data = dict(data, stream_id=stream_id)
+            if client["worker"] is None:
+                await self.attach_upstream(client, worker)
+            elif client["worker"] is not worker:
+                # Moving the client would drop its own peer connection
+                self.send_error(
+                    client, "Stream is on another relay worker", "stream_not_found"
+                )
+                return
+
+        if client["upstream"] is None:
+            return
+        try:
+            await client["upstream"].send_str(json.dumps(data))
+        except Exception as e:
+            logger.warning(f"Could not forward {message_type} to worker: {e}")
+
+    async def attach_upstream(self, client: dict, worker: dict):
+        """Point a client's signaling at `worker`, replacing any previous one"""
+        if client["worker"] is worker and client["upstream"] is not None:
+            return
+        await self.detach_upstream(client)
+        upstream = await self.session.ws_connect(self.worker_url(worker, "/ws"))
+        client["worker"] = worker
+        client["upstream"] = upstream
+        worker["clients"] += 1
+        client["pump"] = asyncio.create_task(self.pump_upstream(client, upstream))
+
+    async def detach_upstream(self, client: dict):
+        if client["upstream"] is None:
+            return
+        if client["pump"] is not asyncio.current_task():
+            client["pump"].cancel()
+        client["worker"]["clients"] -= 1
+        upstream = client["upstream"]
+        client["worker"] = client["upstream"] = client["pump"] = None
+        # Closing the socket makes the worker tear down the peer connection
+        await upstream.close()
+
+    async def pump_upstream(self, client: dict, upstream):
+        """Relay a worker's messages to the client, minus stream list updates"""
+        try:
+            async for msg in upstream:
+                if msg.type == WSMsgType.BINARY:
+                    client["outbox"].send(msg.data)
+                elif msg.type == WSMsgType.TEXT:
+                    message_type = json.loads(msg.data).get("type")
+                    if message_type not in STREAM_LIST_MESSAGES:
+                        client["outbox"].send(msg.data)
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.warning(f"Upstream connection error: {e}")
+
+        if client["upstream"] is upstream:
+            # The worker went away under a live session
+            await self.detach_upstream(client)
+            self.send_error(client, "Relay worker connection lost")
+
+    # HTTP
+
+    async def health_check(self, request):
+        return web.json_response(
+            {
+                "status": "healthy"
+                if all(worker["alive"] for worker in self.workers)
+                else "degraded",
+                "webrtc_available": True,
+                "active_streams": len(self.stream_owners),
+                "connected_clients": len(self.clients),
+                "uptime_seconds": int(time.monotonic() - self.start_time),
+                "workers": [
+                    {
+                        "index": worker["index"],
+                        "alive": worker["alive"],
+                        "pid": worker["process"].pid if worker["process"] else None,
+                        "streams": len(worker["streams"]),
+                        "clients": worker["clients"],
+                        "cpu_percent": worker["cpu"],
+                    }
+                    for worker in self.workers
+                ],
+            }
+        )
+
+    async def metrics_handler(self, request):
+        """Workers' Prometheus metrics labelled by shard, or a JSON summary"""
+        if request.query.get("format") == "json":
+            return web.json_response(self.metrics_summary())
+
+        scrapes = await asyncio.gather(
+            *(self.scrape_worker(worker) for worker in self.workers),
+            return_exceptions=True,
+        )
+        up = Gauge(
+            "voice_shard_up", "Whether the relay worker answered this scrape", ("shard",)
+        )
+        expositions = {}
+        for worker, scrape in zip(self.workers, scrapes):
+            shard = str(worker["index"])
+            if isinstance(scrape, Exception):
+                logger.debug(f"Worker {shard} metrics scrape failed: {scrape}")
+                up.labels(shard).set(0)
+            else:
+                up.labels(shard).set(1)
+                expositions[shard] = scrape
+        text = "\n".join(up.render()) + "\n"
+        if expositions:
+            text += merge_expositions("shard", expositions)
+        return web.Response(text=text, headers={"Content-Type": CONTENT_TYPE})
+
+    async def scrape_worker(self, worker: dict):
+        async with self.session.get(
+            self.worker_url(worker, "/metrics"),
+            timeout=aiohttp.ClientTimeout(total=WORKER_POLL_INTERVAL),
+        ) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    def metrics_summary(self):
+        """Sum of the workers' JSON summaries from their last load poll"""
+        stats = [worker["stats"] for worker in self.workers if worker["alive"]]
+        first_audio = [s.get("time_to_first_audio_ms") or {} for s in stats]
+        count = sum(entry.get("count", 0) for entry in first_audio)
+        total_ms = sum(
+            entry["avg"] * entry["count"] for entry in first_audio if entry.get("avg")
+        )
+        return {
+            "uptime_seconds": int(time.monotonic() - self.start_time),
+            "active_connections": len(self.clients),
+            "active_streams": len(self.stream_owners),
+            "total_audio_bytes": sum(s.get("total_audio_bytes", 0) for s in stats),
+            "process_cpu_percent": sum(s.get("process_cpu_percent", 0.0) for s in stats),
+            # The busiest loop is the first to refuse new clients
+            "loop_cpu_percent": max(
+                (s.get("loop_cpu_percent", 0.0) for s in stats), default=0.0
+            ),
+            "webrtc_available": bool(stats),
+            "time_to_first_audio_ms": {
+                "count": count,
+                "avg": round(total_ms / count, 1) if count else None,
+            },
+            "workers": [
+                {"shard": worker["index"], "alive": worker["alive"], **worker["stats"]}
+                for worker in self.workers
+            ],
+        }
+
+    async def audio_status_handler(self, request):
+        return web.json_response({"active_streams": list(self.stream_owners)})
+
+    async def latest_audio_handler(self, request):
+        stream_id = self.latest_stream()
+        if stream_id is None:
+            # Any live worker serves the standby page
+            worker = self.least_loaded_worker()
+            if worker is None:
+                return web.Response(status=503, text="Relay worker unavailable")
+            return await self.proxy_audio(request, worker, "/stream/latest.mp3")
+        path = f"/stream/{stream_id}.mp3"
+        if request.query_string:
+            path += f"?{request.query_string}"
+        return await self.proxy_audio(request, self.stream_owners[stream_id], path)
+
+    async def room_audio_handler(self, request):
+        stream_id = self.latest_stream(request.match_info["room"])
+        if stream_id is None:
+            return web.Response(status=404, text="No stream in this room")
+        path = f"/stream/{stream_id}.mp3"
+        if request.query_string:
+            path += f"?{request.query_string}"
+        return await self.proxy_audio(request, self.stream_owners[stream_id], path)
+
+    async def audio_handler(self, request):
+        stream_id = request.match_info["stream_id"]
+        worker = self.stream_owners.get(stream_id)
+        if worker is None:
+            return web.Response(status=404, text="Stream not found")
+        # Same path on the worker, including ?preroll= and ?seconds=
+        return await self.proxy_audio(request, worker, request.path_qs)
+
+    async def replay_handler(self, request):
+        stream_id = request.match_info["stream_id"]
+        worker = self.stream_owners.get(stream_id) or self.ended_owners.get(stream_id)
+        if worker is None or not worker["alive"]:
+            return web.Response(status=404, text="No replay for this stream")
+        return await self.proxy_audio(request, worker, request.path_qs)
+
+    async def hls_handler(self, request):
+        worker = self.stream_owners.get(request.match_info["stream_id"])
+        if worker is None:
+            return web.Response(status=404, text="Stream not found")
+        # Same path on the worker, including LL-HLS blocking reload parameters
+        return await self.proxy_audio(request, worker, request.path_qs)
+
+    async def recordings_handler(self, request):
+        # Workers share the recordings directory, so any live one can serve it
+        worker = next((w for w in self.workers if w["alive"]), None)
+        if worker is None:
+            return web.Response(status=502, text="Relay worker unavailable")
+        return await self.proxy_audio(request, worker, request.path_qs)
+
+    async def proxy_audio(self, request, worker: dict, path: str):
+        # Range lets players seek in recordings
+        headers = {"Range": request.headers["Range"]} if "Range" in request.headers else None
+        try:
+            upstream = await self.session.get(
+                self.worker_url(worker, path, audio=True), headers=headers
+            )
+        except Exception as e:
+            logger.error(f"Audio proxy to worker {worker['index']} failed: {e}")
+            return web.Response(status=502, text="Relay worker unavailable")
+
+        try:
+            response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+            for header in (
+                "Content-Type",
+                "Cache-Control",
+                "Content-Length",
+                "Content-Range",
+                "Accept-Ranges",
+            ):
+                if header in upstream.headers:
+                    response.headers[header] = upstream.headers[header]
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+        except asyncio.CancelledError:
+            logger.info("Client disconnected")
+        except Exception as e:
+            logger.error(f"Audio proxy error: {e}")
+        finally:
+            upstream.release()
+        return response
+
+    async def run_server(self, host: str = "0.0.0.0", port: int = 8080, audio_port: int = 8081):
+        # Long-lived MP3 and WebSocket proxies, so no overall timeout
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5)
+        )
+        for worker in self.workers:
+            self.start_worker(worker)
+            self.tasks.append(asyncio.create_task(self.monitor_worker(worker)))
+            self.tasks.append(asyncio.create_task(self.follow_worker_streams(worker)))
+
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        audio_runner = web.AppRunner(self.audio_app)
+        await audio_runner.setup()
+        await web.TCPSite(audio_runner, host, audio_port).start()
+        logger.info(
+            f"Sharded front started on {host}:{port} with {len(self.workers)} workers"
+        )
+
+        while True:
+            await asyncio.sleep(3600)
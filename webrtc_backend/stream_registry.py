@@ -0,0 +1,264 @@
+"""
+Registry of published streams and who is subscribed to them.
+
+Replaces the plain ``active_streams`` dict and the per-stream receiver lists
+with indexes that keep every hot-path lookup O(1):
+
+- the newest stream is the last key of an insertion-ordered dict, read with
+  ``reversed()`` instead of materialising ``list(keys())``;
+- subscribers are held per kind ("receivers", "levels", ...) as a set per
+  stream plus a reverse subscriber -> stream map, so subscribing, moving and
+  removing a subscriber never scans other streams or lists;
+- every stream carries ``created_at`` and ``last_activity`` timestamps;
+- streams published into a room (``Stream.room``) are also indexed per
+  room, so "latest stream in this room" is as cheap as the global one.
+  Streams without a room are global and belong to every room.
+
+Streams are session_state.Stream objects and the reverse index holds a
+Subscription per subscriber; the registry moves both through their
+lifecycle states as streams are removed and subscribers come and go.
+
+Listeners registered with ``on()`` are called synchronously on "added",
+"removed", "subscribed" and "unsubscribed" events.
+
+StreamReaper expires streams at per-stream deadlines kept in a min-heap.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from session_state import Stream, StreamState, Subscription, SubscriptionState
+
+logger = logging.getLogger(__name__)
+
+
+class StreamRegistry:
+    def __init__(self):
+        self._streams: Dict[str, Stream] = {}  # oldest first
+        # kind -> stream_id -> subscriber ids
+        self._subscribers: Dict[str, Dict[str, set]] = {}
+        # kind -> subscriber id -> subscription
+        self._subscribed_to: Dict[str, Dict[str, Subscription]] = {}
+        self._listeners: Dict[str, list] = {}
+        # room -> stream ids in that room, oldest first
+        self._rooms: Dict[str, Dict[str, None]] = {}
+        # Stream that stands in for "latest" while published, e.g. the mix
+        self.preferred: Optional[str] = None
+
+    def __len__(self):
+        return len(self._streams)
+
+    def __contains__(self, stream_id):
+        return stream_id in self._streams
+
+    def __iter__(self):
+        return iter(self._streams)
+
+    def ids(self):
+        return list(self._streams)
+
+    def items(self):
+        return self._streams.items()
+
+    def get(self, stream_id: Optional[str]) -> Optional[Stream]:
+        return self._streams.get(stream_id)
+
+    def latest(self, room: Optional[str] = None) -> Optional[str]:
+        """Id of the preferred stream if published, else the most recent one,
+        optionally only among the streams of `room`"""
+        if self.preferred in self._streams and (
+            room is None or self.room_of(self.preferred) in (None, room)
+        ):
+            return self.preferred
+        if room is None:
+            return next(reversed(self._streams), None)
+        return next(reversed(self._rooms.get(room, {})), None)
+
+    def resolve(
+        self, stream_id: Optional[str] = None, room: Optional[str] = None
+    ) -> Optional[str]:
+        """The requested stream id if published, the latest one if None"""
+        if not stream_id:
+            return self.latest(room)
+        return stream_id if stream_id in self._streams else None
+
+    def room_of(self, stream_id: str) -> Optional[str]:
+        stream = self._streams.get(stream_id)
+        return stream.room if stream else None
+
+    def in_rooms(self, rooms) -> list:
+        """Ids of the streams in any of `rooms`, plus global streams"""
+        return [
+            stream_id
+            for stream_id, stream in self._streams.items()
+            if stream.room is None or stream.room in rooms
+        ]
+
+    def add(self, stream: Stream) -> Stream:
+        stream_id = stream.stream_id
+        stream.last_activity = time.monotonic()
+        self._streams[stream_id] = stream
+        if stream.room is not None:
+            self._rooms.setdefault(stream.room, {})[stream_id] = None
+        self._emit("added", stream_id, stream)
+        return stream
+
+    def remove(self, stream_id: str) -> Optional[Stream]:
+        stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return None
+        stream.state = StreamState.ENDED
+        room = stream.room
+        if room is not None:
+            del self._rooms[room][stream_id]
+            if not self._rooms[room]:
+                del self._rooms[room]
+        for kind, streams in self._subscribers.items():
+            for subscriber_id in streams.pop(stream_id, ()):
+                self._subscribed_to[kind].pop(subscriber_id).state = (
+                    SubscriptionState.CLOSED
+                )
+        self._emit("removed", stream_id, stream)
+        return stream
+
+    def touch(self, stream_id: str):
+        """Record activity (e.g. a frame) on a stream.
+
+        Per-frame loops that hold the Stream set ``last_activity`` directly.
+        """
+        stream = self._streams.get(stream_id)
+        if stream is not None:
+            stream.last_activity = time.monotonic()
+
+    def idle_for(self, stream_id: str) -> float:
+        return time.monotonic() - self._streams[stream_id].last_activity
+
+    # Subscriptions
+
+    def subscribe(
+        self, kind: str, stream_id: str, subscriber_id: str
+    ) -> Optional[Subscription]:
+        """Subscribe to one stream of this kind, leaving any previous one"""
+        if stream_id not in self._streams:
+            return None
+        current = self._subscribed_to.get(kind, {}).get(subscriber_id)
+        if current is not None and current.stream_id == stream_id:
+            return current
+        self.unsubscribe(kind, subscriber_id)
+        self._subscribers.setdefault(kind, {}).setdefault(stream_id, set()).add(
+            subscriber_id
+        )
+        subscription = Subscription(kind, stream_id, subscriber_id)
+        self._subscribed_to.setdefault(kind, {})[subscriber_id] = subscription
+        self._emit("subscribed", stream_id, kind, subscriber_id)
+        return subscription
+
+    def unsubscribe(self, kind: str, subscriber_id: str) -> Optional[str]:
+        """Leave this kind's subscription; returns the stream id it was for"""
+        subscription = self._subscribed_to.get(kind, {}).pop(subscriber_id, None)
+        if subscription is None:
+            return None
+        subscription.state = SubscriptionState.CLOSED
+        stream_id = subscription.stream_id
+        subscribers = self._subscribers[kind][stream_id]
+        subscribers.discard(subscriber_id)
+        if not subscribers:
+            del self._subscribers[kind][stream_id]
+        self._emit("unsubscribed", stream_id, kind, subscriber_id)
+        return stream_id
+
+    def unsubscribe_all(self, subscriber_id: str):
+        for kind in list(self._subscribed_to):
+            self.unsubscribe(kind, subscriber_id)
+
+    def subscribers(self, kind: str, stream_id: str):
+        """Subscriber ids of a stream; treat the returned set as read-only"""
+        return self._subscribers.get(kind, {}).get(stream_id, frozenset())
+
+    def subscription(self, kind: str, subscriber_id: str) -> Optional[Subscription]:
+        return self._subscribed_to.get(kind, {}).get(subscriber_id)
+
+    # Events
+
+    def on(self, event: str, callback: Callable):
+        self._listeners.setdefault(event, []).append(callback)
+
+    def _emit(self, event: str, *args):
+        for callback in self._listeners.get(event, ()):
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Stream registry {event} listener failed: {e}")
+
+
+class StreamReaper:
+    """Expires registry streams at their exact idle deadlines.
+
+    Every stream has one heap entry at ``last_activity + idle_timeout``.
+    Frame activity only updates the registry timestamp; the entry is pushed
+    back lazily when it comes due and the stream turns out to be active, so
+    the hot path never touches the heap. The loop sleeps until the earliest
+    deadline instead of sweeping on a fixed interval. Events that make a
+    stream stale right away, like its track ending, schedule an entry due now.
+    """
+
+    def __init__(self, registry: StreamRegistry, idle_timeout: float, check, expire):
+        """`check(stream_id, stream)` returns a reason to expire or None;
+        `expire(stream_id, reason)` removes the stream."""
+        self.registry = registry
+        self.idle_timeout = idle_timeout
+        self._check = check
+        self._expire = expire
+        self._heap = []  # (deadline, stream_id)
+        self._wakeup = asyncio.Event()
+        registry.on("added", self._on_added)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _on_added(self, stream_id: str, stream: Stream):
+        self.schedule(stream_id, stream.last_activity + self.idle_timeout)
+
+    def schedule(self, stream_id: str, deadline: float):
+        heapq.heappush(self._heap, (deadline, stream_id))
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            deadline, stream_id = self._heap[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            stream = self.registry.get(stream_id)
+            if stream is None:
+                continue  # Removed some other way, drop the entry
+
+            try:
+                reason = self._check(stream_id, stream)
+                if reason:
+                    self._expire(stream_id, reason)
+                    continue
+            except Exception as e:
+                logger.error(f"Stream reaper failed on {stream_id}: {e}")
+
+            now = time.monotonic()
+            next_deadline = stream.last_activity + self.idle_timeout
+            if next_deadline <= now:
+                # Idle but still wanted (e.g. has receivers), look again later
+                next_deadline = now + self.idle_timeout
+            heapq.heappush(self._heap, (next_deadline, stream_id))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Checks every HTTP egress profile end to end.
+
+For each entry of EGRESS_PROFILES the encoder must produce a comfort silence
+packet, which the jitter buffer and voice activity gating depend on. Then,
+against webrtc_server_relay.py started locally with its default pacing, a
+load_test.py synthetic sender publishes a stream and
+/stream/{id}.mp3?profile=... must deliver audio for every profile.
+
+Usage: python test_egress_profiles.py
+"""
+
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+from audio_stream_server import EGRESS_PROFILES, AudioBroadcast
+from load_test import SyntheticSender, spawn_server, wait_for_server
+
+URL = "ws://127.0.0.1:8080/ws"
+HEALTH_URL = "http://127.0.0.1:8080/health"
+AUDIO_URL = "http://127.0.0.1:8081"
+LISTEN_SECONDS = 2.0
+# Well below the lowest bit rate (24kbit/s) over LISTEN_SECONDS
+MIN_BYTES = 1500
+
+
+def check_silence():
+    for name, profile in EGRESS_PROFILES.items():
+        silence = AudioBroadcast._encode_silence(profile)
+        assert silence, f"{name}: empty silence packet"
+
+
+async def listen(session, stream_id, profile):
+    """Bytes received from one profile's HTTP stream in LISTEN_SECONDS"""
+    received = 0
+    deadline = time.monotonic() + LISTEN_SECONDS
+    async with session.get(
+        f"{AUDIO_URL}/stream/{stream_id}.mp3", params={"profile": profile}
+    ) as response:
+        content_type = response.headers.get("Content-Type")
+        assert response.status == 200, f"{profile}: HTTP {response.status}"
+        assert content_type == EGRESS_PROFILES[profile]["content_type"], content_type
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                chunk = await asyncio.wait_for(response.content.readany(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            received += len(chunk)
+    return received
+
+
+async def check_streams():
+    server = spawn_server()
+    sender = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_server(session, HEALTH_URL)
+            sender = SyntheticSender(session, URL, "tone", 1.0)
+            await sender.start()
+            await asyncio.sleep(1.0)
+
+            received = await asyncio.gather(
+                *(listen(session, sender.stream_id, name) for name in EGRESS_PROFILES)
+            )
+            results = dict(zip(EGRESS_PROFILES, received))
+            for name, count in results.items():
+                assert count >= MIN_BYTES, f"{name}: {count} bytes in {LISTEN_SECONDS}s"
+            return results
+    finally:
+        if sender:
+            await sender.close()
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_every_profile_encodes_silence():
+    check_silence()
+
+
+def test_every_profile_streams_audio():
+    asyncio.run(check_streams())
+
+
+if __name__ == "__main__":
+    try:
+        check_silence()
+        print(asyncio.run(check_streams()))
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
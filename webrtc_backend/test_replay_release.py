@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Checks that a stream's replay ring lets go of its encoder when the sender ends.
+
+Publishes a stream straight into a VoiceStreamingServer's registry and starts
+its replay ring as REPLAY_SECONDS would. Once the sender's track ends, the
+ring keeps its packets for replay but the REPLAY_PROFILE broadcast it listened
+to, with its backlog, must be gone from the audio server.
+
+Usage: python test_replay_release.py
+"""
+
+import asyncio
+import sys
+import time
+
+from audio_levels import VoiceActivityDetector
+from session_state import Stream
+from test_stream_reaper import EndingTrack
+from webrtc_server_relay import VoiceStreamingServer
+
+REPLAY_SECONDS = 5.0
+RELEASE_WITHIN_SECONDS = 1.0
+
+
+async def check_replay_releases_broadcast():
+    server = VoiceStreamingServer(replay_retain_seconds=60.0)
+    audio_server = server.audio_server
+    try:
+        stream_id = "stream_test"
+        track = EndingTrack()
+        server.streams.add(Stream(stream_id, track, vad=VoiceActivityDetector()))
+        replay = audio_server.start_replay(stream_id, track, REPLAY_SECONDS, 1 << 20)
+        await asyncio.sleep(1.0)
+        assert len(replay), "replay ring got no packets"
+        assert audio_server.broadcasts, "no broadcast feeding the replay ring"
+
+        started = time.monotonic()
+        track.stop()
+        while audio_server.broadcasts:
+            elapsed = time.monotonic() - started
+            assert elapsed < RELEASE_WITHIN_SECONDS, (
+                f"broadcasts still open {elapsed:.1f}s after the sender ended: "
+                f"{list(audio_server.broadcasts)}"
+            )
+            await asyncio.sleep(0.02)
+        # The ring itself is retained for late replay requests
+        assert audio_server.replays.get(stream_id) is replay
+        assert len(replay), "replay ring lost its packets"
+        return {
+            "released_after_seconds": round(time.monotonic() - started, 3),
+            "replay_packets": len(replay),
+        }
+    finally:
+        await audio_server.stop()
+
+
+def test_replay_releases_broadcast_when_sender_ends():
+    asyncio.run(check_replay_releases_broadcast())
+
+
+if __name__ == "__main__":
+    try:
+        print(asyncio.run(check_replay_releases_broadcast()))
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Checks that a stream whose track ends is reaped at once.
+
+Publishes a stream straight into a VoiceStreamingServer's registry, with its
+visualization loop pulling a synthetic track and the reaper running with the
+default STREAM_IDLE_TIMEOUT. Once the track ends, the stream must be gone
+within a moment instead of at its idle deadline minutes later.
+
+Usage: python test_stream_reaper.py
+"""
+
+import asyncio
+import sys
+import time
+
+from aiortc.mediastreams import MediaStreamError
+
+from audio_levels import VoiceActivityDetector
+from load_test import PulseTrack
+from session_state import Stream
+from webrtc_server_relay import STREAM_IDLE_TIMEOUT, VoiceStreamingServer
+
+# Far below STREAM_IDLE_TIMEOUT, which is minutes
+REAP_WITHIN_SECONDS = 1.0
+
+
+class EndingTrack(PulseTrack):
+    """PulseTrack that fails recv() once stopped, like a remote track"""
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        return await super().recv()
+
+
+async def check_ended_track_reaped():
+    server = VoiceStreamingServer()
+    reaper = asyncio.create_task(server.reaper.run())
+    try:
+        stream_id = "stream_test"
+        track = EndingTrack()
+        server.streams.add(Stream(stream_id, track, vad=VoiceActivityDetector()))
+        viz = asyncio.create_task(server.process_visualization(stream_id, track))
+        await asyncio.sleep(0.5)
+        assert stream_id in server.streams
+
+        started = time.monotonic()
+        track.stop()
+        while stream_id in server.streams:
+            elapsed = time.monotonic() - started
+            assert elapsed < REAP_WITHIN_SECONDS, (
+                f"ended stream still listed after {elapsed:.1f}s "
+                f"(idle timeout {STREAM_IDLE_TIMEOUT}s)"
+            )
+            await asyncio.sleep(0.02)
+        await viz
+        reaped = server.metrics.streams_reaped.labels("ended").value
+        assert reaped == 1, reaped
+        return {"reaped_after_seconds": round(time.monotonic() - started, 3)}
+    finally:
+        reaper.cancel()
+        if server.audio_server.executor:
+            server.audio_server.executor.shutdown(wait=False)
+
+
+def test_ended_track_is_reaped_without_idle_timeout():
+    asyncio.run(check_ended_track_reaped())
+
+
+if __name__ == "__main__":
+    try:
+        print(asyncio.run(check_ended_track_reaped()))
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Loopback test: a receiver keeps getting audio after switch_stream.
+
+Starts webrtc_server_relay.py locally, once with Opus passthrough and once
+with decoded relay tracks, and uses the load_test.py synthetic peers: two
+senders and one receiver. The receiver switches from the first stream to
+the second on its existing peer connection and must keep receiving frames
+after stream_switched.
+
+Usage: python test_stream_switch.py
+"""
+
+import asyncio
+import sys
+
+import aiohttp
+
+from load_test import (
+    SyntheticReceiver,
+    SyntheticSender,
+    spawn_server,
+    wait_for_server,
+)
+
+URL = "ws://127.0.0.1:8080/ws"
+HEALTH_URL = "http://127.0.0.1:8080/health"
+LISTEN_SECONDS = 3.0
+# 50 frames a second; allow for jitter buffering around the switch
+MIN_FRAMES_AFTER_SWITCH = 50
+
+
+async def wait_for_frames(receiver, count, timeout=10.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while receiver.frames_received < count:
+        if loop.time() > deadline:
+            raise AssertionError(f"receiver got {receiver.frames_received} frames")
+        await asyncio.sleep(0.1)
+
+
+async def check_switch(passthrough):
+    server = spawn_server({"OPUS_PASSTHROUGH": "1" if passthrough else "0"})
+    senders, receiver = [], None
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_server(session, HEALTH_URL)
+            senders = [SyntheticSender(session, URL, "tone", 1.0) for _ in range(2)]
+            for sender in senders:
+                await sender.start()
+            await asyncio.sleep(1.0)
+
+            receiver = SyntheticReceiver(session, URL, senders[0])
+            await receiver.start()
+            await wait_for_frames(receiver, 25)
+
+            await receiver.send(
+                {"type": "switch_stream", "stream_id": senders[1].stream_id}
+            )
+            switched = await receiver.receive("stream_switched")
+            assert switched["stream_id"] == senders[1].stream_id, switched
+
+            before = receiver.frames_received
+            await asyncio.sleep(LISTEN_SECONDS)
+            after = receiver.frames_received - before
+            assert receiver.error is None, receiver.error
+            assert receiver.pc.connectionState == "connected"
+            assert after >= MIN_FRAMES_AFTER_SWITCH, (
+                f"{after} frames in {LISTEN_SECONDS}s after stream_switched"
+            )
+            # The RTP timeline continues across the switch instead of jumping
+            assert receiver.frames_lost < MIN_FRAMES_AFTER_SWITCH, receiver.frames_lost
+            return {
+                "passthrough": passthrough,
+                "frames_before": before,
+                "frames_after": after,
+                "frames_lost": receiver.frames_lost,
+            }
+    finally:
+        clients = senders + ([receiver] if receiver else [])
+        await asyncio.gather(
+            *(client.close() for client in clients), return_exceptions=True
+        )
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_switch_keeps_audio_passthrough():
+    asyncio.run(check_switch(passthrough=True))
+
+
+def test_switch_keeps_audio_decoded():
+    asyncio.run(check_switch(passthrough=False))
+
+
+if __name__ == "__main__":
+    failed = False
+    for passthrough in (True, False):
+        try:
+            print(asyncio.run(check_switch(passthrough)))
+        except AssertionError as e:
+            failed = True
+            print(f"FAILED (passthrough={passthrough}): {e}")
+    sys.exit(1 if failed else 0)
@@ -1,27 +1,301 @@
 import asyncio
 import json
 import logging
+import os
 import time
 import uuid
 from typing import Dict
 
+import av
 import numpy as np
 from aiohttp import WSMsgType, web
-from aiortc import RTCConfiguration, RTCPeerConnection, RTCSessionDescription
+from aiortc import (
+    MediaStreamTrack,
+    RTCConfiguration,
+    RTCPeerConnection,
+    RTCSessionDescription,
+)
 from aiortc.contrib.media import MediaRelay
-from audio_stream_server import AudioStreamServer
+from aiortc.mediastreams import MediaStreamError
+from aiortc.sdp import candidate_from_sdp
+from audio_levels import (
+    LEVEL_FLOOR_DB,
+    LevelAnalyzer,
+    VoiceActivityDetector,
+    pack_audio_levels,
+)
+from audio_stream_server import ENCODE_THREADS, JITTER_BUFFER_MS, AudioStreamServer
+from metrics import (
+    CONTENT_TYPE,
+    StreamingMetrics,
+    monitor_loop_lag,
+    monitor_process_cpu,
+)
+from mixer import MIX_STREAM_ID, StreamMixer
+from opus_passthrough import OpusPacketRelay
+from outbound_queue import OutboundQueue
+from recorder import RECORDINGS_DIR, SEGMENT_SECONDS, StreamRecorder
+from replay_buffer import (
+    REPLAY_MAX_BYTES,
+    REPLAY_MAX_SECONDS,
+    REPLAY_RETAIN_SECONDS,
+    REPLAY_SECONDS,
+)
+from session_state import Connection, ConnectionState, Stream, SubscriptionState
+from shard_front import ShardedFront
+from stream_registry import StreamReaper, StreamRegistry
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long signaling waits for ICE gathering before sending SDP
+ICE_GATHERING_TIMEOUT = 2.0
+
+# RTP clock rate of Opus, used to convert RTCP jitter into seconds
+OPUS_CLOCK_RATE = 48000
+
+# Admission control defaults, overridable via environment variables
+MAX_CONNECTIONS = 50
+MAX_RECEIVERS_PER_STREAM = 20
+# Of the event loop thread, where 100 means it never waits for I/O
+MAX_CPU_PERCENT = 90.0
+
+# Voice activity detection: frames quieter than this for longer than the
+# hangover count as silence, and silent streams skip MP3 encoding
+VAD_THRESHOLD_DB = -45.0
+VAD_HANGOVER_MS = 400
+
+# Room of senders that don't name one
+DEFAULT_ROOM = "default"
+
+# Streams without receivers are reaped after this long without a frame
+STREAM_IDLE_TIMEOUT = 600.0
+
+# Decoded frames after which an Opus tap that saw no RTP counts as broken
+PASSTHROUGH_PROBE_FRAMES = 50
+
+
+async def wait_for_ice_gathering(pc: RTCPeerConnection, timeout: float):
+    """Wait until ICE gathering is complete, or at most `timeout` seconds"""
+    if pc.iceGatheringState == "complete":
+        return
+
+    gathered = asyncio.Event()
+
+    def on_gathering_state_change():
+        if pc.iceGatheringState == "complete":
+            gathered.set()
+
+    pc.on("icegatheringstatechange", on_gathering_state_change)
+    try:
+        await asyncio.wait_for(gathered.wait(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"ICE gathering not complete after {timeout}s, sending SDP anyway"
+        )
+    finally:
+        pc.remove_listener("icegatheringstatechange", on_gathering_state_change)
+
+
+def parse_ice_candidate(candidate_data: dict):
+    """Build an aiortc candidate from a browser RTCIceCandidate JSON object"""
+    sdp = candidate_data.get("candidate")
+    if not sdp:
+        # Empty candidate marks the end of trickling
+        return None
+    if sdp.startswith("candidate:"):
+        sdp = sdp[len("candidate:") :]
+    candidate = candidate_from_sdp(sdp)
+    candidate.sdpMid = candidate_data.get("sdpMid")
+    candidate.sdpMLineIndex = candidate_data.get("sdpMLineIndex")
+    return candidate
+
+
+class MeteredTrack(MediaStreamTrack):
+    """Receiver-side track that counts frames and reports the first one pulled.
+
+    The RTP sender only starts pulling once DTLS is up, so the first recv()
+    marks the moment the receiver's first audio packet goes out.
+
+    It also stays on the receiver's RTP sender for the life of the peer
+    connection while switch() swaps the stream underneath. aiortc's sender
+    loop ends for good once its track's recv() fails, so replacing the
+    sender's track and stopping the old one would leave the receiver silent.
+    Frames from a new source are shifted to continue the previous timeline,
+    so the RTP timestamps don't jump at a switch.
+    """
+
+    kind = "audio"
+
+    def __init__(self, track, frames_out, on_first_frame):
+        super().__init__()
+        self.track = track
+        self._frames_out = frames_out
+        self._on_first_frame = on_first_frame
+        # recv() in flight on the source, cancelled by switch() and stop()
+        self._pending = None
+        # Set while idling after the source ended, until a switch or stop
+        self._resume = None
+        self._pts_offset = 0
+        self._next_pts = None
+        self._step = OPUS_CLOCK_RATE // 50  # 20ms until a source shows its own
+        self._rebase = False
+
+    async def recv(self):
+        while self.readyState == "live":
+            source = self.track
+            pending = self._pending = asyncio.ensure_future(source.recv())
+            try:
+                await asyncio.wait((pending,))
+            except asyncio.CancelledError:
+                pending.cancel()
+                raise
+            finally:
+                self._pending = None
+
+            if pending.cancelled():
+                continue  # switched or stopped while waiting
+            try:
+                frame = pending.result()
+            except MediaStreamError:
+                if source is not self.track or self.readyState != "live":
+                    continue
+                # The stream ended; keep the RTP sender's loop alive so the
+                # receiver can still switch to another stream
+                self._resume = asyncio.get_running_loop().create_future()
+                await self._resume
+                continue
+
+            frame = self._retime(frame)
+            self._frames_out.value += 1
+            if self._on_first_frame:
+                callback, self._on_first_frame = self._on_first_frame, None
+                callback()
+            return frame
+        raise MediaStreamError
+
+    def switch(self, track, frames_out):
+        """Read from another track from the next frame on, stopping the old one"""
+        old, self.track = self.track, track
+        self._frames_out = frames_out
+        self._rebase = True
+        self._wake()
+        old.stop()
+
+    def stop(self):
+        super().stop()
+        self._wake()
+        self.track.stop()
+
+    def _wake(self):
+        if self._pending:
+            self._pending.cancel()
+        if self._resume and not self._resume.done():
+            self._resume.set_result(None)
+
+    def _retime(self, frame):
+        if frame.pts is None:
+            return frame
+        if self._rebase:
+            self._rebase = False
+            if self._next_pts is not None:
+                self._pts_offset = self._next_pts - frame.pts
+        if isinstance(frame, av.AudioFrame):
+            self._step = frame.samples
+            if self._pts_offset:
+                # Relay frames are shared by every receiver of the stream, so
+                # retime a copy; only switched receivers of decoded streams
+                # pay for it
+                retimed = av.AudioFrame.from_ndarray(
+                    frame.to_ndarray(),
+                    format=frame.format.name,
+                    layout=frame.layout.name,
+                )
+                retimed.sample_rate = frame.sample_rate
+                retimed.time_base = frame.time_base
+                retimed.pts = frame.pts + self._pts_offset
+                frame = retimed
+        else:
+            # Passthrough packets are built per receiver, shift them in place.
+            # They carry no duration, so the step is the last pts increment.
+            frame.pts += self._pts_offset
+            if self._next_pts is not None:
+                last_pts = self._next_pts - self._step
+                if frame.pts > last_pts:
+                    self._step = frame.pts - last_pts
+        self._next_pts = frame.pts + self._step
+        return frame
+
 
 class VoiceStreamingServer:
-    def __init__(self):
-        self.connections: Dict[str, dict] = {}
-        self.active_streams: Dict[str, Dict] = {}  # stream_id -> {track, receivers[]}
-        self.total_audio_bytes = 0
+    def __init__(
+        self,
+        ice_gathering_timeout: float = ICE_GATHERING_TIMEOUT,
+        max_connections: int = MAX_CONNECTIONS,
+        max_receivers_per_stream: int = MAX_RECEIVERS_PER_STREAM,
+        max_cpu_percent: float = MAX_CPU_PERCENT,
+        opus_passthrough: bool = True,
+        encode_threads: int = ENCODE_THREADS,
+        jitter_buffer_ms: int = JITTER_BUFFER_MS,
+        vad_threshold_db: float = VAD_THRESHOLD_DB,
+        vad_hangover_ms: float = VAD_HANGOVER_MS,
+        vad_gating: bool = True,
+        stream_idle_timeout: float = STREAM_IDLE_TIMEOUT,
+        recordings_dir: str = RECORDINGS_DIR,
+        record_streams: bool = False,
+        recording_segment_seconds: float = SEGMENT_SECONDS,
+        replay_seconds: float = REPLAY_SECONDS,
+        replay_max_seconds: float = REPLAY_MAX_SECONDS,
+        replay_max_bytes: int = REPLAY_MAX_BYTES,
+        replay_retain_seconds: float = REPLAY_RETAIN_SECONDS,
+        mix_streams: bool = False,
+    ):
+        self.connections: Dict[str, Connection] = {}
+        # stream_id -> Stream, with "receivers" and "levels" subscriber indexes
+        self.streams = StreamRegistry()
+        self.streams.on("removed", self.on_stream_removed)
+        self.reaper = StreamReaper(
+            self.streams, stream_idle_timeout, self.stale_reason, self.reap_stream
+        )
+        self.ice_gathering_timeout = ice_gathering_timeout
+        self.max_connections = max_connections
+        self.max_receivers_per_stream = max_receivers_per_stream
+        self.max_cpu_percent = max_cpu_percent
+        # Forward senders' encoded Opus to receivers instead of re-encoding
+        self.opus_passthrough = opus_passthrough
+        self.vad_threshold_db = vad_threshold_db
+        self.vad_hangover_ms = vad_hangover_ms
+        # Skip encode work while a stream's VAD reports silence
+        self.vad_gating = vad_gating
+        self.recordings_dir = recordings_dir
+        # Record every new stream, not only on start_recording requests
+        self.record_streams = record_streams
+        self.recording_segment_seconds = recording_segment_seconds
+        self.recorders: Dict[str, StreamRecorder] = {}  # stream_id -> recorder
+        # room -> ids of connections that joined it, and the connections in no
+        # room, which get every stream notification
+        self.room_members: Dict[str, set] = {}
+        self.unscoped: set = set()
+        # Instant replay ring per stream; senders may pick their own limits
+        # up to the maximums, 0 seconds turns replay off
+        self.replay_seconds = replay_seconds
+        self.replay_max_seconds = replay_max_seconds
+        self.replay_max_bytes = replay_max_bytes
+        self.metrics = StreamingMetrics()
         self.app = web.Application()
         self.relay = MediaRelay()
-        self.audio_server = AudioStreamServer(self)
+        # Conference mode: all senders are also summed into one "mix" stream,
+        # which becomes the default for receivers and latest.mp3
+        self.mixer = None
+        if mix_streams:
+            self.mixer = StreamMixer(self.relay, self.metrics)
+            self.streams.preferred = MIX_STREAM_ID
+            self.streams.on("added", self.on_stream_added)
+        self.audio_server = AudioStreamServer(
+            self,
+            encode_threads=encode_threads,
+            jitter_buffer_ms=jitter_buffer_ms,
+            replay_retain_seconds=replay_retain_seconds,
+        )
         self.setup_routes()
 
     def setup_routes(self):
@@ -30,20 +304,105 @@ class VoiceStreamingServer:
         self.app.router.add_get("/ws", self.websocket_handler)
         self.start_time = asyncio.get_event_loop().time()
         self.cleanup_task = None
+        self.loop_lag_task = None
+        self.cpu_task = None
 
     async def metrics_handler(self, request):
-        """Provide Prometheus-compatible or JSON metrics"""
+        """Prometheus text-format metrics, or a JSON summary with ?format=json"""
         uptime = int(asyncio.get_event_loop().time() - self.start_time)
-        return web.json_response(
-            {
-                "uptime_seconds": uptime,
-                "active_connections": len(self.connections),
-                "active_streams": len(self.active_streams),
-                "total_audio_bytes": self.total_audio_bytes,
-                "webrtc_available": True,
-            }
+        if request.query.get("format") == "json":
+            first_packet = self.metrics.join_first_packet_seconds.labels()
+            return web.json_response(
+                {
+                    "uptime_seconds": uptime,
+                    "active_connections": len(self.connections),
+                    "active_streams": len(self.streams),
+                    "total_audio_bytes": int(self.metrics.audio_bytes.value),
+                    "process_cpu_percent": self.metrics.process_cpu.value,
+                    "loop_cpu_percent": self.metrics.loop_cpu.value,
+                    "webrtc_available": True,
+                    "time_to_first_audio_ms": {
+                        "count": first_packet.count,
+                        "avg": round(first_packet.sum / first_packet.count * 1000, 1)
+                        if first_packet.count
+                        else None,
+                    },
+                }
+            )
+
+        self.metrics.uptime.set(uptime)
+        self.metrics.connections.set(len(self.connections))
+        self.metrics.streams.set(len(self.streams))
+        self.metrics.reaper_pending.set(len(self.reaper))
+        await self.collect_peer_stats()
+        return web.Response(
+            text=self.metrics.render(), headers={"Content-Type": CONTENT_TYPE}
         )
 
+    async def collect_peer_stats(self):
+        """Refresh per-peer jitter, RTT and loss gauges from aiortc getStats()"""
+        peers = [
+            (connection_id, connection.role, connection.pc)
+            for connection_id, connection in self.connections.items()
+            if connection.pc and connection.role
+        ]
+        results = await asyncio.gather(
+            *(pc.getStats() for _, _, pc in peers), return_exceptions=True
+        )
+        for (connection_id, role, _), report in zip(peers, results):
+            if isinstance(report, Exception):
+                continue
+            for stats in report.values():
+                # Receivers: what the browser reports back about our outbound
+                # audio. Senders: what we measured on the inbound audio.
+                if stats.type not in ("remote-inbound-rtp", "inbound-rtp"):
+                    continue
+                self.metrics.jitter.labels(connection_id, role).set(
+                    stats.jitter / OPUS_CLOCK_RATE
+                )
+                self.metrics.packets_lost.labels(connection_id, role).set(
+                    stats.packetsLost
+                )
+                rtt = getattr(stats, "roundTripTime", None)
+                if rtt is not None:
+                    self.metrics.rtt.labels(connection_id, role).set(rtt)
+
+    def record_first_audio(self, connection_id: str, join_started: float):
+        elapsed = asyncio.get_event_loop().time() - join_started
+        self.metrics.join_first_packet_seconds.observe(elapsed)
+        subscription = self.streams.subscription("receivers", connection_id)
+        if subscription is not None:
+            subscription.state = SubscriptionState.ACTIVE
+        logger.info(
+            f"Receiver {connection_id} got first audio after {elapsed * 1000:.0f}ms"
+        )
+
+    def remove_stream(self, stream_id: str):
+        self.streams.remove(stream_id)
+
+    def on_stream_added(self, stream_id: str, stream: Stream):
+        """Feed a new sender into the mix, publishing the mix with the first one"""
+        if stream_id == MIX_STREAM_ID:
+            return
+        self.mixer.add_input(stream_id, stream.track)
+        if MIX_STREAM_ID not in self.streams:
+            # Not analysed for levels, so never gated as silent (no vad)
+            self.streams.add(Stream(MIX_STREAM_ID, self.mixer.track, mix=True))
+            self.broadcast_stream_available(MIX_STREAM_ID)
+
+    def on_stream_removed(self, stream_id: str, stream: Stream):
+        """Release a stream's recorder, passthrough relay and per-stream metrics"""
+        if self.mixer and stream_id != MIX_STREAM_ID:
+            self.mixer.remove_input(stream_id)
+            if not self.mixer.inputs and MIX_STREAM_ID in self.streams:
+                # Last sender gone, the mix ends with it
+                self.remove_stream(MIX_STREAM_ID)
+                self.broadcast_stream_ended(MIX_STREAM_ID)
+        self.stop_recording(stream_id)
+        if stream.opus_relay:
+            stream.opus_relay.stop()
+        self.metrics.forget_stream(stream_id)
+
     async def health_check(self, request):
         uptime = int(asyncio.get_event_loop().time() - self.start_time)
         return web.json_response(
@@ -51,62 +410,72 @@ class VoiceStreamingServer:
                 "status": "healthy",
                 "webrtc_available": True,
                 "audio_server_running": self.audio_server is not None,
-                "active_streams": len(self.active_streams),
+                "active_streams": len(self.streams),
                 "connected_clients": len(self.connections),
                 "uptime_seconds": uptime,
             }
         )
 
-    async def cleanup_stale_streams(self):
-        """Periodically clean up streams with no active receivers"""
-        while True:
-            try:
-                await asyncio.sleep(300)  # Run every 5 minutes
-                stale_streams = []
-
-                for stream_id, stream_info in self.active_streams.items():
-                    # Check if the track is ended
-                    track = stream_info.get("track")
-                    if track and track.readyState == "ended":
-                        stale_streams.append(stream_id)
-                        continue
-
-                    if not stream_info.get("receivers"):
-                        # Check if stream has been inactive for more than 10 minutes
-                        if not hasattr(stream_info, "last_activity"):
-                            stream_info["last_activity"] = (
-                                asyncio.get_event_loop().time()
-                            )
-                        elif (
-                            asyncio.get_event_loop().time()
-                            - stream_info["last_activity"]
-                            > 600
-                        ):
-                            stale_streams.append(stream_id)
-
-                for stream_id in stale_streams:
-                    logger.info(f"Cleaning up stale stream: {stream_id}")
-                    if stream_id in self.active_streams:
-                        del self.active_streams[stream_id]
-
-            except Exception as e:
-                logger.error(f"Error in cleanup task: {e}")
+    def stale_reason(self, stream_id: str, stream: Stream):
+        """Why the reaper should drop a stream whose deadline came up, if at all"""
+        if stream.mix:
+            # The mix lives exactly as long as its inputs
+            return None
+        if stream.track.readyState == "ended":
+            return "ended"
+        if (
+            not self.streams.subscribers("receivers", stream_id)
+            and self.streams.idle_for(stream_id) >= self.reaper.idle_timeout
+        ):
+            return "idle"
+        return None
+
+    def reap_stream(self, stream_id: str, reason: str):
+        logger.info(f"Reaping {reason} stream: {stream_id}")
+        freed = self.metrics.reaper_freed
+        freed.labels("receivers").inc(
+            len(self.streams.subscribers("receivers", stream_id))
+        )
+        freed.labels("level_subscribers").inc(
+            len(self.streams.subscribers("levels", stream_id))
+        )
+        room = self.streams.room_of(stream_id)
+        self.remove_stream(stream_id)
+        for resource, count in self.audio_server.close_stream(stream_id).items():
+            freed.labels(resource).inc(count)
+        self.metrics.streams_reaped.labels(reason).inc()
+        self.broadcast_stream_ended(stream_id, room)
 
     async def websocket_handler(self, request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
 
+        if len(self.connections) >= self.max_connections:
+            logger.warning(f"Rejecting WebSocket from {request.remote}: server full")
+            self.metrics.admission_rejected.labels("max_connections").inc()
+            await ws.send_str(
+                json.dumps(
+                    {
+                        "type": "error",
+                        "code": "server_full",
+                        "message": "Too many connections, try again later",
+                    }
+                )
+            )
+            await ws.close()
+            return ws
+
         connection_id = str(uuid.uuid4())
-        self.connections[connection_id] = {
-            "ws": ws,
-            "pc": None,
-            "role": None,
-            "stream_id": None,
-        }
+        self.connections[connection_id] = Connection(
+            connection_id,
+            ws,
+            OutboundQueue(ws, dropped_counter=self.metrics.ws_messages_dropped.labels()),
+        )
+        self.unscoped.add(connection_id)
 
         try:
             # Notify the client of available streams immediately
-            await self.send_available_streams(connection_id)
+            self.send_available_streams(connection_id)
 
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
@@ -137,9 +506,21 @@ class VoiceStreamingServer:
         logger.debug(f"Handling message {message_type} for {connection_id}")
 
         if message_type == "start_sending":
-            await self.setup_sender(connection_id)
+            await self.setup_sender(
+                connection_id, data.get("replay"), data.get("room") or DEFAULT_ROOM
+            )
         elif message_type == "start_receiving":
-            await self.setup_receiver(connection_id, data.get("stream_id"))
+            await self.setup_receiver(
+                connection_id, data.get("stream_id"), data.get("room")
+            )
+        elif message_type == "switch_stream":
+            await self.switch_stream(
+                connection_id, data.get("stream_id"), data.get("room")
+            )
+        elif message_type == "join_room":
+            self.join_room(connection_id, data.get("room"))
+        elif message_type == "leave_room":
+            self.leave_room(connection_id, data.get("room"))
         elif message_type == "webrtc_offer":
             await self.handle_webrtc_offer(connection_id, data)
         elif message_type == "webrtc_answer":
@@ -147,32 +528,262 @@ class VoiceStreamingServer:
         elif message_type == "ice_candidate":
             await self.handle_ice_candidate(connection_id, data)
         elif message_type == "get_available_streams":
-            await self.send_available_streams(connection_id)
+            self.send_available_streams(connection_id)
         elif message_type == "stop_stream":
             # Just stop media, keep WS open
             await self.stop_media(connection_id)
         elif message_type == "local_ip":
             await self.handle_local_ip(connection_id, data)
+        elif message_type == "subscribe_levels":
+            self.subscribe_levels(connection_id, data.get("stream_id"))
+        elif message_type == "unsubscribe_levels":
+            self.unsubscribe_levels(connection_id)
+        elif message_type == "set_mix_gain":
+            self.set_mix_gain(connection_id, data.get("stream_id"), data.get("gain"))
+        elif message_type == "start_recording":
+            self.handle_start_recording(connection_id, data.get("stream_id"))
+        elif message_type == "stop_recording":
+            self.handle_stop_recording(connection_id, data.get("stream_id"))
+
+    def set_mix_gain(self, connection_id: str, stream_id: str, gain):
+        """Set how loud one sender is in the mix (1.0 = unchanged)"""
+        try:
+            gain = min(max(float(gain), 0.0), 4.0)
+        except (TypeError, ValueError):
+            gain = None
+        if not self.mixer or gain is None or not self.mixer.set_gain(stream_id, gain):
+            self.connections[connection_id].outbox.send(
+                json.dumps(
+                    {
+                        "type": "error",
+                        "code": "bad_mix_gain",
+                        "message": "Mixing is off, or no such input or gain",
+                    }
+                )
+            )
+            return
+        logger.info(f"Mix gain of {stream_id} set to {gain}")
+
+    def start_recording(self, stream_id: str):
+        """Start recording a stream unless it already is; returns the recorder"""
+        recorder = self.recorders.get(stream_id)
+        if recorder:
+            return recorder
+        stream = self.streams.get(stream_id)
+        # Passthrough streams are recorded from their Opus packets, no encode
+        recorder = StreamRecorder(
+            stream_id,
+            self.subscribe_receiver_track(stream),
+            self.recordings_dir,
+            self.metrics,
+            segment_seconds=self.recording_segment_seconds,
+        )
+        recorder.start(asyncio.get_event_loop())
+        self.recorders[stream_id] = recorder
+        self.metrics.recordings_active.set(len(self.recorders))
+        return recorder
+
+    def stop_recording(self, stream_id: str):
+        recorder = self.recorders.pop(stream_id, None)
+        if recorder is None:
+            return None
+        recorder.stop()
+        self.metrics.recordings_active.set(len(self.recorders))
+        return recorder
+
+    def handle_start_recording(self, connection_id: str, stream_id: str = None):
+        connection = self.connections[connection_id]
+        stream_id = self.resolve_stream(connection_id, stream_id)
+        if not stream_id:
+            connection.outbox.send(
+                json.dumps(
+                    {
+                        "type": "error",
+                        "code": "stream_not_found",
+                        "message": "No such stream to record",
+                    }
+                )
+            )
+            return
+        try:
+            recorder = self.start_recording(stream_id)
+        except OSError as e:
+            logger.error(f"Cannot record {stream_id}: {e}")
+            connection.outbox.send(
+                json.dumps(
+                    {
+                        "type": "error",
+                        "code": "recording_failed",
+                        "message": f"Cannot record stream: {e}",
+                    }
+                )
+            )
+            return
+        connection.outbox.send(
+            json.dumps(
+                {
+                    "type": "recording_started",
+                    "stream_id": stream_id,
+                    "recording": recorder.name,
+                }
+            )
+        )
+
+    def handle_stop_recording(self, connection_id: str, stream_id: str = None):
+        stream_id = stream_id or self.streams.latest()
+        recorder = self.stop_recording(stream_id)
+        self.connections[connection_id].outbox.send(
+            json.dumps(
+                {
+                    "type": "recording_stopped",
+                    "stream_id": stream_id,
+                    "recording": recorder.name if recorder else None,
+                }
+            )
+        )
+
+    def join_room(self, connection_id: str, room: str):
+        """Limit a client's stream notifications to the rooms it joined"""
+        if not room:
+            return
+        connection = self.connections[connection_id]
+        connection.rooms.add(room)
+        self.room_members.setdefault(room, set()).add(connection_id)
+        self.unscoped.discard(connection_id)
+        self.send_available_streams(connection_id)
+
+    def leave_room(self, connection_id: str, room: str = None):
+        """Leave one room, or all of them if `room` is omitted"""
+        self.leave_rooms(connection_id, [room] if room else None)
+        self.send_available_streams(connection_id)
+
+    def leave_rooms(self, connection_id: str, rooms=None):
+        connection = self.connections[connection_id]
+        for left in rooms if rooms is not None else list(connection.rooms):
+            connection.rooms.discard(left)
+            members = self.room_members.get(left)
+            if members is not None:
+                members.discard(connection_id)
+                if not members:
+                    del self.room_members[left]
+        if not connection.rooms:
+            self.unscoped.add(connection_id)
+
+    def audience(self, room: str = None):
+        """Connections to notify about a stream in `room` (None: global)"""
+        if room is None:
+            return list(self.connections.values())
+        return [
+            self.connections[connection_id]
+            for connection_id in self.unscoped | self.room_members.get(room, set())
+        ]
+
+    def resolve_stream(self, connection_id: str, stream_id: str = None, room: str = None):
+        """Requested stream, else the latest one in `room` or the client's only room"""
+        if room is None:
+            rooms = self.connections[connection_id].rooms
+            if len(rooms) == 1:
+                room = next(iter(rooms))
+        return self.streams.resolve(stream_id, room)
+
+    def subscribe_levels(self, connection_id: str, stream_id: str = None):
+        """Start sending binary audio_levels for a stream (latest if omitted)"""
+        stream_id = self.resolve_stream(connection_id, stream_id)
+        if stream_id:
+            subscription = self.streams.subscribe("levels", stream_id, connection_id)
+            # Levels need no negotiation, they flow with the next window
+            subscription.state = SubscriptionState.ACTIVE
+
+    def unsubscribe_levels(self, connection_id: str):
+        self.streams.unsubscribe("levels", connection_id)
+
+    def send_audio_levels(self, stream_id: str, payload: bytes):
+        for connection_id in self.streams.subscribers("levels", stream_id):
+            connection = self.connections.get(connection_id)
+            if connection:
+                # A client that is behind only ever holds the newest levels
+                connection.outbox.send(payload, coalesce_key="audio_levels")
 
     async def stop_media(self, connection_id: str):
         connection = self.connections.get(connection_id)
-        if connection and connection.get("pc"):
+        if connection and connection.pc:
             logger.info(f"Stopping media for {connection_id}")
-            await connection["pc"].close()
-            connection["pc"] = None
-            connection["stream_id"] = None
+            self.detach_receiver(connection_id)
+            await connection.pc.close()
+            connection.pc = None
+            connection.rtp_sender = None
+            connection.stream_id = None
+            connection.state = ConnectionState.OPEN
             # Do NOT remove from self.connections, keep WS open
 
-    async def setup_sender(self, connection_id: str):
-        """Set up a client as an audio sender"""
+    def detach_receiver(self, connection_id: str):
+        """Remove a receiver from its current stream's receivers"""
+        self.streams.unsubscribe("receivers", connection_id)
+
+    def admission_error(self, stream_id: str = None):
+        """Return an error code if a new sender/receiver must be refused"""
+        # The event loop thread, not the whole process: encode threads may
+        # use other cores while the loop still keeps up
+        if self.metrics.loop_cpu.value >= self.max_cpu_percent:
+            return "server_busy"
+        if (
+            stream_id is not None
+            and len(self.streams.subscribers("receivers", stream_id))
+            >= self.max_receivers_per_stream
+        ):
+            return "stream_full"
+        return None
+
+    def reject(self, connection_id: str, code: str):
+        messages = {
+            "server_busy": "Server is overloaded, try again later",
+            "stream_full": "Too many listeners on this stream",
+        }
+        logger.warning(f"Admission control refused {connection_id}: {code}")
+        self.metrics.admission_rejected.labels(code).inc()
+        connection = self.connections.get(connection_id)
+        if connection:
+            connection.outbox.send(
+                json.dumps({"type": "error", "code": code, "message": messages[code]})
+            )
+
+    def replay_limits(self, requested: dict = None):
+        """(seconds, max_bytes) for a stream's replay ring, within server limits"""
+        requested = requested or {}
+        try:
+            seconds = float(requested.get("seconds", self.replay_seconds))
+            max_bytes = int(requested.get("max_bytes", self.replay_max_bytes))
+        except (TypeError, ValueError):
+            seconds, max_bytes = self.replay_seconds, self.replay_max_bytes
+        return (
+            max(0.0, min(seconds, self.replay_max_seconds)),
+            max(0, min(max_bytes, self.replay_max_bytes)),
+        )
+
+    async def setup_sender(
+        self, connection_id: str, replay: dict = None, room: str = DEFAULT_ROOM
+    ):
+        """Set up a client as an audio sender publishing into `room`.
+
+        `replay` optionally sets the stream's replay ring limits:
+        {"seconds": ..., "max_bytes": ...}; {"seconds": 0} disables it.
+        """
         logger.info(f"Setting up sender for connection {connection_id}")
         connection = self.connections[connection_id]
-        connection["role"] = "sender"
+
+        error = self.admission_error()
+        if error:
+            self.reject(connection_id, error)
+            return
+
+        connection.role = "sender"
+        replay_seconds, replay_max_bytes = self.replay_limits(replay)
 
         # Create RTCPeerConnection with LAN-only ICE configuration
         config = RTCConfiguration(iceServers=[])
         pc = RTCPeerConnection(configuration=config)
-        connection["pc"] = pc
+        connection.pc = pc
+        connection.state = ConnectionState.NEGOTIATING
 
         @pc.on("track")
         async def on_track(track):
@@ -181,17 +792,49 @@ class VoiceStreamingServer:
 
                 # Store the audio stream
                 stream_id = f"stream_{connection_id}"
-                self.active_streams[stream_id] = {
-                    "track": track,
-                    "receivers": [],
-                    "sender_id": connection_id,
-                }
-                connection["stream_id"] = stream_id
+                opus_relay = None
+                if self.opus_passthrough:
+                    opus_relay = OpusPacketRelay.attach(pc, track)
+                    if opus_relay is None:
+                        logger.warning(
+                            f"Opus passthrough unavailable for {connection_id}, "
+                            "receivers will re-encode"
+                        )
+
+                self.streams.add(
+                    Stream(
+                        stream_id,
+                        track,
+                        sender_id=connection_id,
+                        room=room,
+                        opus_relay=opus_relay,
+                        vad=VoiceActivityDetector(
+                            self.vad_threshold_db, self.vad_hangover_ms
+                        ),
+                    )
+                )
+                connection.stream_id = stream_id
 
                 logger.info(f"Stored stream {stream_id} for sender {connection_id}")
                 
                 # Broadast availability to all clients
-                await self.broadcast_stream_available(stream_id)
+                self.broadcast_stream_available(stream_id)
+
+                if replay_seconds > 0 and replay_max_bytes > 0:
+                    # Encoded from the first frame so replay and pre-roll have
+                    # something to serve when asked
+                    try:
+                        self.audio_server.start_replay(
+                            stream_id, track, replay_seconds, replay_max_bytes
+                        )
+                    except Exception as e:
+                        logger.error(f"Cannot keep replay for {stream_id}: {e}")
+
+                if self.record_streams:
+                    try:
+                        self.start_recording(stream_id)
+                    except OSError as e:
+                        logger.error(f"Cannot record {stream_id}: {e}")
 
                 # Start visualization task
                 # Subscribe immediately to keep the track flowing
@@ -201,76 +844,93 @@ class VoiceStreamingServer:
                 @track.on("ended")
                 async def on_ended():
                     logger.info(f"Audio track ended for {connection_id}")
-                    if stream_id in self.active_streams:
-                        del self.active_streams[stream_id]
-                    await self.broadcast_stream_ended(stream_id)
+                    # Reap now rather than at the stream's idle deadline
+                    self.reaper.schedule(stream_id, time.monotonic())
 
         @pc.on("iceconnectionstatechange")
         async def on_iceconnectionstatechange():
             logger.info(
                 f"ICE connection state for sender {connection_id}: {pc.iceConnectionState}"
             )
+            self.on_ice_state(connection, pc)
             if pc.iceConnectionState == "failed":
                 await pc.close()
 
         # Send ready signal
-        await connection["ws"].send_str(
+        connection.outbox.send(
             json.dumps({"type": "sender_ready", "connection_id": connection_id})
         )
 
-    async def setup_receiver(self, connection_id: str, stream_id: str = None):
+    async def setup_receiver(
+        self, connection_id: str, stream_id: str = None, room: str = None
+    ):
         """Set up a client as an audio receiver"""
+        join_started = asyncio.get_event_loop().time()
         try:
             connection = self.connections.get(connection_id)
             if not connection:
                 return
 
-            connection["role"] = "receiver"
+            connection.role = "receiver"
 
-            # If no specific stream requested, use the last available (newest)
-            if not stream_id and self.active_streams:
-                # Use list conversion to get the last key
-                stream_keys = list(self.active_streams.keys())
-                stream_id = stream_keys[-1]
+            # If no specific stream requested, use the newest in the room
+            stream_id = self.resolve_stream(connection_id, stream_id, room)
 
-            if not stream_id or stream_id not in self.active_streams:
+            if not stream_id:
                 logger.warning(f"No audio stream available for receiver {connection_id}")
-                await connection["ws"].send_str(
+                connection.outbox.send(
                     json.dumps({"type": "error", "message": "No audio stream available"})
                 )
                 return
 
-            stream_info = self.active_streams[stream_id]
-            source_track = stream_info["track"]
+            stream = self.streams.get(stream_id)
+            source_track = stream.track
 
             if source_track.readyState == "ended":
                 logger.warning(f"Stream {stream_id} track is ended, cannot receive")
-                del self.active_streams[stream_id]
-                await connection["ws"].send_str(
+                self.remove_stream(stream_id)
+                connection.outbox.send(
                     json.dumps({"type": "error", "message": "Stream ended"})
                 )
                 return
 
-            # Add this receiver to the stream list
-            if connection_id not in stream_info["receivers"]:
-                stream_info["receivers"].append(connection_id)
-            
-            connection["stream_id"] = stream_id
+            # The client starts over with a fresh peer connection, so drop ours
+            if connection.pc:
+                self.detach_receiver(connection_id)
+                await connection.pc.close()
+                connection.pc = None
+                connection.rtp_sender = None
+                connection.state = ConnectionState.OPEN
+
+            error = self.admission_error(stream_id)
+            if error:
+                self.reject(connection_id, error)
+                return
+
+            self.streams.subscribe("receivers", stream_id, connection_id)
+
+            connection.stream_id = stream_id
 
             # Create RTCPeerConnection
             config = RTCConfiguration(iceServers=[])
             pc = RTCPeerConnection(configuration=config)
-            connection["pc"] = pc
+            connection.pc = pc
+            connection.state = ConnectionState.NEGOTIATING
 
             # Use MediaRelay to create a consumer track
-            relayed_track = self.relay.subscribe(source_track)
-            pc.addTrack(relayed_track)
+            relayed_track = MeteredTrack(
+                self.subscribe_receiver_track(stream),
+                self.metrics.frames_out.labels(stream_id),
+                lambda: self.record_first_audio(connection_id, join_started),
+            )
+            connection.rtp_sender = pc.addTrack(relayed_track)
 
             @pc.on("iceconnectionstatechange")
             async def on_iceconnectionstatechange():
                 logger.info(
                     f"ICE connection state for receiver {connection_id}: {pc.iceConnectionState}"
                 )
+                self.on_ice_state(connection, pc)
                 if pc.iceConnectionState == "failed":
                     await pc.close()
 
@@ -278,15 +938,15 @@ class VoiceStreamingServer:
             offer = await pc.createOffer()
             await pc.setLocalDescription(offer)
 
-            # Wait slightly longer for ICE gathering to be safe
-            await asyncio.sleep(1.0) 
+            # Send as soon as our candidates are in the SDP
+            await wait_for_ice_gathering(pc, self.ice_gathering_timeout)
 
             # Check if connection still exists and matches
-            if self.connections.get(connection_id, {}).get("pc") != pc:
+            if connection.state is ConnectionState.CLOSED or connection.pc is not pc:
                 logger.warning(f"Connection {connection_id} reset during setup")
                 return
 
-            await connection["ws"].send_str(
+            connection.outbox.send(
                 json.dumps(
                     {
                         "type": "webrtc_offer",
@@ -297,54 +957,162 @@ class VoiceStreamingServer:
                     }
                 )
             )
+            connection.offer_sent_at = asyncio.get_event_loop().time()
             logger.info(f"Sent offer to receiver {connection_id} for stream {stream_id}")
 
         except Exception as e:
             logger.error(f"Error setting up receiver {connection_id}: {e}", exc_info=True)
             if connection_id in self.connections:
-                await self.connections[connection_id]["ws"].send_str(
+                self.connections[connection_id].outbox.send(
                     json.dumps(
                         {"type": "error", "message": f"Server error: {str(e)}"}
                     )
                 )
 
-    async def send_available_streams(self, connection_id: str):
-        """Send list of available streams to a client"""
+    def on_ice_state(self, connection: Connection, pc: RTCPeerConnection):
+        """Follow ICE progress in the connection's lifecycle state"""
+        if connection.pc is not pc or connection.state is ConnectionState.CLOSED:
+            return  # A peer connection that has since been replaced
+        if pc.iceConnectionState in ("connected", "completed"):
+            connection.state = ConnectionState.CONNECTED
+        elif pc.iceConnectionState in ("failed", "closed"):
+            connection.state = ConnectionState.OPEN
+
+    def subscribe_receiver_track(self, stream: Stream):
+        """Track to hand a WebRTC receiver: encoded passthrough or decoded relay"""
+        if stream.opus_relay:
+            return stream.opus_relay.subscribe()
+        return self.relay.subscribe(stream.track)
+
+    def disable_passthrough(self, stream: Stream):
+        """Move a stream's receivers to decoded relay tracks.
+
+        Frames are being decoded but the Opus tap never saw an RTP packet,
+        so aiortc no longer routes packets through the wrapped handler.
+        """
+        logger.warning(
+            f"Opus passthrough tap of {stream.stream_id} sees no packets, "
+            "receivers will re-encode"
+        )
+        opus_relay, stream.opus_relay = stream.opus_relay, None
+        for receiver_id in list(self.streams.subscribers("receivers", stream.stream_id)):
+            connection = self.connections.get(receiver_id)
+            if connection and connection.rtp_sender:
+                connection.rtp_sender.track.switch(
+                    self.subscribe_receiver_track(stream),
+                    self.metrics.frames_out.labels(stream.stream_id),
+                )
+        opus_relay.stop()
+
+    async def switch_stream(
+        self, connection_id: str, stream_id: str = None, room: str = None
+    ):
+        """Move a connected receiver to another stream on its existing peer connection.
+
+        Every stream is Opus audio, so swapping the sender's track is enough:
+        no new offer/answer, DTLS handshake or ICE checks are needed.
+        """
         connection = self.connections.get(connection_id)
         if not connection:
             return
 
-        stream_list = list(self.active_streams.keys())
-        try:
-            await connection["ws"].send_str(
-                json.dumps({"type": "available_streams", "streams": stream_list})
+        pc = connection.pc
+        if (
+            connection.role != "receiver"
+            or pc is None
+            or pc.connectionState != "connected"
+            or not connection.rtp_sender
+        ):
+            # Nothing to reuse, fall back to a full setup
+            await self.setup_receiver(connection_id, stream_id, room)
+            return
+
+        stream_id = self.resolve_stream(connection_id, stream_id, room)
+        stream = self.streams.get(stream_id)
+        if not stream or stream.track.readyState == "ended":
+            connection.outbox.send(
+                json.dumps({"type": "error", "message": "No audio stream available"})
             )
-        except Exception as e:
-            logger.error(f"Error sending available streams: {e}")
+            return
+        if stream_id == connection.stream_id:
+            return
 
-    async def broadcast_stream_available(self, stream_id: str):
-        message = json.dumps({"type": "stream_available", "stream_id": stream_id})
-        for conn in self.connections.values():
-            try:
-                await conn["ws"].send_str(message)
-            except Exception:
-                pass
+        error = self.admission_error(stream_id)
+        if error:
+            self.reject(connection_id, error)
+            return
 
-    async def broadcast_stream_ended(self, stream_id: str):
-        message = json.dumps({"type": "stream_ended", "stream_id": stream_id})
-        for conn in self.connections.values():
-            try:
-                await conn["ws"].send_str(message)
-            except Exception:
-                pass
+        # The sender keeps pulling from the same MeteredTrack; only its
+        # source changes
+        connection.rtp_sender.track.switch(
+            self.subscribe_receiver_track(stream),
+            self.metrics.frames_out.labels(stream_id),
+        )
+
+        self.streams.subscribe("receivers", stream_id, connection_id)
+        connection.stream_id = stream_id
+        connection.outbox.send(
+            json.dumps({"type": "stream_switched", "stream_id": stream_id})
+        )
+        logger.info(f"Receiver {connection_id} switched to stream {stream_id}")
+
+    def send_available_streams(self, connection_id: str):
+        """Send list of available streams to a client"""
+        connection = self.connections.get(connection_id)
+        if not connection:
+            return
+
+        if connection.rooms:
+            stream_list = self.streams.in_rooms(connection.rooms)
+        else:
+            stream_list = self.streams.ids()
+        # Only the newest snapshot matters if the client has not caught up
+        connection.outbox.send(
+            json.dumps(
+                {
+                    "type": "available_streams",
+                    "streams": stream_list,
+                    "rooms": {
+                        stream_id: self.streams.room_of(stream_id)
+                        for stream_id in stream_list
+                    },
+                }
+            ),
+            coalesce_key="available_streams",
+        )
+
+    def broadcast_stream_available(self, stream_id: str):
+        room = self.streams.room_of(stream_id)
+        message = json.dumps(
+            {"type": "stream_available", "stream_id": stream_id, "room": room}
+        )
+        for conn in self.audience(room):
+            conn.outbox.send(message)
+
+    def broadcast_stream_vad(self, stream_id: str, active: bool):
+        message = json.dumps(
+            {"type": "stream_vad", "stream_id": stream_id, "active": active}
+        )
+        for conn in self.audience(self.streams.room_of(stream_id)):
+            # Only the current state matters to a client that is behind
+            conn.outbox.send(message, coalesce_key=f"stream_vad:{stream_id}")
+
+    def broadcast_stream_ended(self, stream_id: str, room: str = None):
+        """Tell the stream's room; the stream is gone, so callers pass its room"""
+        message = json.dumps(
+            {"type": "stream_ended", "stream_id": stream_id, "room": room}
+        )
+        for conn in self.audience(room):
+            conn.outbox.send(message)
 
     async def handle_webrtc_offer(self, connection_id: str, data: dict):
         # This handles offers FROM the client (Sender)
         connection = self.connections.get(connection_id)
-        if not connection or not connection["pc"]:
+        if not connection or not connection.pc:
             return
 
-        pc = connection["pc"]
+        pc = connection.pc
+        offer_received_at = asyncio.get_event_loop().time()
         try:
             offer = RTCSessionDescription(
                 sdp=data["offer"]["sdp"], type=data["offer"]["type"]
@@ -354,10 +1122,12 @@ class VoiceStreamingServer:
             answer = await pc.createAnswer()
             await pc.setLocalDescription(answer)
             
-            # Wait for ICE
-            await asyncio.sleep(1.0)
+            await wait_for_ice_gathering(pc, self.ice_gathering_timeout)
 
-            await connection["ws"].send_str(
+            self.metrics.offer_answer_seconds.labels("sender").observe(
+                asyncio.get_event_loop().time() - offer_received_at
+            )
+            connection.outbox.send(
                 json.dumps(
                     {
                         "type": "webrtc_answer",
@@ -374,22 +1144,38 @@ class VoiceStreamingServer:
     async def handle_webrtc_answer(self, connection_id: str, data: dict):
         # This handles answers FROM the client (Receiver)
         connection = self.connections.get(connection_id)
-        if not connection or not connection["pc"]:
+        if not connection or not connection.pc:
             return
 
-        pc = connection["pc"]
+        pc = connection.pc
         try:
             answer = RTCSessionDescription(
                 sdp=data["answer"]["sdp"], type=data["answer"]["type"]
             )
             await pc.setRemoteDescription(answer)
             logger.info(f"Set remote description (answer) for {connection_id}")
+
+            offer_sent_at, connection.offer_sent_at = connection.offer_sent_at, None
+            if offer_sent_at is not None:
+                self.metrics.offer_answer_seconds.labels("receiver").observe(
+                    asyncio.get_event_loop().time() - offer_sent_at
+                )
         except Exception as e:
             logger.error(f"Error handling answer from {connection_id}: {e}")
 
     async def handle_ice_candidate(self, connection_id: str, data: dict):
-        # aiortc handles ICE candidates via SDP usually, but logging is good
-        pass
+        # Trickled candidates from the browser, so ICE checks can start before
+        # the client has finished gathering
+        connection = self.connections.get(connection_id)
+        if not connection or not connection.pc or not data.get("candidate"):
+            return
+
+        try:
+            candidate = parse_ice_candidate(data["candidate"])
+            if candidate:
+                await connection.pc.addIceCandidate(candidate)
+        except Exception as e:
+            logger.warning(f"Ignoring bad ICE candidate from {connection_id}: {e}")
 
     async def handle_local_ip(self, connection_id: str, data: dict):
         pass
@@ -398,42 +1184,92 @@ class VoiceStreamingServer:
         if connection_id in self.connections:
             connection = self.connections[connection_id]
             logger.info(f"Cleaning up connection {connection_id}")
+            # Setup still awaiting on this connection sees it is going away
+            connection.state = ConnectionState.CLOSED
 
             # If sender, remove stream
-            if connection.get("role") == "sender" and connection.get("stream_id"):
-                stream_id = connection["stream_id"]
-                if stream_id in self.active_streams:
-                    del self.active_streams[stream_id]
-                await self.broadcast_stream_ended(stream_id)
+            if connection.role == "sender" and connection.stream_id:
+                stream_id = connection.stream_id
+                room = self.streams.room_of(stream_id)
+                self.remove_stream(stream_id)
+                self.broadcast_stream_ended(stream_id, room)
 
             # If receiver, remove from list
-            elif connection.get("role") == "receiver" and connection.get("stream_id"):
-                stream_id = connection["stream_id"]
-                if stream_id in self.active_streams:
-                    receivers = self.active_streams[stream_id].get("receivers", [])
-                    if connection_id in receivers:
-                        receivers.remove(connection_id)
+            elif connection.role == "receiver" and connection.stream_id:
+                self.detach_receiver(connection_id)
 
-            if connection.get("pc"):
-                await connection["pc"].close()
+            if connection.pc:
+                await connection.pc.close()
 
+            self.leave_rooms(connection_id)
+            self.unscoped.discard(connection_id)
+            connection.outbox.close()
             del self.connections[connection_id]
+            self.streams.unsubscribe_all(connection_id)
+            self.metrics.forget_connection(connection_id)
 
     async def process_visualization(self, stream_id: str, track):
         """Keep the stream flowing and send viz data"""
         logger.info(f"Starting visualization task for {stream_id}")
-        frame_count = 0
+        levels_sent = 0
+        # 5 x 20ms frames per analysis window -> 10 level updates a second
+        analyzer = LevelAnalyzer(window_frames=5)
+        expected_pts = None
+        # Resolve metric children once, the loop below runs 50 times a second
+        frames_in = self.metrics.frames_in.labels(stream_id)
+        bytes_in = self.metrics.bytes_in.labels(stream_id)
+        frames_lost = self.metrics.frames_dropped.labels(stream_id, "upstream")
+        audio_bytes = self.metrics.audio_bytes
+        voice_active = self.metrics.voice_active.labels(stream_id)
+        stream = self.streams.get(stream_id)
+        vad = stream.vad
         try:
-            while stream_id in self.active_streams:
+            while stream_id in self.streams:
                 try:
                     # Pull frame to keep relay active
                     frame = await asyncio.wait_for(track.recv(), timeout=2.0)
-                    
-                    frame_count += 1
-                    # Downsample viz data
-                    if frame_count % 5 == 0:
-                        # Processing logic...
-                        pass
+
+                    frame_bytes = (
+                        frame.samples * len(frame.layout.channels) * frame.format.bytes
+                    )
+                    frames_in.value += 1
+                    stream.last_activity = time.monotonic()
+                    if (
+                        stream.opus_relay
+                        and frames_in.value >= PASSTHROUGH_PROBE_FRAMES
+                        and not stream.opus_relay.tapped
+                    ):
+                        self.disable_passthrough(stream)
+                    bytes_in.value += frame_bytes
+                    audio_bytes.inc(frame_bytes)
+
+                    # A pts jump means the jitter buffer gave up on some frames
+                    if frame.pts is not None:
+                        if expected_pts is not None and frame.pts > expected_pts:
+                            gap = frame.pts - expected_pts
+                            frames_lost.value += gap // frame.samples
+                        expected_pts = frame.pts + frame.samples
+
+                    if vad.update(frame):
+                        voice_active.set(1 if vad.active else 0)
+                        self.broadcast_stream_vad(stream_id, vad.active)
+                        if not vad.active and self.streams.subscribers("levels", stream_id):
+                            # Drop the meters to the floor once, then go quiet
+                            levels_sent += 1
+                            floor = -LEVEL_FLOOR_DB
+                            payload = pack_audio_levels(
+                                stream_id, levels_sent, floor, floor,
+                                np.full(analyzer.bands, floor),
+                            )
+                            self.send_audio_levels(stream_id, payload)
+
+                    # Only analyse voice, and only while someone is watching the meters
+                    if vad.active and self.streams.subscribers("levels", stream_id):
+                        levels = analyzer.add(frame)
+                        if levels:
+                            levels_sent += 1
+                            payload = pack_audio_levels(stream_id, levels_sent, *levels)
+                            self.send_audio_levels(stream_id, payload)
                 except asyncio.TimeoutError:
                     # Just continue, don't crash. Silence is okay.
                     continue
@@ -445,28 +1281,81 @@ class VoiceStreamingServer:
             logger.error(f"Visualization task error: {e}")
         finally:
             logger.info(f"Visualization task stopped for {stream_id}")
+            if stream_id in self.streams:
+                # Nothing pulls the track any more; let the reaper look now
+                self.reaper.schedule(stream_id, time.monotonic())
 
-    async def run_server(self):
-        port = 8080
-        host = "0.0.0.0"
-
+    async def run_server(self, host: str = "0.0.0.0", port: int = 8080, audio_port: int = 8081):
         runner = web.AppRunner(self.app)
         await runner.setup()
         site = web.TCPSite(runner, host, port)
         await site.start()
 
         # Start Audio Stream Server
-        await self.audio_server.start(host, 8081)
+        await self.audio_server.start(host, audio_port)
 
-        self.cleanup_task = asyncio.create_task(self.cleanup_stale_streams())
+        self.cleanup_task = asyncio.create_task(self.reaper.run())
+        self.loop_lag_task = asyncio.create_task(monitor_loop_lag(self.metrics))
+        self.cpu_task = asyncio.create_task(monitor_process_cpu(self.metrics))
         logger.info(f"Server started on {host}:{port}")
 
         while True:
             await asyncio.sleep(3600)
 
+
+def run_worker(options: dict, port: int, audio_port: int):
+    """Entry point of one worker process in sharded mode"""
+    logging.basicConfig(level=logging.INFO)
+    server = VoiceStreamingServer(**options)
+    try:
+        asyncio.run(server.run_server("127.0.0.1", port, audio_port))
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    server = VoiceStreamingServer()
+    options = {
+        "ice_gathering_timeout": float(
+            os.environ.get("ICE_GATHERING_TIMEOUT", ICE_GATHERING_TIMEOUT)
+        ),
+        "max_connections": int(os.environ.get("MAX_CONNECTIONS", MAX_CONNECTIONS)),
+        "max_receivers_per_stream": int(
+            os.environ.get("MAX_RECEIVERS_PER_STREAM", MAX_RECEIVERS_PER_STREAM)
+        ),
+        "max_cpu_percent": float(os.environ.get("MAX_CPU_PERCENT", MAX_CPU_PERCENT)),
+        "opus_passthrough": os.environ.get("OPUS_PASSTHROUGH", "1") != "0",
+        "encode_threads": int(os.environ.get("ENCODE_THREADS", ENCODE_THREADS)),
+        "jitter_buffer_ms": int(os.environ.get("HTTP_JITTER_BUFFER_MS", JITTER_BUFFER_MS)),
+        "vad_threshold_db": float(os.environ.get("VAD_THRESHOLD_DB", VAD_THRESHOLD_DB)),
+        "vad_hangover_ms": float(os.environ.get("VAD_HANGOVER_MS", VAD_HANGOVER_MS)),
+        "vad_gating": os.environ.get("VAD_GATING", "1") != "0",
+        "recordings_dir": os.environ.get("RECORDINGS_DIR", RECORDINGS_DIR),
+        "record_streams": os.environ.get("RECORD_STREAMS", "0") != "0",
+        "recording_segment_seconds": float(
+            os.environ.get("RECORDING_SEGMENT_SECONDS", SEGMENT_SECONDS)
+        ),
+        "mix_streams": os.environ.get("MIX_STREAMS", "0") != "0",
+        "replay_seconds": float(os.environ.get("REPLAY_SECONDS", REPLAY_SECONDS)),
+        "replay_max_seconds": float(
+            os.environ.get("REPLAY_MAX_SECONDS", REPLAY_MAX_SECONDS)
+        ),
+        "replay_max_bytes": int(os.environ.get("REPLAY_MAX_BYTES", REPLAY_MAX_BYTES)),
+        "replay_retain_seconds": float(
+            os.environ.get("REPLAY_RETAIN_SECONDS", REPLAY_RETAIN_SECONDS)
+        ),
+        "stream_idle_timeout": float(
+            os.environ.get("STREAM_IDLE_TIMEOUT", STREAM_IDLE_TIMEOUT)
+        ),
+    }
+    # WORKERS=N shards streams over N processes behind one signaling front
+    workers = int(os.environ.get("WORKERS", "1"))
+    if workers > 1:
+        if options["mix_streams"]:
+            logger.warning("MIX_STREAMS only mixes the senders within each worker")
+        server = ShardedFront(workers, run_worker, options)
+    else:
+        server = VoiceStreamingServer(**options)
     try:
         asyncio.run(server.run_server())
     except KeyboardInterrupt: